@@ -67,50 +67,32 @@ class Borehole:
         c: direction of cosines at measurements points which point downwards
         """
 
-        npts = ldepth.size
-        # the x,y and z coordinates are initially a matrix which contains as much 0 as the number of measurement points
-        # we can see the c value as the combination of the three cartesian coordinates in unitary form
-        x = np.zeros((npts, 1))
-        y = np.zeros((npts, 1))
-        z = np.zeros((npts, 1))
-        c = np.zeros((npts, 3))
-
+        ldepth = np.asarray(ldepth, dtype=np.float64).flatten()
         depthBH = np.append(np.array([[0]]), np.cumsum(np.sqrt(np.sum(np.diff(fdata, n=1, axis=0) ** 2, axis=1))))
 
         # Knowing that de BH's depth is a matrix which contains the distance between every points of fdata, and that
-        # ldepth contains the points where the data was taken,we need to first make sure that every points taken in
-        # charge by ldepth is in the range of the BH's depth.  As a matter of fact, we verify if each points of ldepth
-        # is contained in between the volume (i.e. between X and Xmax and the same for Y and Z).  If so, we take the
-        # closest point under our point of interest (i.e. i2[0]) and the closest point above our point of interest
-        # (i.e. i1[-1]). So you can anticipate that these points will change for every index of the ldepth vector.
-
-        for n in range(npts):
-            i1, = np.nonzero(ldepth[n] >= depthBH)
-            i2, = np.nonzero(ldepth[n] < depthBH)
-            if i1.size == 0 or i2.size == 0:
-                x = np.zeros((npts, 1))
-                y = np.zeros((npts, 1))
-                z = np.zeros((npts, 1))
-                c = np.zeros((npts, 3))
-                raise ValueError('Depth data outside trajectory range')
-            i1 = i1[-1]
-            i2 = i2[0]
-
-            # Here we calculate the distance between the points which have the same index than the closest points above
-            # and under
-            d = np.sqrt(np.sum((fdata[i2, :] - fdata[i1, :]) ** 2))
-            l = (fdata[i2, :] - fdata[i1, :]) / d
-            # the l value represents the direction cosine for every dimension
-
-            d2 = ldepth[n] - depthBH[i1]
-
-            x[n] = fdata[i1, 0] + d2 * l[0]
-            y[n] = fdata[i1, 1] + d2 * l[1]
-            z[n] = fdata[i1, 2] + d2 * l[2]
-            c[n, :] = l
-
-            # We represent the ldepth's point of interest coordinates by adding the direction cosine of every dimension
-            # to the closest upper point's coordinates
+        # ldepth contains the points where the data was taken, we take for each point of ldepth the closest point
+        # above (i1, depthBH[i1] <= ldepth) and the closest point under (i2 = i1 + 1, depthBH[i2] > ldepth).
+        # All points must be within the range of the BH's depth.
+
+        i1 = np.searchsorted(depthBH, ldepth, side='right') - 1
+        outside = np.logical_or(i1 < 0, i1 >= depthBH.size - 1)
+        if np.any(outside):
+            raise ValueError('Depth data outside trajectory range: ' +
+                             ', '.join(['{0:g}'.format(d) for d in ldepth[outside]]))
+        i2 = i1 + 1
+
+        # c holds the direction cosines of the segments containing the points
+        v = fdata[i2, :] - fdata[i1, :]
+        c = v / np.sqrt(np.sum(v ** 2, axis=1)).reshape(-1, 1)
+
+        # We represent the ldepth's point of interest coordinates by adding the direction cosine of every dimension
+        # to the closest upper point's coordinates
+        d2 = (ldepth - depthBH[i1]).reshape(-1, 1)
+        x = fdata[i1, 0].reshape(-1, 1) + d2 * c[:, 0].reshape(-1, 1)
+        y = fdata[i1, 1].reshape(-1, 1) + d2 * c[:, 1].reshape(-1, 1)
+        z = fdata[i1, 2].reshape(-1, 1) + d2 * c[:, 2].reshape(-1, 1)
+
         return x, y, z, c
 
 
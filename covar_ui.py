@@ -21,8 +21,8 @@ along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 import sys
 from PyQt5 import QtGui, QtWidgets, QtCore
-from model import Model
-from mog import Mog
+from model import Model, ModelDataset
+from mog import Mog, fingerprint
 import covar
 import database
 import utils_ui
@@ -54,6 +54,8 @@ class CovarUI(QtWidgets.QFrame):
     data = None  # holds the model's data so that it does not need to be computed
     # more than once
     idata = None  # idem.
+    dataset = None  # ModelDataset of the selected mogs, data and idata are taken from it
+    rays_key = None  # dataset (id & version) & grid for which L was computed
     L = None  # ray matrix
     Cd = None  # experimental covariance
     xc = None  # grid's centers
@@ -774,10 +776,21 @@ class CovarUI(QtWidgets.QFrame):
         type_ = type_dict[self.T_and_A_combo.currentIndex()]
 
         if self.mogs_list.currentRow() != -1:
-            self.data, self.idata = Model.getModelData(self.model, selectedMogs, type_, vlim=vlim)
+            if self.dataset is None or self.dataset.model is not self.model:
+                self.dataset = ModelDataset(self.model)
+            self.dataset.select(selectedMogs, type_, vlim)
+            self.data = self.dataset.data
+            self.idata = self.dataset.idata
             self.rays_no_label.setText(str(self.data.shape[0]))
-            self.loadRays()
-            self.computeCd()
+
+            # rays and experimental covariance are computed again only if data or grid have changed
+            rays_key = (id(self.dataset), self.dataset.version, self.ellip_veloc_checkbox.isChecked(),
+                        self.curv_rays_combo.currentIndex(),
+                        fingerprint(self.temp_grid.grx, self.temp_grid.gry, self.temp_grid.grz))
+            if rays_key != self.rays_key:
+                self.loadRays()
+                self.computeCd()
+                self.rays_key = rays_key
 
     def loadRays(self):
         aniso = self.ellip_veloc_checkbox.isChecked()
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Copyright 2016 Bernard Giroux
+    email: bernard.giroux@ete.inrs.ca
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+    SEG-Y input/output.  The compiled reader cutils.segy is used if it has
+    been built (python setup.py build_ext --inplace), the pure NumPy reader
+    cutils.npsegy otherwise; both have the same interface.
+"""
+
+try:
+    from .segy import read_segy, iter_segy, Segy_data, Segy_index, build_segy_index, load_segy_index
+except ImportError:
+    from .npsegy import read_segy, iter_segy, Segy_data, Segy_index, build_segy_index, load_segy_index
+
+from .npsegy import read_segy_text, write_segy, scaling, TIME_UNITS_RE
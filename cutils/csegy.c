@@ -1,9 +1,16 @@
 
 #include <inttypes.h>
+#include <math.h>
 #include <stdio.h>
+#include <stdlib.h>
 
 #include "csegy.h"
 
+#define SEGY_TXT_HDR 3200L     // size of textual file header
+#define SEGY_BIN_HDR 400L      // size of binary file header
+#define SEGY_TR_HDR 240L       // size of trace header
+#define SEGY_HDR_BLOCK 1048576L  // max number of bytes read at once when scanning trace headers
+
 
 /* returns true if on big endian, else false */
 int IsBigEndian() { // grabed at http://unixpapa.com/incnote/byteorder.html
@@ -24,6 +31,26 @@ void SwapFloat(float *x) {
     *y=(((*y>>24)&0xff) | ((*y&0xff)<<24) | ((*y>>8)&0xff00) | ((*y&0xff00)<<8));
 }
 
+void Swap2BytesArray(int16_t *x, size_t n) {
+    for ( size_t i=0; i<n; ++i )
+        Swap2Bytes(&x[i]);
+}
+
+void Swap4BytesArray(int32_t *x, size_t n) {
+    for ( size_t i=0; i<n; ++i )
+        Swap4Bytes(&x[i]);
+}
+
+/* decode big endian words from memory, whatever the byte order of the host */
+int16_t get_int16(const unsigned char *p) {
+    return (int16_t)(((uint16_t)p[0] << 8) | (uint16_t)p[1]);
+}
+
+int32_t get_int32(const unsigned char *p) {
+    return (int32_t)(((uint32_t)p[0] << 24) | ((uint32_t)p[1] << 16) |
+                     ((uint32_t)p[2] << 8) | (uint32_t)p[3]);
+}
+
 void ibm2float(int32_t from[], int32_t to[], size_t n, int endian) {
     /***********************************************************************
      * ibm2float - convert between 32 bit IBM and IEEE floating numbers
@@ -127,6 +154,83 @@ Author: John Stockwell,  2005
 	}
 }
 
+/* read the 400-byte binary header in buf */
+int read_bin_header(FILE *fid, unsigned char *buf) {
+    if ( fseek(fid, SEGY_TXT_HDR, SEEK_SET) == -1 ) {
+        return 2;
+    }
+    if ( fread(buf, 1, SEGY_BIN_HDR, fid) != SEGY_BIN_HDR ) {
+        return 2;
+    }
+    return 0;
+}
+
+/* number of samples per trace, sample format and number of extended textual headers */
+int read_segy_info(FILE *fid, int *nsamples, short *format, int *bytesPerSample, int *nextended) {
+    unsigned char buf[SEGY_BIN_HDR];
+
+    if ( read_bin_header(fid, buf) != 0 ) {
+        return 2;
+    }
+    *nsamples = (uint16_t)get_int16(buf+20);   // bytes 3221-3222
+    *format = get_int16(buf+24);               // bytes 3225-3226
+    *nextended = get_int16(buf+304);           // bytes 3505-3506
+    if ( *nextended < 0 ) {
+        *nextended = 0;  // variable number of extended headers not handled
+    }
+
+    switch( *format ) {
+        case 1:
+        case 2:
+        case 5:
+            *bytesPerSample = 4;
+            break;
+        case 3:
+            *bytesPerSample = 2;
+            break;
+        case 8:
+            *bytesPerSample = 1;
+            break;
+        default:
+            return 2;
+    }
+    return 0;
+}
+
+/* trace numbers held in traceNo, or all traces in file if traceNo is empty (NULL on error) */
+int32_t* get_traces_no(FILE *fid, PyObject* traceNo, long data_start, long trace_size, Py_ssize_t *ntraces) {
+    int32_t* traces_no;
+
+    *ntraces = PyList_Size(traceNo);
+    if ( *ntraces != 0 ) {
+        traces_no = (int32_t*)malloc(*ntraces*sizeof(int32_t));
+
+        for ( Py_ssize_t n=0; n<*ntraces; ++n) {
+            PyObject* tn = PyList_GetItem(traceNo, n);
+            if ( PyLong_Check(tn)==0 ) {
+                free(traces_no);
+                return NULL;
+            }
+            traces_no[n] = (int32_t)PyLong_AsLong(tn);
+        }
+    } else {
+        // we must read for all traces
+
+        fseek(fid, 0L, SEEK_END);
+        long filesize = ftell(fid);
+        fseek(fid, 0L, SEEK_SET);
+
+        *ntraces = (filesize - data_start) / trace_size;
+        if ( *ntraces < 0 ) {
+            *ntraces = 0;
+        }
+        traces_no = (int32_t*)malloc((*ntraces+1)*sizeof(int32_t));
+        for (int32_t n=0; n<*ntraces; ++n)
+            traces_no[n] = n;
+    }
+    return traces_no;
+}
+
 int read_segy_b_header(const char* filename, PyObject* bh) {
 
     const char *fnames[] = {  // follows CWP/SU naming convention for bytes 3201-3260
@@ -169,134 +273,65 @@ int read_segy_b_header(const char* filename, PyObject* bh) {
     const short word_length[] = {
         4, 4, 4, 2, 2, 2, 2, 2, 2, 2,
         2, 2, 2, 2, 2, 2, 2, 2, 2, 2,
-        2, 2, 2, 2, 2, 2, 2
+        2, 2, 2, 2, 2, 2, 2,
+        2, 2, 2
     };
 
     const short signed_word[] = {
         1, 1, 1, 1, 1, 0, 0, 0, 0, 1,
         1, 1, 1, 1, 1, 1, 1, 1, 1, 1,
-        1, 1, 1, 1, 0, 1, 1
+        1, 1, 1, 1, 0, 1, 1,
+        0, 1, 1
     };
 
+    unsigned char buf[SEGY_BIN_HDR];
     FILE *fid;
 
     //  open file
-    fid = fopen(filename, "r");
+    fid = fopen(filename, "rb");
 
     if ( fid==NULL ) {
         return 1;
     }
 
     if ( !PyDict_Check(bh) ) {
-        return 2;
-    }
-    PyDict_Clear(bh);
-
-    int bt = IsBigEndian();
-
-    int16_t *stmp = (int16_t *)malloc(sizeof(int16_t));
-    int32_t *itmp = (int32_t *)malloc(sizeof(int32_t));
-    double *dtmp = (double *)malloc(sizeof(double));
-
-    long offset = 3200L;
-    long val;
-    for ( size_t nf=0; nf<27; ++nf ) {
-
-        if ( fseek(fid, offset, SEEK_SET) == -1 ) {
-            fclose(fid);
-            return 2;
-        }
-
-        switch ( word_length[ nf ] ) {
-            case 2:
-                fread(stmp, 2, 1, fid);
-                if ( bt == 0 ) {
-                    Swap2Bytes( stmp );
-                }
-                if ( signed_word[nf] ) {
-                    val = *stmp;
-                } else {
-                    uint16_t utmp;
-                    memcpy(&utmp, stmp, 2);
-                    val = utmp;
-                }
-                if ( PyDict_SetItemString(bh, fnames[nf], PyLong_FromLong(val))==-1 )
-                    return 2;
-                break;
-            case 4:
-                fread(itmp, 4, 1, fid);
-                if ( bt == 0 ) {
-                    Swap4Bytes( itmp );
-                }
-                if ( signed_word[nf] ) {
-                    val = *itmp;
-                } else {
-                    uint32_t utmp;
-                    memcpy(&utmp, itmp, 4);
-                    val = utmp;
-                }
-                if ( PyDict_SetItemString(bh, fnames[nf], PyLong_FromLong(val))==-1 )
-                    return 2;
-                break;
-            default:
-                return 2; //This should never happen!
-        }
-
-        offset += word_length[nf];
-    }
-
-    // get SEG Y Format revision number
-
-    if ( fseek(fid, 3500L, SEEK_SET) == -1 ) {
         fclose(fid);
         return 2;
     }
-    fread(stmp, 2, 1, fid);
-    if ( bt == 0 ) {
-        Swap2Bytes( stmp );
-    }
-    uint16_t utmp;
-    memcpy(&utmp, stmp, 2);
-    val = utmp;
-    if ( PyDict_SetItemString(bh, fnames[27], PyLong_FromLong(val))==-1 )
-        return 2;
-
-    // get Fixed length trace flag
 
-    if ( fseek(fid, 3502L, SEEK_SET) == -1 ) {
+    // the whole binary header is read at once, fields are decoded from memory
+    if ( read_bin_header(fid, buf) != 0 ) {
         fclose(fid);
         return 2;
     }
+    fclose(fid);
 
-    fread(stmp, 2, 1, fid);
-    if ( bt == 0 ) {
-        Swap2Bytes( stmp );
-    }
-    val = *stmp;
-    if ( PyDict_SetItemString(bh, fnames[28], PyLong_FromLong(val))==-1 )
-        return 2;
+    PyDict_Clear(bh);
 
-    // get Number of 3200-byte, Extended Textual File Header records
+    long offset = 0L;
+    long val;
+    for ( size_t nf=0; nf<30; ++nf ) {
 
-    if ( fseek(fid, 3504L, SEEK_SET) == -1 ) {
-        fclose(fid);
-        return 2;
-    }
+        if ( nf == 27 ) {
+            offset = 300L;   // SEG Y Format revision number is at byte 3501
+        }
 
-    fread(stmp, 2, 1, fid);
-    if ( bt == 0 ) {
-        Swap2Bytes( stmp );
-    }
-    val = *stmp;
-    if ( PyDict_SetItemString(bh, fnames[29], PyLong_FromLong(val))==-1 )
-        return 2;
+        if ( word_length[nf] == 2 ) {
+            val = signed_word[nf] ? (long)get_int16(buf+offset) : (long)(uint16_t)get_int16(buf+offset);
+        } else {
+            val = signed_word[nf] ? (long)get_int32(buf+offset) : (long)(uint32_t)get_int32(buf+offset);
+        }
 
-    fclose(fid);
+        PyObject* pyval = PyLong_FromLong(val);
+        if ( pyval==NULL || PyDict_SetItemString(bh, fnames[nf], pyval)==-1 ) {
+            Py_XDECREF(pyval);
+            return 2;
+        }
+        Py_DECREF(pyval);
 
+        offset += word_length[nf];
+    }
 
-    free(stmp);
-    free(itmp);
-    free(dtmp);
     return 0;
 }
 
@@ -407,7 +442,6 @@ int read_segy_tr_headers(const char* filename,
         "smunit"   // 86 - source measurement units
     };
     const short NFIELDS_SEG = 86;
-    char **fnames;
 
     const short word_length_seg[] = {
         4, 4, 4, 4, 4, 4, 4, 2, 2, 2,
@@ -416,187 +450,71 @@ int read_segy_tr_headers(const char* filename,
         2, 2, 2, 2, 2, 2, 2, 2, 2, 2,
         2, 2, 2, 2, 2, 2, 2, 2, 2, 2,
         2, 2, 2, 2, 2, 2, 2, 2, 2, 2,
+        2, 2, 2, 2, 2, 2, 2, 2, 2, 2,
         2, 4, 4, 4, 4, 4, 2, 2, 6, 2,
         2, 2, 2, 6, 6, 2
     };
-    short *word_length;
 
-    FILE *fid;
+    const char **fnames = NULL;
+    short *word_length = NULL;
+    int16_t *fields_no = NULL;
+    long *fields_offset = NULL;
+    int32_t *traces_no = NULL;
+    void **thData = NULL;
+    unsigned char *buf = NULL;
+    int retval = 2;
+
+    // make sure th is a dict and we have lists as input
+    if ( !PyDict_Check(th) || PyList_Check(traceNo) == 0 || PyList_Check(fields) == 0 ||
+         PyList_Check(thDict) == 0 || PyList_Check(wordLength) == 0 ) {
+        return 2;
+    }
 
-    int bt = IsBigEndian();
+    FILE *fid;
 
     //  open file
-    fid = fopen(filename, "r");
+    fid = fopen(filename, "rb");
 
     if ( fid==NULL ) {
         return 1;
     }
 
-    // make sure th is a dict
-    if ( !PyDict_Check(th) ) {
-        return 2;
-    }
-    PyDict_Clear(th);
-
-    int16_t *stmp = (int16_t *)malloc(sizeof(int16_t));
-    int32_t *itmp = (int32_t *)malloc(sizeof(int32_t));
-    double *dtmp = (double *)malloc(sizeof(double));
-    float *ftmp = (float *)malloc(sizeof(float));
-
-
-    // read in some info
-    // read in number of samples per data trace
-    if ( fseek(fid, 3220, SEEK_SET)  == -1 ) {
-        fclose(fid);
-        free(stmp);
-        free(itmp);
-        free(dtmp);
-        free(ftmp);
-        return 2;
-    }
-
-    fread(stmp, 2, 1, fid);
-    if ( bt == 0 ) {
-        // we have read a big endian word, we're on a little endian machine
-        Swap2Bytes( stmp );
-    }
-    int nsamples = *stmp;
-
-    // read in data sample format code
-    if ( fseek(fid, 3224, SEEK_SET)  == -1 ) {
-        fclose(fid);
-        free(stmp);
-        free(itmp);
-        free(dtmp);
-        free(ftmp);
-        return 2;
-    }
-    fread(stmp, 2, 1, fid);
-    if ( bt == 0 ) {
-        // we have read a big endian word, we're on a little endian machine
-        Swap2Bytes( stmp );
-    }
-    int bytesPerSample;
-    switch( *stmp ) {
-        case 1:
-        case 2:
-        case 5:
-            bytesPerSample = 4;
-            break;
-        case 3:
-            bytesPerSample = 2;
-            break;
-        case 8:
-            bytesPerSample = 1;
-            break;
-        default:
-            return 2;
-    }
-
-    // get Number of 3200-byte, Extended Textual File Header records
-    if ( fseek(fid, 3502, SEEK_SET) == -1 ) {
-        fclose(fid);
-        free(stmp);
-        free(itmp);
-        free(dtmp);
-        free(ftmp);
-        return 2;
-    }
-    fread(stmp, 2, 1, fid);
-    if ( bt == 0 ) {
-        Swap2Bytes( stmp );
-    }
-    int nextended = *stmp;
-
-
-    // make sure traceNo is a list
-    if ( PyList_Check(traceNo) == 0 ) {
-        free(stmp);
-        free(itmp);
-        free(dtmp);
-        free(ftmp);
-        return 2;
-    }
-    int32_t* traces_no;
-    Py_ssize_t ntraces = PyList_Size(traceNo);
-    if ( ntraces != 0 ) {
-        traces_no = (int32_t*)malloc(ntraces*sizeof(int32_t));
-
-        for ( Py_ssize_t n=0; n<ntraces; ++n) {
-            PyObject* tn = PyList_GetItem(traceNo, n);
-            if ( PyLong_Check(tn)==0 ) {
-                free(stmp);
-                free(itmp);
-                free(dtmp);
-                free(ftmp);
-                return 2;
-            }
-            traces_no[n] = (int32_t)PyLong_AsLong(tn);
-        }
-    } else {
-        // we must read for all traces
-
-        fseek(fid, 0L, SEEK_END);
-        long filesize = ftell(fid);
-        fseek(fid, 0L, SEEK_SET);
+    int bt = IsBigEndian();
 
-        filesize -= 3600L + nextended*3200L;
-        ntraces = filesize / ( 240 + bytesPerSample*nsamples );
-        traces_no = (int32_t*)malloc(ntraces*sizeof(int32_t));
-        for (int32_t n=0; n<ntraces; ++n)
-            traces_no[n] = n;
+    int nsamples, bytesPerSample, nextended;
+    short format;
+    if ( read_segy_info(fid, &nsamples, &format, &bytesPerSample, &nextended) != 0 ) {
+        goto cleanup;
     }
+    long trace_size = SEGY_TR_HDR + (long)bytesPerSample*nsamples;
+    long data_start = SEGY_TXT_HDR + SEGY_BIN_HDR + nextended*SEGY_TXT_HDR;
 
-    if ( PyList_Check(thDict) == 0 || PyList_Check(wordLength) == 0 ) {
-        free(stmp);
-        free(itmp);
-        free(dtmp);
-        free(ftmp);
-        return 2;
+    Py_ssize_t ntraces;
+    traces_no = get_traces_no(fid, traceNo, data_start, trace_size, &ntraces);
+    if ( traces_no==NULL ) {
+        goto cleanup;
     }
 
     // check if user gave a dict
     Py_ssize_t NFIELDS = PyList_Size(thDict);
     if ( NFIELDS != 0 ) {
-        Py_ssize_t nwordLength = PyList_Size(wordLength);
-
-        if ( NFIELDS != nwordLength ) {
-            free(stmp);
-            free(itmp);
-            free(dtmp);
-            free(ftmp);
-            return 2;
+        if ( NFIELDS != PyList_Size(wordLength) ) {
+            goto cleanup;
         }
 
-        fnames = (char **)malloc(sizeof(char*)*NFIELDS);
+        fnames = (const char **)malloc(sizeof(char*)*NFIELDS);
         word_length = (short *)malloc(sizeof(short)*NFIELDS);
 
         for ( Py_ssize_t n=0; n<NFIELDS; ++n) {
             PyObject* tn = PyList_GetItem(thDict, n);
-            if ( PyUnicode_Check(tn)==0 ) {
-                free(stmp);
-                free(itmp);
-                free(dtmp);
-                free(ftmp);
-                return 2;
+            if ( PyUnicode_Check(tn)==0 || PyUnicode_KIND(tn) != PyUnicode_1BYTE_KIND ) {
+                goto cleanup;
             }
-            if ( PyUnicode_KIND(tn) != PyUnicode_1BYTE_KIND ) {
-                free(stmp);
-                free(itmp);
-                free(dtmp);
-                free(ftmp);
-                return 2;
-            }
-            fnames[n] = (char *)malloc(sizeof(char)*(1+strlen(PyUnicode_1BYTE_DATA(tn))));
-            strcpy(fnames[n], PyUnicode_1BYTE_DATA(tn));
+            fnames[n] = (const char *)PyUnicode_1BYTE_DATA(tn);  // thDict outlives this call
 
             tn = PyList_GetItem(wordLength, n);
             if ( PyLong_Check(tn)==0 ) {
-                free(stmp);
-                free(itmp);
-                free(dtmp);
-                free(ftmp);
-                return 2;
+                goto cleanup;
             }
             word_length[n] = (short)PyLong_AsLong(tn);
         }
@@ -604,26 +522,16 @@ int read_segy_tr_headers(const char* filename,
     } else {
         // we use the "standard" dict
         NFIELDS = NFIELDS_SEG;
-        fnames = (char **)malloc(sizeof(char*)*NFIELDS);
+        fnames = (const char **)malloc(sizeof(char*)*NFIELDS);
         word_length = (short *)malloc(sizeof(short)*NFIELDS);
         for ( Py_ssize_t n = 0; n<NFIELDS; ++n ) {
-            fnames[n] = (char *)malloc(sizeof(char)*(1+strlen(fnames_seg[n])));
-            strcpy(fnames[n], fnames_seg[n]);
+            fnames[n] = fnames_seg[n];
             word_length[n] = word_length_seg[n];
         }
     }
 
-    if ( PyList_Check(fields) == 0 ) {
-        free(stmp);
-        free(itmp);
-        free(dtmp);
-        free(ftmp);
-        return 2;
-    }
-
     // fields to read
     Py_ssize_t nfields = PyList_Size(fields);
-    int16_t* fields_no=NULL;
     if ( nfields==1 ) {
         PyObject* tn = PyList_GetItem(fields, 0);
 
@@ -638,356 +546,260 @@ int read_segy_tr_headers(const char* filename,
                 fields_no = (int16_t*)malloc(sizeof(int16_t));
                 int found = 0;
                 for ( Py_ssize_t n = 0; n<NFIELDS; ++n ) {
-                    if ( strcmp(PyUnicode_1BYTE_DATA(tn), fnames[n])==0 ) {
+                    if ( strcmp((const char *)PyUnicode_1BYTE_DATA(tn), fnames[n])==0 ) {
                         fields_no[0] = n;
                         found = 1;
                         break;
                     }
                 }
                 if ( found==0 ) {
-                    free(fields_no);
-                    free(stmp);
-                    free(itmp);
-                    free(dtmp);
-                    free(ftmp);
-                    return 2;
+                    goto cleanup;
                 }
             }
         } else if ( PyLong_Check(tn)!=0 ) {
             if ( PyLong_AsLong(tn)<NFIELDS && PyLong_AsLong(tn)>=0 ) {
-                nfields = 1;
-                fields_no = (int16_t*)malloc(nfields*sizeof(int16_t));
+                fields_no = (int16_t*)malloc(sizeof(int16_t));
                 fields_no[0] = (int16_t)PyLong_AsLong(tn);
             } else {
-                free(stmp);
-                free(itmp);
-                free(dtmp);
-                free(ftmp);
-                return 2;
+                goto cleanup;
             }
         } else {
-            free(stmp);
-            free(itmp);
-            free(dtmp);
-            free(ftmp);
-            return 2;
+            goto cleanup;
         }
 
     } else {
-        fields_no = (int16_t*)malloc(nfields*sizeof(int16_t));
+        fields_no = (int16_t*)malloc((nfields+1)*sizeof(int16_t));
         for ( Py_ssize_t n = 0; n<nfields; ++n ) {
             PyObject* tn = PyList_GetItem(fields, n);
 
-            if ( PyUnicode_KIND(tn) != PyUnicode_1BYTE_KIND ) {
-                return 2;
+            if ( PyUnicode_Check(tn)==0 || PyUnicode_KIND(tn) != PyUnicode_1BYTE_KIND ) {
+                goto cleanup;
             }
 
             int found = 0;
             for ( Py_ssize_t nn = 0; nn<NFIELDS; ++nn ) {
-                if ( strcmp(PyUnicode_1BYTE_DATA(tn), fnames[nn])==0 ) {
+                if ( strcmp((const char *)PyUnicode_1BYTE_DATA(tn), fnames[nn])==0 ) {
                     fields_no[n] = nn;
                     found = 1;
                     break;
                 }
             }
             if ( found==0 ) {
-                free(fields_no);
-                free(stmp);
-                free(itmp);
-                free(dtmp);
-                free(ftmp);
-                return 2;
+                goto cleanup;
             }
         }
     }
 
+    // position of the fields within the 240-byte trace header
+    fields_offset = (long*)malloc((nfields+1)*sizeof(long));
+    for ( Py_ssize_t nf=0; nf<nfields; ++nf ) {
+        fields_offset[nf] = 0L;
+        for (int16_t m=0; m<fields_no[nf]; ++m) {
+            fields_offset[nf] += word_length[m]==5 ? 4 : word_length[m];  // we use 5 for 4-byte ibm float
+        }
+        if ( fields_offset[nf] + (word_length[fields_no[nf]]==5 ? 4 : word_length[fields_no[nf]]) > SEGY_TR_HDR ) {
+            goto cleanup;
+        }
+    }
+
     // create arrays to hold the data
 
-    import_array();  // to use PyArray_SimpleNewFromData
+    // to use PyArray_SimpleNew; import_array() would return NULL from this int function
+    if ( _import_array() < 0 ) {
+        retval = 3;
+        goto cleanup;
+    }
 
-    void** thData = (void**)malloc(nfields*sizeof(void*));
-    PyObject** thPyData = (PyObject**)malloc(nfields*sizeof(PyObject*));
+    thData = (void**)malloc((nfields+1)*sizeof(void*));
     npy_intp dims[] = {(npy_intp)ntraces};
     for ( Py_ssize_t nf=0; nf<nfields; ++nf ) {
+        PyObject* thPyData;
         switch ( word_length[ fields_no[nf] ] ) {
             case 2:
-                thData[nf] = (int16_t*)malloc(ntraces*sizeof(int16_t));
-                thPyData[nf] = PyArray_SimpleNewFromData(1, dims, NPY_INT16, thData[nf]);
-                PyArray_ENABLEFLAGS((PyArrayObject*)thPyData[nf], NPY_ARRAY_OWNDATA);
+                thPyData = PyArray_SimpleNew(1, dims, NPY_INT16);
                 break;
             case 4:
-                thData[nf] = (int32_t*)malloc(ntraces*sizeof(int32_t));
-                thPyData[nf] = PyArray_SimpleNewFromData(1, dims, NPY_INT32, thData[nf]);
-                PyArray_ENABLEFLAGS((PyArrayObject*)thPyData[nf], NPY_ARRAY_OWNDATA);
+                thPyData = PyArray_SimpleNew(1, dims, NPY_INT32);
                 break;
             case 5:
-                thData[nf] = (float*)malloc(ntraces*sizeof(float));
-                thPyData[nf] = PyArray_SimpleNewFromData(1, dims, NPY_FLOAT32, thData[nf]);
-                PyArray_ENABLEFLAGS((PyArrayObject*)thPyData[nf], NPY_ARRAY_OWNDATA);
+                thPyData = PyArray_SimpleNew(1, dims, NPY_FLOAT32);
                 break;
             case 6:
-                thData[nf] = (double*)malloc(ntraces*sizeof(double));
-                thPyData[nf] = PyArray_SimpleNewFromData(1, dims, NPY_FLOAT64, thData[nf]);
-                PyArray_ENABLEFLAGS((PyArrayObject*)thPyData[nf], NPY_ARRAY_OWNDATA);
+                thPyData = PyArray_SimpleNew(1, dims, NPY_FLOAT64);
                 break;
             default:
-                return 2;
+                goto cleanup;
         }
-        if ( PyDict_SetItemString(th, fnames[fields_no[nf]], thPyData[nf])==-1 )
-            return 2;
+        if ( thPyData==NULL ) {
+            goto cleanup;
+        }
+        thData[nf] = PyArray_DATA((PyArrayObject*)thPyData);
+        if ( PyDict_SetItemString(th, fnames[fields_no[nf]], thPyData)==-1 ) {
+            Py_DECREF(thPyData);
+            goto cleanup;
+        }
+        Py_DECREF(thPyData);  // th holds the reference
     }
 
-    long offset, offset2, ioff;
-    for ( size_t n=0; n<ntraces; ++n ) {
-
-        offset = 3600L + nextended*3200 + (traces_no[n]*(240+(bytesPerSample*nsamples)));
-
-        for ( size_t nf=0; nf<nfields; ++nf ) {
-
-            offset2 = offset;
-            for (size_t m=0; m<fields_no[nf]; ++m) {
-                ioff = word_length[m]==5 ? 4 : word_length[m];  // we use 5 for 4-byte ibm float
-                offset2 += ioff;
-            }
-
-            if ( fseek(fid, offset2, SEEK_SET) == -1 ) {
-                fclose(fid);
-                free(fields_no);
-                free(stmp);
-                free(itmp);
-                free(dtmp);
-                free(ftmp);
-                return 2;
-            }
-
-            switch ( word_length[ fields_no[nf] ] ) {
-                case 2:
-                    fread(stmp, 2, 1, fid);
-
-                    if ( bt == 0 ) {
-                        Swap2Bytes( stmp );
-                    }
-
-                    memcpy(((int16_t*)thData[nf])+n, stmp, 2);
-
-                    break;
-                case 4:
-                    fread(itmp, 4, 1, fid);
-
-                    if ( bt == 0 ) {
-                        Swap4Bytes( itmp );
-                    }
-
-                    memcpy(((int32_t *)thData[nf])+n, itmp, 4);
+    // Headers are read by blocks of consecutive traces.  When traces are
+    // short, the samples in between headers are read along to avoid a seek
+    // per trace, otherwise only the 240 bytes of each header are read.
+    Py_ssize_t nblock = SEGY_HDR_BLOCK / trace_size;
+    if ( nblock < 1 ) {
+        nblock = 1;
+    }
+    buf = (unsigned char *)malloc((nblock-1)*trace_size + SEGY_TR_HDR);
 
-                    break;
-                case 5:
-                    fread(itmp, 4, 1, fid);
-                    ibm2float(itmp, (int32_t *)ftmp, 1, bt);
+    Py_ssize_t n = 0;
+    while ( n < ntraces ) {
 
-                    memcpy(((float *)thData[nf])+n, ftmp, sizeof(float));
+        Py_ssize_t k = 1;
+        while ( n+k < ntraces && k < nblock && traces_no[n+k] == traces_no[n]+k ) {
+            ++k;
+        }
 
-                    break;
-                case 6:
-                    fread(itmp, 4, 1, fid);
-                    fread(stmp, 2, 1, fid);
+        long offset = data_start + traces_no[n]*trace_size;
+        size_t nbytes = (k-1)*trace_size + SEGY_TR_HDR;
 
-                    if ( bt == 0 ) {
-                        Swap4Bytes( itmp );
-                        Swap2Bytes( stmp );
-                    }
+        if ( fseek(fid, offset, SEEK_SET) == -1 || fread(buf, 1, nbytes, fid) != nbytes ) {
+            goto cleanup;
+        }
 
-                    *dtmp = *itmp * pow( 10.0, *stmp );
+        for ( Py_ssize_t m=0; m<k; ++m ) {
+            unsigned char *hdr = buf + m*trace_size;
 
-                    memcpy(((double *)thData[nf])+n, dtmp, sizeof(double));
+            for ( Py_ssize_t nf=0; nf<nfields; ++nf ) {
+                unsigned char *ptr = hdr + fields_offset[nf];
 
-                    break;
-                default:
-                    fclose(fid);
-                    free(fields_no);
-                    free(stmp);
-                    free(itmp);
-                    free(dtmp);
-                    free(ftmp);
-                    return 2;
+                switch ( word_length[ fields_no[nf] ] ) {
+                    case 2:
+                        memcpy(((int16_t*)thData[nf])+n+m, ptr, 2);
+                        break;
+                    case 4:
+                    case 5:
+                        memcpy(((int32_t*)thData[nf])+n+m, ptr, 4);
+                        break;
+                    case 6:
+                        ((double*)thData[nf])[n+m] = get_int32(ptr) * pow( 10.0, get_int16(ptr+4) );
+                        break;
+                }
             }
         }
+        n += k;
     }
 
-    fclose(fid);
+    // words were copied as read (big endian), now convert them all at once
+    for ( Py_ssize_t nf=0; nf<nfields; ++nf ) {
+        switch ( word_length[ fields_no[nf] ] ) {
+            case 2:
+                if ( bt == 0 ) {
+                    Swap2BytesArray( (int16_t*)thData[nf], ntraces );
+                }
+                break;
+            case 4:
+                if ( bt == 0 ) {
+                    Swap4BytesArray( (int32_t*)thData[nf], ntraces );
+                }
+                break;
+            case 5:
+                ibm2float( (int32_t*)thData[nf], (int32_t*)thData[nf], ntraces, bt );
+                break;
+        }
+    }
 
+    retval = 0;
+
+cleanup:
+    fclose(fid);
+    free(buf);
+    free(thData);
+    free(fields_offset);
     free(fields_no);
-    free(stmp);
-    free(itmp);
-    free(dtmp);
-    free(ftmp);
-    return 0;
+    free(word_length);
+    free(fnames);
+    free(traces_no);
+    return retval;
 }
 
 
-PyObject* read_segy_data(const char* filename, PyObject* traceNo) {
+
+/* number of samples per trace, sample format, offset of first trace and number of traces in file */
+int read_segy_file_info(const char* filename, int *nsamples, short *format, int *bytesPerSample,
+                        long *data_start, long *ntraces) {
 
     FILE *fid;
+    int nextended;
 
     //  open file
-    fid = fopen(filename, "r");
+    fid = fopen(filename, "rb");
 
     if ( fid==NULL ) {
-        return PyLong_FromLong(1);
+        return 1;
     }
 
-    int bt = IsBigEndian();
-
-    int16_t *stmp = (int16_t *)malloc(sizeof(int16_t));
-    int32_t *itmp = (int32_t *)malloc(sizeof(int32_t));
-
-    // read in some info
-    // read in number of samples per data trace
-    if ( fseek(fid, 3220, SEEK_SET)  == -1 ) {
+    if ( read_segy_info(fid, nsamples, format, bytesPerSample, &nextended) != 0 ) {
         fclose(fid);
-        free(stmp);
-        free(itmp);
-        return PyLong_FromLong(2);
-    }
-
-    fread(stmp, 2, 1, fid);
-    if ( bt == 0 ) {
-        // we have read a big endian word, we're on a little endian machine
-        Swap2Bytes( stmp );
+        return 2;
     }
-    int nsamples = *stmp;
+    *data_start = SEGY_TXT_HDR + SEGY_BIN_HDR + nextended*SEGY_TXT_HDR;
 
-    // read in data sample format code
-    if ( fseek(fid, 3224, SEEK_SET)  == -1 ) {
-        fclose(fid);
-        free(stmp);
-        free(itmp);
-        return PyLong_FromLong(2);
-    }
-    fread(stmp, 2, 1, fid);
-    if ( bt == 0 ) {
-        Swap2Bytes( stmp );
-    }
-    short format = *stmp;
-    int bytesPerSample;
-    switch( format ) {
-        case 1:
-        case 2:
-        case 5:
-            bytesPerSample = 4;
-            break;
-        case 3:
-            bytesPerSample = 2;
-            break;
-        case 8:
-            bytesPerSample = 1;
-            break;
-        default:
-            return PyLong_FromLong(2);
-    }
+    fseek(fid, 0L, SEEK_END);
+    long filesize = ftell(fid);
+    fclose(fid);
 
-    // get Number of 3200-byte, Extended Textual File Header records
-    if ( fseek(fid, 3502, SEEK_SET) == -1 ) {
-        fclose(fid);
-        free(stmp);
-        free(itmp);
-        return PyLong_FromLong(2);
-    }
-    fread(stmp, 2, 1, fid);
-    if ( bt == 0 ) {
-        Swap2Bytes( stmp );
+    *ntraces = (filesize - *data_start) / ( SEGY_TR_HDR + (long)(*bytesPerSample)*(*nsamples) );
+    if ( *ntraces < 0 ) {
+        *ntraces = 0;
     }
-    int nextended = *stmp;
+    return 0;
+}
 
 
-    // make sure traceNo is a list
-    if ( PyList_Check(traceNo) == 0 ) {
-        fclose(fid);
-        free(stmp);
-        free(itmp);
-        return PyLong_FromLong(2);
-    }
-    int32_t* traces_no;
-    Py_ssize_t ntraces = PyList_Size(traceNo);
-    if ( ntraces != 0 ) {
-        traces_no = (int32_t*)malloc(ntraces*sizeof(int32_t));
+/*
+ * Read and convert to float the samples of traces listed in traces_no.
+ *
+ * data must hold ntraces x nsamples floats (trace after trace).  The
+ * Python API is not used here, so that this function can be called
+ * without holding the GIL, and concurrently by many threads each
+ * working on its own set of traces.
+ */
+int read_segy_traces(const char* filename, const int32_t* traces_no, size_t ntraces,
+                     int nsamples, short format, int bytesPerSample, long data_start,
+                     float* data) {
 
-        for ( Py_ssize_t n=0; n<ntraces; ++n) {
-            PyObject* tn = PyList_GetItem(traceNo, n);
-            if ( PyLong_Check(tn)==0 ) {
-                free(stmp);
-                free(itmp);
-                return PyLong_FromLong(2);
-            }
-            traces_no[n] = (int32_t)PyLong_AsLong(tn);
-        }
-    } else {
-        // we must read for all traces
+    FILE *fid;
 
-        fseek(fid, 0L, SEEK_END);
-        long filesize = ftell(fid);
-        fseek(fid, 0L, SEEK_SET);
+    //  open file
+    fid = fopen(filename, "rb");
 
-        filesize -= 3600L + nextended*3200L;
-        ntraces = filesize / ( 240 + bytesPerSample*nsamples );
-        traces_no = (int32_t*)malloc(ntraces*sizeof(int32_t));
-        for (int32_t n=0; n<ntraces; ++n)
-            traces_no[n] = n;
+    if ( fid==NULL ) {
+        return 1;
     }
 
-    float* pdata = (float*)malloc(nsamples*ntraces*sizeof(float));
-    npy_intp dims[] = {(npy_intp)ntraces,(npy_intp)nsamples};  // ntraces x nsamples due to memory layout
-    PyObject* data = PyArray_SimpleNewFromData(2, dims, NPY_FLOAT, pdata);
-    PyArray_ENABLEFLAGS((PyArrayObject*)data, NPY_ARRAY_OWNDATA);
-
+    int bt = IsBigEndian();
+    long trace_size = SEGY_TR_HDR + (long)bytesPerSample*nsamples;
 
-    void *ptr;
-    switch ( format ) {
-        case 1:
-        case 2:
-            ptr = (int32_t *) malloc(nsamples*sizeof(int32_t));
-            break;
-        case 3:
-            ptr = (int16_t *) malloc(nsamples*sizeof(int16_t));
-            break;
-        case 5:
-            ptr = (float *) malloc(nsamples*sizeof(float));
-            break;
-        case 8:
-            ptr = (char *) malloc(nsamples*sizeof(char));
-            break;
-        default:
-            fclose(fid);
-            free(stmp);
-            free(itmp);
-            return PyLong_FromLong(2);
+    void *ptr = malloc((size_t)bytesPerSample*nsamples + 1);
+    if ( ptr==NULL ) {
+        fclose(fid);
+        return 2;
     }
 
-    float *fltptr;
-    if ( format == 5 )
-        fltptr = ptr;
-    else
-        fltptr = malloc(nsamples*sizeof(float));
-
-    long offset;
-
     for ( size_t n=0; n<ntraces; ++n ) {
 
-        offset = 3600L + nextended*3200 +
-                (traces_no[n]*(240+(bytesPerSample*nsamples))) + 240L;
+        long offset = data_start + traces_no[n]*trace_size + SEGY_TR_HDR;
+        float *fltptr = data + n*nsamples;
 
-        if ( fseek(fid, offset, SEEK_SET) == -1 ) {
+        if ( fseek(fid, offset, SEEK_SET) == -1 ||
+             fread(ptr, bytesPerSample, nsamples, fid) != (size_t)nsamples ) {
             fclose(fid);
-            free(stmp);
-            free(itmp);
-            return PyLong_FromLong(2);
+            free(ptr);
+            return 2;
         }
 
-        fread(ptr, bytesPerSample, nsamples, fid);
-
         switch ( format ) {
             case 1:
-                ibm2float(ptr, (int32_t *)fltptr, nsamples, bt);
+                ibm2float((int32_t *)ptr, (int32_t *)fltptr, nsamples, bt);
                 break;
             case 2:
                 int32_t2float((int32_t *)ptr, fltptr, nsamples, bt);
@@ -996,21 +808,22 @@ PyObject* read_segy_data(const char* filename, PyObject* traceNo) {
                 int16_t2float((int16_t *)ptr, fltptr, nsamples, bt);
                 break;
             case 5:
+                memcpy(fltptr, ptr, nsamples*sizeof(float));
                 if ( bt == 0 )
-                    for ( size_t ns=0; ns<nsamples; ++ns )
+                    for ( int ns=0; ns<nsamples; ++ns )
                         SwapFloat(&fltptr[ns]);
                 break;
             case 8:
                 integer1_to_float((signed char *)ptr, fltptr, nsamples);
                 break;
+            default:
+                fclose(fid);
+                free(ptr);
+                return 2;
         }
-        memcpy(pdata, fltptr, bytesPerSample*nsamples);
-        pdata += nsamples;
     }
 
-
     fclose(fid);
-    free(stmp);
-    free(itmp);
-    return PyArray_Transpose(data,NULL);  // we transpose to get an array of size nsamples x ntraces like in matlab
+    free(ptr);
+    return 0;
 }
@@ -2,6 +2,7 @@
 #ifndef _CSEGY_H_
 #define _CSEGY_H_
 
+#include <inttypes.h>
 #include "string.h"
 
 #define NPY_NO_DEPRECATED_API NPY_1_7_API_VERSION
@@ -12,6 +13,7 @@
 
 int read_segy_b_header(const char*, PyObject*);
 int read_segy_tr_headers(const char*, PyObject*, PyObject*, PyObject*, PyObject*, PyObject*);
-PyObject* read_segy_data(const char*, PyObject*);
+int read_segy_file_info(const char*, int*, short*, int*, long*, long*);
+int read_segy_traces(const char*, const int32_t*, size_t, int, short, int, long, float*);
 
 #endif
\ No newline at end of file
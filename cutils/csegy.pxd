@@ -4,10 +4,12 @@ Created on Fri Aug  5 09:00:30 2016
 
 @author: giroux
 """
+from libc.stdint cimport int32_t
 
 cdef extern from "csegy.h":
     int read_segy_b_header(const char*, object)
     int read_segy_tr_headers(const char*, object, object, object, object, object)
-    object read_segy_data(const char*, object)
+    int read_segy_file_info(const char*, int*, short*, int*, long*, long*)
+    int read_segy_traces(const char*, const int32_t*, size_t, int, short, int, long, float*) nogil
 
     
\ No newline at end of file
@@ -0,0 +1,522 @@
+# -*- coding: utf-8 -*-
+
+"""
+    Copyright 2016 Bernard Giroux
+    email: bernard.giroux@ete.inrs.ca
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+    Pure NumPy SEG-Y reader, used when the compiled module cutils.segy
+    is not available (see cutils/__init__.py).  The file is memory-mapped
+    with a structured dtype (240-byte trace header followed by the
+    samples), so that header words and traces are views on the file, and
+    only the traces that are accessed are read.
+
+    Also holds what needs no compiled code: the SEG-Y writer, and the
+    trace index (Segy_index) shared with cutils.segy.
+"""
+import os
+import re
+
+import numpy as np
+
+# follows CWP/SU naming convention, see read_segy_tr_headers in csegy.c
+TH_NAMES = ['tracl', 'tracr', 'fldr', 'tracf', 'ep', 'cdp', 'cdpt', 'trid', 'nvs', 'nhs',
+            'duse', 'offset', 'gelev', 'selev', 'sdepth', 'gdel', 'sdel', 'swdep', 'gwdep', 'scalel',
+            'scalco', 'sx', 'sy', 'gx', 'gy', 'counit', 'wevel', 'swevel', 'sut', 'gut',
+            'sstat', 'gstat', 'tstat', 'laga', 'lagb', 'delrt', 'muts', 'mute', 'ns', 'dt',
+            'gain', 'igc', 'igi', 'corr', 'sfs', 'sfe', 'slen', 'styp', 'stas', 'stae',
+            'tatyp', 'afilf', 'afils', 'nofilf', 'nofils', 'lcf', 'hcf', 'lcs', 'hcs', 'year',
+            'day', 'hour', 'minute', 'sec', 'timbas', 'trwf', 'grnors', 'grnofr', 'grnlof', 'gaps',
+            'otrav', 'xcdp', 'ycdp', 'ilineno', 'clineno', 'shotno', 'scalsn', 'tvmunit', 'tdcst', 'tdunit',
+            'trid', 'scalt', 'styp', 'sdir', 'smeas', 'smunit']
+
+TH_WORD_LENGTH = [4, 4, 4, 4, 4, 4, 4, 2, 2, 2,
+                  2, 4, 4, 4, 4, 4, 4, 4, 4, 2,
+                  2, 4, 4, 4, 4, 2, 2, 2, 2, 2,
+                  2, 2, 2, 2, 2, 2, 2, 2, 2, 2,
+                  2, 2, 2, 2, 2, 2, 2, 2, 2, 2,
+                  2, 2, 2, 2, 2, 2, 2, 2, 2, 2,
+                  2, 2, 2, 2, 2, 2, 2, 2, 2, 2,
+                  2, 4, 4, 4, 4, 4, 2, 2, 6, 2,
+                  2, 2, 2, 6, 6, 2]
+
+# binary header: name, byte offset w/r to start of binary header, type
+BH_FIELDS = [('jobid', 0, '>i4'), ('lino', 4, '>i4'), ('reno', 8, '>i4'), ('ntrpr', 12, '>i2'),
+             ('nart', 14, '>i2'), ('hdt', 16, '>u2'), ('dto', 18, '>u2'), ('hns', 20, '>u2'),
+             ('nso', 22, '>u2'), ('format', 24, '>i2'), ('fold', 26, '>i2'), ('tsort', 28, '>i2'),
+             ('vscode', 30, '>i2'), ('hsfs', 32, '>i2'), ('hsfe', 34, '>i2'), ('hslen', 36, '>i2'),
+             ('hstyp', 38, '>i2'), ('schn', 40, '>i2'), ('hstas', 42, '>i2'), ('hstae', 44, '>i2'),
+             ('htatyp', 46, '>i2'), ('hcorr', 48, '>i2'), ('bgrcv', 50, '>i2'), ('rcvm', 52, '>i2'),
+             ('mfeet', 54, '>u2'), ('polyt', 56, '>i2'), ('vpol', 58, '>i2'),
+             ('rev', 300, '>u2'), ('fixl', 302, '>i2'), ('extfh', 304, '>i2')]
+
+SAMPLE_DTYPES = {1: '>u4', 2: '>i4', 3: '>i2', 5: '>f4', 8: 'i1'}
+
+
+def ibm2float(ibm):
+    """
+    Convert IBM 32-bit floats (given as uint32 words) to IEEE float32
+    """
+    ibm = np.asarray(ibm, dtype=np.uint32)
+    mant = (ibm & 0x00ffffff).astype(np.float64)
+    expo = ((ibm >> 24) & 0x7f).astype(np.int64)
+    val = np.ldexp(mant, 4 * (expo - 64) - 24)
+    val[(ibm >> 31) == 1] *= -1.0
+    return val.astype(np.float32)
+
+
+# time units & exact sample interval, written in textual header by write_segy
+TIME_UNITS_RE = re.compile(r'time units: (\w+), sample interval: ([-+0-9.eE]+)')
+
+
+def scaling(scal):
+    """
+    Factors to apply to coordinates given scalco or scalel header words
+    """
+    scal = np.asarray(scal, dtype=np.float64)
+    fac = np.ones(scal.shape)
+    fac[scal > 0] = scal[scal > 0]
+    fac[scal < 0] = -1.0 / scal[scal < 0]
+    return fac
+
+
+def read_segy_text(segyfile):
+    """
+    Textual file header (3200 bytes), decoded from EBCDIC or ASCII
+    """
+    raw = np.fromfile(segyfile, dtype=np.uint8, count=3200).tobytes()
+    if raw[:1] == b'\xc3':  # 'C' in EBCDIC
+        return raw.decode('cp500', 'replace')
+    return raw.decode('ascii', 'replace')
+
+
+def trace_header_dtype(thDict=None, wordLength=None):
+    """
+    Structured dtype of the 240-byte trace header
+
+    Returns the dtype and a dict holding, for each field, its word length
+    (2 & 4: integers, 5: IBM float, 6: 4-byte mantissa & 2-byte power of 10)
+    """
+    if thDict is None or len(thDict) == 0:
+        thDict = TH_NAMES
+        wordLength = TH_WORD_LENGTH
+    elif wordLength is None or len(wordLength) != len(thDict):
+        raise ValueError('word_length must be given for each word of custom dictionary')
+
+    names = []
+    formats = []
+    offsets = []
+    wl = {}
+    offset = 0
+    for name, length in zip(thDict, wordLength):
+        if name not in wl:   # first occurrence kept for names used twice in standard
+            if length == 2:
+                fmt = '>i2'
+            elif length == 4:
+                fmt = '>i4'
+            elif length == 5:
+                fmt = '>u4'
+            elif length == 6:
+                fmt = np.dtype([('m', '>i4'), ('e', '>i2')])
+            else:
+                raise ValueError('Word length should be 2, 4, 5 or 6')
+            names.append(name)
+            formats.append(fmt)
+            offsets.append(offset)
+            wl[name] = length
+        offset += 4 if length == 5 else length
+
+    if offset > 240:
+        raise ValueError('Sum of word_length should be less than 241')
+
+    return np.dtype({'names': names, 'formats': formats, 'offsets': offsets, 'itemsize': 240}), wl
+
+
+class SegyFile(object):
+    """
+    Memory-mapped SEG-Y file
+
+    Attributes are:
+        bh: dictionary containing binary header data
+        ntraces: number of traces
+        nsamples: number of samples per trace
+        th: structured array (view on the file) of trace headers
+        samples: array (view on the file) of raw samples, ntraces x nsamples
+    """
+
+    def __init__(self, segyfile, thDict=None, wordLength=None):
+        self.filename = segyfile
+
+        raw = np.fromfile(segyfile, dtype=np.uint8, count=3600)
+        if raw.size < 3600:
+            raise IOError('Problem opening segy file')
+        self.bh = {}
+        for name, offset, fmt in BH_FIELDS:
+            self.bh[name] = int(raw[3200 + offset:3200 + offset + 2 + 2 * (fmt[-1] == '4')].view(fmt)[0])
+
+        fmt = self.bh['format']
+        if fmt not in SAMPLE_DTYPES:
+            raise RuntimeError('Problem parsing binary header')
+        self.format = fmt
+        self.nsamples = self.bh['hns']
+        nextended = max(self.bh['extfh'], 0)
+
+        self.th_dtype, self.word_length = trace_header_dtype(thDict, wordLength)
+        trace_dtype = np.dtype([('header', self.th_dtype),
+                                ('data', SAMPLE_DTYPES[fmt], (self.nsamples,))])
+        offset = 3600 + 3200 * nextended
+        self.ntraces = (os.path.getsize(segyfile) - offset) // trace_dtype.itemsize
+        self._traces = np.memmap(segyfile, dtype=trace_dtype, mode='r', offset=offset,
+                                 shape=(self.ntraces,))
+        self.th = self._traces['header']
+        self.samples = self._traces['data']
+
+    def header(self, name, ind=None):
+        """
+        Values of trace header word name, for traces ind (all traces if None)
+        """
+        values = self.th[name] if ind is None else self.th[name][ind]
+        wl = self.word_length[name]
+        if wl == 2:
+            return values.astype(np.int16)
+        elif wl == 4:
+            return values.astype(np.int32)
+        elif wl == 5:
+            return ibm2float(values)
+        else:
+            return values['m'] * np.power(10.0, values['e'])
+
+    def traces(self, ind=None):
+        """
+        Traces ind as float32, array of size nsamples x ntraces
+        """
+        samples = self.samples if ind is None else self.samples[ind]
+        if self.format == 1:
+            data = ibm2float(samples)
+        else:
+            data = samples.astype(np.float32)
+        return data.T
+
+    def index_traces(self):
+        """
+        Trace numbers and scaled coordinates of all traces (see INDEX_DTYPE)
+        """
+        traces = np.empty(self.ntraces, dtype=INDEX_DTYPE)
+        traces['trace'] = np.arange(self.ntraces)
+        fac_co = scaling(self.header('scalco'))
+        fac_el = scaling(self.header('scalel'))
+        for name in ('sx', 'sy', 'gx', 'gy'):
+            traces[name] = fac_co * self.header(name)
+        for name in ('selev', 'gelev'):
+            traces[name] = fac_el * self.header(name)
+        return traces
+
+
+class Segy_data():
+    """
+    Class to hold SEG-Y data (see cutils.segy.Segy_data)
+    """
+    bh=0     # binary header
+    th=0     # trace headers
+    data=0   # traces
+
+
+def read_segy(segyfile, traceNo=None, fields=None, thDict=None, wordLength=None, nthreads=1):
+    """
+    READ_SEGY - read the content of a SEG-Y file
+
+    Same interface and output as cutils.segy.read_segy (nthreads is ignored,
+    traces are converted with vectorized NumPy operations)
+    """
+    try:
+        f = SegyFile(segyfile, thDict, wordLength)
+    except (IOError, OSError):
+        raise IOError('Problem opening segy file')
+
+    if traceNo is not None and len(traceNo) > 0:
+        ind = np.asarray(traceNo, dtype=np.int64)
+        if np.any(ind < 0) or np.any(ind >= f.ntraces):
+            raise RuntimeError('Problem parsing trace data')
+    else:
+        ind = None
+
+    s = Segy_data()
+    s.bh = f.bh
+    s.th = dict()
+    for name in _header_fields(f, fields, thDict):
+        s.th[name] = f.header(name, ind)
+
+    s.data = f.traces(ind)
+    return s
+
+
+def iter_segy(segyfile, block=1024, fields=None, thDict=None, wordLength=None):
+    """
+    ITER_SEGY - iterate over the traces of a SEG-Y file by blocks
+
+    Same interface and output as cutils.segy.iter_segy.  Blocks are
+    slices of the memory-mapped file, read when they are converted; data
+    is a new array at each iteration (the compiled version reuses its
+    buffers, copy data to keep it whatever the backend).
+    """
+    try:
+        f = SegyFile(segyfile, thDict, wordLength)
+    except (IOError, OSError):
+        raise IOError('Problem opening segy file')
+    fields = _header_fields(f, fields, thDict)
+
+    block = max(1, block)
+    for start in range(0, f.ntraces, block):
+        ind = slice(start, min(start + block, f.ntraces))
+        th = dict()
+        for name in fields:
+            th[name] = f.header(name, ind)
+        yield th, f.traces(ind)
+
+
+def _header_fields(f, fields, thDict):
+    # names of trace header words requested with fields (see read_segy)
+    if fields is None:
+        return []
+    fields = list(fields)
+    names = list(f.th_dtype.names) if thDict is None or len(thDict) == 0 else list(thDict)
+    if len(fields) == 1 and fields[0] == 'ALL':
+        fields = names
+    elif len(fields) == 1 and isinstance(fields[0], (int, np.integer)):
+        if fields[0] < 0 or fields[0] >= len(names):
+            raise RuntimeError('Problem parsing trace headers')
+        fields = [names[fields[0]]]
+    for name in fields:
+        if name not in f.word_length:
+            raise RuntimeError('Problem parsing trace headers')
+    return fields
+
+
+INDEX_DTYPE = np.dtype([('trace', np.int32),
+                        ('sx', np.float64), ('sy', np.float64), ('selev', np.float64),
+                        ('gx', np.float64), ('gy', np.float64), ('gelev', np.float64)])
+
+
+class Segy_index():
+    """
+    Index of the traces of a SEG-Y file, for random access by position
+
+    Attributes are:
+        filename: name of SEG-Y file
+        traces: structured array with fields
+                trace   -  trace number within the file
+                sx, sy, selev  -  source coordinates (scaled with scalco and scalel)
+                gx, gy, gelev  -  receiver coordinates (scaled with scalco and scalel)
+    """
+    _read_segy = staticmethod(read_segy)  # reader of the backend, see read
+
+    def __init__(self, filename, traces):
+        self.filename = filename
+        self.traces = traces
+
+    def __len__(self):
+        return self.traces.size
+
+    def select(self, **ranges):
+        """
+        Trace numbers for traces within coordinate ranges
+
+        ranges are given as keyword arguments, with names of coordinates
+        (sx, sy, selev, gx, gy, gelev) and values (min, max), use None for
+        an open bound, e.g.
+
+            ind.select(selev=(-5.01, -4.99), gelev=(None, -10.0))
+        """
+        mask = np.ones(self.traces.size, dtype=bool)
+        for name, bounds in ranges.items():
+            if name not in ('sx', 'sy', 'selev', 'gx', 'gy', 'gelev'):
+                raise ValueError('Unknown coordinate: ' + name)
+            vmin, vmax = bounds
+            if vmin is not None:
+                mask &= self.traces[name] >= vmin
+            if vmax is not None:
+                mask &= self.traces[name] <= vmax
+        return self.traces['trace'][mask]
+
+    def read(self, fields=None, nthreads=1, **ranges):
+        """
+        Read traces within coordinate ranges (see select), returns an
+        instance of Segy_data (see read_segy)
+        """
+        traceNo = self.select(**ranges)
+        if traceNo.size == 0:
+            raise ValueError('No trace within given ranges')
+        return self._read_segy(self.filename, traceNo=traceNo, fields=fields, nthreads=nthreads)
+
+
+def build_segy_index(segyfile, indexfile=None):
+    """
+    BUILD_SEGY_INDEX - scan trace headers of a SEG-Y file and save an index
+    ind = build_segy_index(segyfile, indexfile)
+
+    Input:
+        segyfile (mandatory) : name of SEG-Y file
+        indexfile (optional) : name of sidecar file (segyfile + '.idx.npz' by default)
+
+    Output:
+        ind : instance of Segy_index
+
+    Note:
+        Only trace headers are read.  The sidecar file holds the size and
+        modification time of the SEG-Y file, see load_segy_index.
+    """
+    try:
+        f = SegyFile(segyfile)
+    except (IOError, OSError):
+        raise IOError('Problem opening segy file')
+    traces = f.index_traces()
+    _save_index(segyfile, indexfile, traces)
+    return Segy_index(segyfile, traces)
+
+
+def load_segy_index(segyfile, indexfile=None):
+    """
+    LOAD_SEGY_INDEX - load the index of a SEG-Y file
+    ind = load_segy_index(segyfile, indexfile)
+
+    The sidecar file is read if it exists and is up to date with the
+    SEG-Y file, otherwise the index is built (see build_segy_index)
+    """
+    traces = _load_index(segyfile, indexfile)
+    if traces is None:
+        return build_segy_index(segyfile, indexfile)
+    return Segy_index(segyfile, traces)
+
+
+def _save_index(segyfile, indexfile, traces):
+    # the sidecar is stamped with size & modification time of the SEG-Y file
+    if indexfile is None:
+        indexfile = segyfile + '.idx.npz'
+    stat = os.stat(segyfile)
+    with open(indexfile, 'wb') as f:
+        np.savez(f, traces=traces, stamp=np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64))
+
+
+def _load_index(segyfile, indexfile):
+    # traces of sidecar file, None if it does not exist or is out of date
+    if indexfile is None:
+        indexfile = segyfile + '.idx.npz'
+    if not os.path.isfile(indexfile):
+        return None
+    stat = os.stat(segyfile)
+    with np.load(indexfile) as f:
+        if f['stamp'][0] == stat.st_size and f['stamp'][1] == stat.st_mtime_ns:
+            return f['traces']
+    return None
+
+
+def write_segy(segyfile, mogdata, block=1024):
+    """
+    WRITE_SEGY - write the traces of a MOG in a SEG-Y file
+    write_segy(segyfile, mogdata, block)
+
+    Input:
+        segyfile (mandatory) : name of SEG-Y file
+        mogdata (mandatory) : instance of MogData
+        block (optional) : number of traces converted & written at once
+
+    Note:
+        Samples are written as 4-byte IEEE floats (format 5).  The sample
+        interval in headers is 1000*timec, i.e. in µs if timec is in ms, or
+        in ps if timec is in ns (common practice for GPR data); time units
+        and the exact sample interval are written in line 4 of the textual
+        header (see TIME_UNITS_RE), from which MogData.readSEGY takes them
+        back.  Coordinates are taken from Tx_* and Rx_* and stored with the
+        largest scalar (scalco and scalel, down to -1000) that fits in
+        4-byte integers.
+    """
+    nsamples = mogdata.nptsptrc
+    ntraces = mogdata.ntrace
+    dt = int(round(1000.0 * mogdata.timec))
+    if dt <= 0 or dt > 0xffff:
+        raise ValueError('Sample interval cannot be stored in SEG-Y header')
+    if nsamples > 0x7fff:
+        raise ValueError('Number of samples per trace cannot be stored in SEG-Y header')
+
+    coords = dict()
+    for name, attr in (('sx', 'Tx_x'), ('sy', 'Tx_y'), ('selev', 'Tx_z'),
+                       ('gx', 'Rx_x'), ('gy', 'Rx_y'), ('gelev', 'Rx_z')):
+        coords[name] = np.broadcast_to(np.asarray(getattr(mogdata, attr), dtype=np.float64), (ntraces,))
+    scalco = _scalar(np.concatenate([coords[n] for n in ('sx', 'sy', 'gx', 'gy')]))
+    scalel = _scalar(np.concatenate([coords[n] for n in ('selev', 'gelev')]))
+
+    text = ['C 1 BhTomoPy export of MOG ' + mogdata.name,
+            'C 2 date: ' + mogdata.date,
+            'C 3 antennas: ' + mogdata.antennas,
+            'C 4 time units: {0:s}, sample interval: {1!r}, coordinates units: {2:s}'.format(
+                mogdata.tunits, float(mogdata.timec), mogdata.cunits),
+            'C 5 comment: ' + mogdata.comment]
+    text += ['C{0:2d}'.format(n) for n in range(len(text) + 1, 41)]
+    text = ''.join([(l[:79] + '\n').ljust(80) for l in text]).encode('ascii', 'replace')
+
+    bh = np.zeros(1, dtype=np.dtype({'names': ['ntrpr', 'hdt', 'hns', 'format', 'mfeet', 'rev', 'fixl'],
+                                     'formats': ['>i2', '>u2', '>u2', '>i2', '>i2', '>u2', '>i2'],
+                                     'offsets': [12, 16, 20, 24, 54, 300, 302],
+                                     'itemsize': 400}))
+    bh['ntrpr'] = 1
+    bh['hdt'] = dt
+    bh['hns'] = nsamples
+    bh['format'] = 5
+    bh['mfeet'] = 2 if mogdata.cunits == 'ft' else 1
+    bh['rev'] = 0x0100
+    bh['fixl'] = 1
+
+    th_dtype = np.dtype({'names': ['tracl', 'tracr', 'trid', 'gelev', 'selev', 'scalel', 'scalco',
+                                   'sx', 'sy', 'gx', 'gy', 'counit', 'ns', 'dt'],
+                         'formats': ['>i4', '>i4', '>i2', '>i4', '>i4', '>i2', '>i2',
+                                     '>i4', '>i4', '>i4', '>i4', '>i2', '>u2', '>u2'],
+                         'offsets': [0, 4, 28, 40, 44, 68, 70, 72, 76, 80, 84, 88, 114, 116],
+                         'itemsize': 240})
+    block = max(1, min(block, ntraces))
+    buf = np.zeros(block, dtype=np.dtype([('header', th_dtype), ('data', '>f4', (nsamples,))]))
+    buf['header']['trid'] = 1
+    buf['header']['scalco'] = scalco
+    buf['header']['scalel'] = scalel
+    buf['header']['counit'] = 1
+    buf['header']['ns'] = nsamples
+    buf['header']['dt'] = dt
+    fac_co = scaling(scalco)
+    fac_el = scaling(scalel)
+
+    with open(segyfile, 'wb') as f:
+        f.write(text)
+        f.write(bh.tobytes())
+        for start in range(0, ntraces, block):
+            stop = min(start + block, ntraces)
+            tr = buf[:stop - start]
+            tr['header']['tracl'] = np.arange(start + 1, stop + 1)
+            tr['header']['tracr'] = tr['header']['tracl']
+            for name in ('sx', 'sy', 'gx', 'gy'):
+                tr['header'][name] = np.round(coords[name][start:stop] / fac_co)
+            for name in ('selev', 'gelev'):
+                tr['header'][name] = np.round(coords[name][start:stop] / fac_el)
+            tr['data'] = mogdata.rdata[:, start:stop].T
+            tr.tofile(f)
+
+
+def _scalar(coords):
+    """
+    Largest SEG-Y scalar (as divisor, down to -1000) for which coords fit in 4-byte integers
+    """
+    cmax = np.max(np.abs(coords)) if coords.size > 0 else 0.0
+    for scal in (-1000, -100, -10):
+        if cmax * -scal < 2**31 - 1:
+            return scal
+    return 1
@@ -17,11 +17,20 @@
     You should have received a copy of the GNU General Public License
     along with this program. If not, see <http://www.gnu.org/licenses/>.
 """
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 cimport numpy as np
+from libc.stdint cimport int32_t
 
 cimport csegy
 
+# writing needs no compiled code, write_segy is shared with the pure NumPy module
+from cutils import npsegy
+from cutils.npsegy import scaling, write_segy
+
+np.import_array()
+
 #cdef struct c_bin_header:
 #    int jobid
 #    int lino
@@ -204,10 +213,10 @@ class Segy_data():
     th=0     # trace headers
     data=0   # traces
 
-def read_segy(segyfile, traceNo=None, fields=None, thDict=None, wordLength=None):
+def read_segy(segyfile, traceNo=None, fields=None, thDict=None, wordLength=None, nthreads=1):
     """
     READ_SEGY - read the content of a SEG-Y file
-    s = read_segy(segyfile, traces, fields, dict, word_length)
+    s = read_segy(segyfile, traces, fields, dict, word_length, nthreads)
 
     Input:
         segyfile (mandatory) : name of SEG-Y file
@@ -219,6 +228,7 @@ def read_segy(segyfile, traceNo=None, fields=None, thDict=None, wordLength=None)
 	               - sum(word_length) must be less than 241
                     - numel(word_length) must equal numel(dict)
                     - 4-byte IBM float words are handled by setting word_length=5
+        nthreads (optional) : number of threads used to read and convert the traces
 
     Output:
         s : instance of a class with the following attributes
@@ -226,6 +236,12 @@ def read_segy(segyfile, traceNo=None, fields=None, thDict=None, wordLength=None)
                 - the trace header data (s.th)
                 - the trace data (s.data)
 
+    Note:
+        Traces are decoded without holding the GIL, other python threads
+        (e.g. the GUI) keep running while data is read.  With nthreads > 1,
+        traces are split in contiguous chunks decoded concurrently into
+        the same array.
+
     Caveat:
         Text headers are not read
         Traces of variable length are not handled (results unpredictable)
@@ -250,7 +266,7 @@ def read_segy(segyfile, traceNo=None, fields=None, thDict=None, wordLength=None)
     if traceNo is None:
         traceNo = list()
     else:
-        traceNo = list(traceNo)
+        traceNo = [int(n) for n in traceNo]
         
     if fields is not None:
         fields = list(fields)   # make sure we have list instances
@@ -268,16 +284,213 @@ def read_segy(segyfile, traceNo=None, fields=None, thDict=None, wordLength=None)
             raise IOError('Problem opening segy file')
         elif retval == 2:
             raise RuntimeError('Problem parsing trace headers')
+        elif retval == 3:
+            raise ImportError('NumPy C API could not be initialized')
+
+    cdef int nsamples = 0
+    cdef short fmt = 0
+    cdef int bytesPerSample = 0
+    cdef long data_start = 0
+    cdef long ntraces = 0
+    retval = csegy.read_segy_file_info(filename, &nsamples, &fmt, &bytesPerSample, &data_start, &ntraces)
+
+    if retval == 1:
+        raise IOError('Problem opening segy file')
+    elif retval == 2:
+        raise RuntimeError('Problem parsing trace data')
 
-    s.data = csegy.read_segy_data(filename, traceNo)
-    if type(s.data) is int:
-        retval = s.data
+    if len(traceNo) == 0:
+        traces = np.arange(ntraces, dtype=np.int32)
     else:
-        retval = 0
-    
+        traces = np.array(traceNo, dtype=np.int32)
+
+    # ntraces x nsamples due to memory layout
+    data = np.empty((traces.size, nsamples), dtype=np.float32)
+
+    nthreads = max(1, min(nthreads, traces.size))
+    if nthreads == 1:
+        retval = _read_traces(py_bytes, traces, data, nsamples, fmt, bytesPerSample, data_start)
+    else:
+        bounds = np.linspace(0, traces.size, nthreads + 1).astype(np.int64)
+        with ThreadPoolExecutor(max_workers=nthreads) as executor:
+            retvals = executor.map(lambda n: _read_traces(py_bytes, traces[bounds[n]:bounds[n + 1]],
+                                                          data[bounds[n]:bounds[n + 1], :],
+                                                          nsamples, fmt, bytesPerSample, data_start),
+                                   range(nthreads))
+            retval = max(retvals)
+
     if retval == 1:
         raise IOError('Problem opening segy file')
     elif retval == 2:
         raise RuntimeError('Problem parsing trace data')
 
+    s.data = data.T  # we transpose to get an array of size nsamples x ntraces like in matlab
+
     return s
+
+
+def _read_traces(bytes filename, np.ndarray traces, np.ndarray data,
+                 int nsamples, short fmt, int bytesPerSample, long data_start):
+    """
+    Decode a set of traces in data (ntraces x nsamples), the GIL is released while reading
+
+    traces (int32) and data (float32) must be C-contiguous
+    """
+    cdef const char* fname = filename
+    cdef int32_t* ptraces = <int32_t*> np.PyArray_DATA(traces)
+    cdef float* pdata = <float*> np.PyArray_DATA(data)
+    cdef size_t ntraces = traces.shape[0]
+    cdef int retval = 0
+    if ntraces == 0 or nsamples == 0:
+        return 0
+    with nogil:
+        retval = csegy.read_segy_traces(fname, ptraces, ntraces, nsamples,
+                                        fmt, bytesPerSample, data_start, pdata)
+    return retval
+
+
+class Segy_index(npsegy.Segy_index):
+    """
+    Index of the traces of a SEG-Y file, for random access by position
+    (see cutils.npsegy.Segy_index), traces are read with this module
+    """
+    _read_segy = staticmethod(read_segy)
+
+
+def build_segy_index(segyfile, indexfile=None):
+    """
+    BUILD_SEGY_INDEX - scan trace headers of a SEG-Y file and save an index
+    ind = build_segy_index(segyfile, indexfile)
+
+    Input:
+        segyfile (mandatory) : name of SEG-Y file
+        indexfile (optional) : name of sidecar file (segyfile + '.idx.npz' by default)
+
+    Output:
+        ind : instance of Segy_index
+
+    Note:
+        Only trace headers are read.  The sidecar file holds the size and
+        modification time of the SEG-Y file, see load_segy_index.
+    """
+    cdef bytes py_bytes = segyfile.encode()
+    cdef char* filename = py_bytes
+    cdef int nsamples = 0
+    cdef short fmt = 0
+    cdef int bytesPerSample = 0
+    cdef long data_start = 0
+    cdef long ntraces = 0
+    cdef int retval = csegy.read_segy_file_info(filename, &nsamples, &fmt, &bytesPerSample,
+                                                &data_start, &ntraces)
+    if retval == 1:
+        raise IOError('Problem opening segy file')
+    elif retval == 2:
+        raise RuntimeError('Problem parsing trace data')
+
+    th = dict()
+    retval = csegy.read_segy_tr_headers(filename, list(),
+                                        ['sx', 'sy', 'selev', 'gx', 'gy', 'gelev', 'scalco', 'scalel'],
+                                        list(), list(), th)
+    if retval == 1:
+        raise IOError('Problem opening segy file')
+    elif retval == 2:
+        raise RuntimeError('Problem parsing trace headers')
+    elif retval == 3:
+        raise ImportError('NumPy C API could not be initialized')
+
+    traces = np.empty(ntraces, dtype=npsegy.INDEX_DTYPE)
+    traces['trace'] = np.arange(ntraces)
+    fac_co = scaling(th['scalco'])
+    fac_el = scaling(th['scalel'])
+    for name in ('sx', 'sy', 'gx', 'gy'):
+        traces[name] = fac_co * th[name]
+    for name in ('selev', 'gelev'):
+        traces[name] = fac_el * th[name]
+
+    npsegy._save_index(segyfile, indexfile, traces)
+    return Segy_index(segyfile, traces)
+
+
+def load_segy_index(segyfile, indexfile=None):
+    """
+    LOAD_SEGY_INDEX - load the index of a SEG-Y file
+    ind = load_segy_index(segyfile, indexfile)
+
+    The sidecar file is read if it exists and is up to date with the
+    SEG-Y file, otherwise the index is built (see build_segy_index)
+    """
+    traces = npsegy._load_index(segyfile, indexfile)
+    if traces is None:
+        return build_segy_index(segyfile, indexfile)
+    return Segy_index(segyfile, traces)
+
+
+def iter_segy(segyfile, block=1024, fields=None, thDict=None, wordLength=None):
+    """
+    ITER_SEGY - iterate over the traces of a SEG-Y file by blocks
+    for th, data in iter_segy(segyfile, block, fields, dict, word_length):
+
+    Input:
+        segyfile (mandatory) : name of SEG-Y file
+        block (optional)  : number of traces per block
+        fields, dict, word_length (optional) : see read_segy
+
+    Output (at each iteration):
+        th : dictionary of trace header data for the traces of the block
+        data : traces of the block (numpy array of size nsamples x ntraces in block)
+
+    Note:
+        data is a view on a buffer that is reused, it is overwritten when
+        the next block is requested (copy it to keep it).  The next block
+        is read in a background thread while the current one is processed.
+    """
+    cdef bytes py_bytes = segyfile.encode()
+    cdef char* filename = py_bytes
+    cdef int nsamples = 0
+    cdef short fmt = 0
+    cdef int bytesPerSample = 0
+    cdef long data_start = 0
+    cdef long ntraces = 0
+    cdef int retval = csegy.read_segy_file_info(filename, &nsamples, &fmt, &bytesPerSample,
+                                                &data_start, &ntraces)
+    if retval == 1:
+        raise IOError('Problem opening segy file')
+    elif retval == 2:
+        raise RuntimeError('Problem parsing trace data')
+
+    if fields is not None:
+        fields = list(fields)
+        thDict = list() if thDict is None else list(thDict)
+        wordLength = list() if wordLength is None else list(wordLength)
+
+    block = max(1, min(block, ntraces))
+    buffers = [np.empty((block, nsamples), dtype=np.float32) for n in range(2)]
+
+    def read_block(start, buf):
+        traces = np.arange(start, min(start + block, ntraces), dtype=np.int32)
+        return _read_traces(py_bytes, traces, buf[:traces.size, :], nsamples, fmt, bytesPerSample, data_start)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(read_block, 0, buffers[0])
+        for nb, start in enumerate(range(0, ntraces, block)):
+            stop = min(start + block, ntraces)
+            th = dict()
+            if fields is not None:
+                retval = csegy.read_segy_tr_headers(filename, list(range(start, stop)), fields,
+                                                    thDict, wordLength, th)
+                if retval == 1:
+                    raise IOError('Problem opening segy file')
+                elif retval == 2:
+                    raise RuntimeError('Problem parsing trace headers')
+                elif retval == 3:
+                    raise ImportError('NumPy C API could not be initialized')
+
+            retval = future.result()
+            if retval == 1:
+                raise IOError('Problem opening segy file')
+            elif retval == 2:
+                raise RuntimeError('Problem parsing trace data')
+            if stop < ntraces:
+                future = executor.submit(read_block, stop, buffers[(nb + 1) % 2])
+
+            yield th, buffers[nb % 2][:stop - start, :].T
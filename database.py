@@ -18,18 +18,21 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program. If not, see <http://www.gnu.org/licenses/>.
 """
+import glob
 import os
 import re
 import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import h5py
 import numpy as np
 from ttcrpy import rgrid
 
 from borehole import Borehole
-from grid import Grid2D
+from grid import Grid2D, straight_rays_cache
 from model import Model
-from mog import MogData, Mog, AirShots
+from mog import MogData, Mog, AirShots, MemmapTraces, IndexedTraces, MergedTraces, PruneParams, TRACE_DTYPE
 
 
 class DbList(list):
@@ -50,7 +53,11 @@ class DbList(list):
 
 
 class BhTomoDb():
-    def __init__(self, fname=''):
+    def __init__(self, fname='', cache_rays=False):
+        # if cache_rays is True, straight ray matrices of the models are also kept in the file
+        # (see grid.RayMatrixCache); it is read when the file is opened
+        self.cache_rays = cache_rays
+        self.f = None
         self.filename = fname
         self.air_shots = DbList()
         self.boreholes = DbList()
@@ -74,9 +81,12 @@ class BhTomoDb():
     @filename.setter
     def filename(self, fname):
         # TODO: check if db is modified before making the change
+        straight_rays_cache.detach(self)
         if fname != '':
             try:
                 self.f = h5py.File(fname, 'a')
+                if self.cache_rays:
+                    straight_rays_cache.attach(self.f.require_group('/ray_matrices'), self)
                 # we must reset modified to True otherwise nothing will be saved in new file
                 for obj in self.boreholes + self.air_shots + self.mogs + self.models:
                     obj.modified = True
@@ -84,6 +94,15 @@ class BhTomoDb():
                 raise e
         self._filename = fname
 
+    def close(self):
+        """
+        Close the database file
+        """
+        straight_rays_cache.detach(self)
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
     @property
     def name(self):
         return os.path.basename(self._filename)
@@ -156,6 +175,52 @@ class BhTomoDb():
         self._save_object(mog, group)
         self.f.flush()
         
+    def import_ramac(self, files, max_workers=None):
+        """
+        Import RAMAC data files (.rad/.rd3/.tlf triples) without the GUI
+
+        files: directory, glob pattern or list of file names (any of the
+               three extensions, or basename)
+        max_workers: number of processes used to parse files (os.cpu_count() if None)
+
+        Files are parsed in a process pool, and each Mog is added to the
+        database and saved as soon as it is available (the database file
+        must be set).  Returns a list holding, for each file, a tuple
+        (basename, time to parse [s], time to save [s], error message),
+        the error message being '' on success.
+        """
+        if isinstance(files, str):
+            if os.path.isdir(files):
+                files = glob.glob(os.path.join(files, '*'))
+            else:
+                files = glob.glob(files)
+        basenames = []
+        for f in files:
+            basename, ext = os.path.splitext(f)
+            if ext.lower() not in ('.rad', '.rd3', '.tlf'):
+                if ext != '':
+                    continue
+                basename = f
+            if basename not in basenames:
+                basenames.append(basename)
+
+        report = []
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(_read_ramac, b) for b in sorted(basenames)]
+            for future in as_completed(futures):
+                basename, mog, t_parse, err = future.result()
+                t_save = 0.0
+                if mog is not None:
+                    t0 = time.perf_counter()
+                    try:
+                        self.mogs.append(mog)
+                        self.save(obj=mog)
+                    except Exception as e:
+                        err = str(e)
+                    t_save = time.perf_counter() - t0
+                report.append((basename, t_parse, t_save, err))
+        return report
+
     def save_model(self, model):
         # TODO: make sure all mogs held in model.mogs are in db
         group = self.f.require_group('/models/'+model.name)
@@ -243,6 +308,7 @@ class BhTomoDb():
     
     def load_air_shots(self):
         self.air_shots = self.get_air_shots()
+        Mog.fit_air_shots(self.air_shots)
 
     def get_mog_names(self):
         gr = self.f['/mogs']
@@ -276,6 +342,9 @@ class BhTomoDb():
             # print(k, type(obj.__dict__[k]), obj.__dict__[k])
             if obj.__dict__[k] is None:
                 continue
+            if k.startswith('_'):
+                # private attributes hold cached values, not saved
+                continue
             if type(obj.__dict__[k]) is rgrid.Grid2d:
                 continue
             elif type(obj.__dict__[k]) is str:
@@ -293,27 +362,10 @@ class BhTomoDb():
             elif type(obj.__dict__[k]) is np.int64:
                 group.attrs[k] = obj.__dict__[k]
             elif type(obj.__dict__[k]) is np.ndarray:
-                try:
-                    if group[k].shape != obj.__dict__[k].shape:
-                        # we have to delete previous dataset because new one is not same size
-                        del(group[k])
-                        #group[k] = obj.__dict__[k]
-                        if obj.__dict__[k].dtype is np.dtype('bool'):
-                            # for some reason, bools are not stored in file, so we cast to int8 instead
-                            group.create_dataset(k, data=obj.__dict__[k].astype(np.int8), compression='gzip')
-                        else:
-                            group.create_dataset(k, data=obj.__dict__[k], compression='gzip')
-                    else:
-                        if obj.__dict__[k].dtype is np.dtype('bool'):
-                            group[k][...] = obj.__dict__[k].astype(np.int8)
-                        else:
-                            group[k][...] = obj.__dict__[k]
-                except:
-                    #group[k] = obj.__dict__[k]
-                    if obj.__dict__[k].dtype is np.dtype('bool'):
-                        group.create_dataset(k, data=obj.__dict__[k].astype(np.int8), compression='gzip')
-                    else:
-                        group.create_dataset(k, data=obj.__dict__[k], compression='gzip')
+                self._save_array(obj.__dict__[k], group, k)
+            elif type(obj.__dict__[k]) in (MemmapTraces, IndexedTraces, MergedTraces):
+                # traces mapped from the original file, reordered or merged lazily are copied in the db
+                self._save_array(np.asarray(obj.__dict__[k]), group, k)
             elif type(obj.__dict__[k]) is list:
                 g = group.require_group('_list_'+k)
                 self._save_list(obj.__dict__[k], g)
@@ -323,6 +375,29 @@ class BhTomoDb():
                 g.attrs['BhTomoPyClassName'] = obj.__dict__[k].__class__.__name__
                 self._save_object(obj.__dict__[k], g)
 
+    def _save_array(self, arr, group, k):
+        try:
+            if group[k].shape != arr.shape:
+                # we have to delete previous dataset because new one is not same size
+                del(group[k])
+                #group[k] = arr
+                if arr.dtype is np.dtype('bool'):
+                    # for some reason, bools are not stored in file, so we cast to int8 instead
+                    group.create_dataset(k, data=arr.astype(np.int8), compression='gzip')
+                else:
+                    group.create_dataset(k, data=arr, compression='gzip')
+            else:
+                if arr.dtype is np.dtype('bool'):
+                    group[k][...] = arr.astype(np.int8)
+                else:
+                    group[k][...] = arr
+        except:
+            #group[k] = arr
+            if arr.dtype is np.dtype('bool'):
+                group.create_dataset(k, data=arr.astype(np.int8), compression='gzip')
+            else:
+                group.create_dataset(k, data=arr, compression='gzip')
+
     def _save_list(self, lst, group):
         for n in range(len(lst)):
             # group name in index in list
@@ -409,11 +484,15 @@ class BhTomoDb():
 
     def _load_mog(self, group):
         m = Mog()
+        columns = {}
         for kk in group.attrs.keys():
             m.__dict__[kk] = group.attrs[kk]
         for kk in group.keys():
             if type(group[kk]) is h5py._hl.dataset.Dataset:  # @UndefinedVariable
-                if group[kk].dtype is np.dtype('int8'):
+                if kk in TRACE_DTYPE.names:
+                    # file written before per-trace attributes were grouped in Mog.traces
+                    columns[kk] = np.asarray(group[kk])
+                elif group[kk].dtype is np.dtype('int8'):
                     m.__dict__[kk] = np.asarray(group[kk]).astype(bool)
                 else:
                     m.__dict__[kk] = np.asarray(group[kk])
@@ -424,6 +503,10 @@ class BhTomoDb():
 #                 else:
 #                     m.__dict__[kk] = self._load_object(gr2, m)
                 m.__dict__[kk] = self._load_object(gr2, m)
+        if len(columns) > 0:
+            m.traces = Mog.new_traces(m.data.ntrace)
+            for kk in columns:
+                m.traces[kk] = columns[kk]
         return m
 
     def _load_model(self, group):
@@ -446,6 +529,23 @@ class BhTomoDb():
         return m
     
 
+def _read_ramac(basename):
+    """
+    Parse a RAMAC data set in a worker process (see BhTomoDb.import_ramac)
+    """
+    t0 = time.perf_counter()
+    try:
+        name = os.path.basename(basename)
+        mogdata = MogData(name)
+        mogdata.readRAMAC(basename, memmap=True)  # traces are remapped, not copied, when unpickled
+        mog = Mog(name, mogdata)
+        err = ''
+    except Exception as e:
+        mog = None
+        err = str(e)
+    return basename, mog, time.perf_counter() - t0, err
+
+
 if __name__ == '__main__':
 
     if os.path.isfile('/tmp/test_db.h5'):
@@ -486,7 +586,7 @@ if __name__ == '__main__':
     print(db.modified)
     
     db.save()
-    db.f.close()
+    db.close()
     shutil.copyfile('/tmp/test_db.h5', '/tmp/test_db2.h5')
     
     db.filename = '/tmp/test_db.h5'
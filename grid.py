@@ -24,8 +24,12 @@ along with this program. If not, see <http://www.gnu.org/licenses/>.
 """
 
 import math
+import hashlib
+import threading
+import time
+from collections import OrderedDict
 import numpy as np
-from scipy.sparse import csr_matrix
+from scipy.sparse import csr_matrix, identity, kron
 import h5py
 
 from ttcrpy import rgrid
@@ -34,6 +38,120 @@ from BhTomoPy.utils import nargout
 import BhTomoPy.covar as covar
 
 
+class RayMatrixCache(object):
+    """
+    Cache of straight-ray projection matrices
+
+    Matrices are indexed by a digest of the grid node coordinates, cell
+    sizes, Tx and Rx coordinates and anisotropy flag (see key).  The last
+    maxsize matrices used are kept in memory.  If a group (an HDF5 group,
+    e.g. in the database file) is attached (see attach), matrices are also
+    stored on disk as CSR components, and are thus found again in a later
+    session; at most max_disk matrices are kept on disk, the oldest being
+    removed first.
+
+    Matrices returned are shared, their arrays are set read-only.
+    """
+
+    def __init__(self, maxsize=8, max_disk=32):
+        self.maxsize = maxsize
+        self.max_disk = max_disk
+        self.group = None
+        self._owner = None
+        self._matrices = OrderedDict()
+        self._lock = threading.Lock()
+
+    def attach(self, group, owner):
+        """
+        Store matrices in HDF5 group, on behalf of owner (e.g. a BhTomoDb)
+        """
+        with self._lock:
+            self.group = group
+            self._owner = owner
+
+    def detach(self, owner):
+        """
+        Stop storing matrices on disk, if group was attached by owner
+        """
+        with self._lock:
+            if self._owner is owner:
+                self.group = None
+                self._owner = None
+
+    @staticmethod
+    def key(grx, grz, Tx, Rx, aniso, gry=None):
+        h = hashlib.blake2b(digest_size=16)
+        arrays = [grx, grz, Tx, Rx]
+        if gry is not None:
+            arrays.append(gry)
+        for a in arrays:
+            a = np.ascontiguousarray(a, dtype=np.float64)
+            h.update(str(a.shape).encode())
+            h.update(a)
+        cell = [grx[1] - grx[0], grz[1] - grz[0]]
+        if gry is not None and len(gry) > 1:
+            cell.append(gry[1] - gry[0])
+        h.update(np.array(cell, dtype=np.float64))
+        h.update(str(bool(aniso)).encode())
+        return h.hexdigest()
+
+    def get(self, key):
+        """
+        Matrix of key, or None if it is not in cache
+        """
+        with self._lock:
+            if key in self._matrices:
+                self._matrices.move_to_end(key)
+                return self._matrices[key]
+            if self.group is not None and key in self.group:
+                g = self.group[key]
+                L = csr_matrix((g['data'][()], g['indices'][()], g['indptr'][()]),
+                               shape=tuple(g.attrs['shape']))
+                self._add(key, L)
+                return L
+        return None
+
+    def put(self, key, L):
+        L = csr_matrix(L)
+        with self._lock:
+            self._add(key, L)
+            if self.group is not None and key not in self.group:
+                g = self.group.create_group(key)
+                g.create_dataset('data', data=L.data, compression='gzip')
+                g.create_dataset('indices', data=L.indices, compression='gzip')
+                g.create_dataset('indptr', data=L.indptr, compression='gzip')
+                g.attrs['shape'] = L.shape
+                g.attrs['time'] = time.time()
+                self._trim_disk()
+                self.group.file.flush()
+        return L
+
+    def clear(self):
+        """
+        Empty in-memory cache (matrices on disk are kept)
+        """
+        with self._lock:
+            self._matrices.clear()
+
+    def _trim_disk(self):
+        if len(self.group) <= self.max_disk:
+            return
+        keys = sorted(self.group.keys(), key=lambda k: self.group[k].attrs.get('time', 0.0))
+        for k in keys[:len(keys) - self.max_disk]:
+            del self.group[k]
+
+    def _add(self, key, L):
+        for a in (L.data, L.indices, L.indptr):
+            a.flags.writeable = False
+        self._matrices[key] = L
+        self._matrices.move_to_end(key)
+        while len(self._matrices) > self.maxsize:
+            self._matrices.popitem(last=False)
+
+
+straight_rays_cache = RayMatrixCache()
+
+
 class Grid(object):
     """
     Superclass for 2D and 3D grids
@@ -57,6 +175,7 @@ class Grid(object):
         self.Rx_Z_water = np.nan
         self.in_vect = np.array([])
         self.nthreads = 1
+        self._derivatives = {}  # see derivative
 
     def getNumberOfCells(self):
         """
@@ -91,6 +210,96 @@ class Grid(object):
     def dz(self):
         return self.grz[1] - self.grz[0]
 
+    def derivative(self, order, normalize=False, weights=None):
+        """
+        Compute spatial derivative operators for grid _cells_
+
+        For 1st order:
+            forward operator is (u_{i+1} - u_i)/dx
+            centered operator is (u_{i+1} - u_{i-1})/(2dx)
+            backward operator is (u_i - u_{i-1})/dx
+
+        For 2nd order:
+            forward operator is (u_i - 2u_{i+1} + u_{i+2})/dx^2
+            centered operator is (u_{i-1} - 2u_i + u_{i+1})/dx^2
+            backward operator is (u_{i-2} - 2u_{i-1} + u_i)/dx^2
+
+        Operators along each axis (see derivative_1d) are extended to the
+        grid with Kronecker products with identity matrices.  They are kept
+        in the grid, and built again only if order, normalize or the cells
+        change.
+
+        Input:
+            order: 1 or 2
+            normalize: divide by cell size (otherwise cell size is 1)
+            weights: (wx, wy, wz), factors applied to Dx, Dy and Dz, e.g.
+                     for anisotropic smoothing
+
+        Output:
+            Dx, Dy, Dz: sparse matrices, ncell x ncell (Dy is zero for 2D grids)
+        """
+        ncell = self.getNcell()
+        if normalize:
+            h = tuple(gr[1] - gr[0] if len(gr) > 1 else 1.0 for gr in (self.grx, self.gry, self.grz))
+        else:
+            h = (1.0, 1.0, 1.0)
+        key = (order, ncell, h)
+        if key not in self._derivatives:
+            if len(ncell) == 3:
+                n = ncell
+            else:
+                n = (ncell[0], 1, ncell[1])
+
+            D = []
+            for axis in range(3):
+                op = [identity(m, format='csr') for m in n]
+                if n[axis] > 1:
+                    op[axis] = Grid.derivative_1d(n[axis], order, h[axis])
+                else:
+                    op[axis] = csr_matrix((1, 1))    # no derivative along missing axis
+                d = kron(op[0], kron(op[1], op[2]), format='csr')
+                for a in (d.data, d.indices, d.indptr):
+                    a.flags.writeable = False
+                D.append(d)
+            self._derivatives[key] = tuple(D)
+
+        Dx, Dy, Dz = self._derivatives[key]
+        if weights is not None:
+            Dx = Dx * weights[0]
+            Dy = Dy * weights[1]
+            Dz = Dz * weights[2]
+        return Dx, Dy, Dz
+
+    @staticmethod
+    def derivative_1d(n, order, h=1.0):
+        """
+        Derivative operator along one axis of n cells (n x n sparse matrix)
+
+        For 1st order, forward, centered and backward operators are used at
+        first, inner and last cells; for 2nd order, the centered operator
+        is used at inner cells, and the forward and backward ones at first
+        and last cells (see derivative).  The operator is zero if n is too
+        small for the stencil.
+        """
+        if order == 1:
+            if n < 2:
+                return csr_matrix((n, n))
+            j = np.vstack((np.arange(n) - 1, np.arange(n) + 1)).T
+            j[0] = [0, 1]
+            j[-1] = [n - 2, n - 1]
+            v = np.tile(np.array([-0.5, 0.5]), (n, 1))
+            v[0] = [-1.0, 1.0]
+            v[-1] = [-1.0, 1.0]
+            v /= h
+        else:
+            if n < 3:
+                return csr_matrix((n, n))
+            c = np.clip(np.arange(n), 1, n - 2)
+            j = np.vstack((c - 1, c, c + 1)).T
+            v = np.tile(np.array([1.0, -2.0, 1.0]), (n, 1)) / (h * h)
+        i = np.repeat(np.arange(n), j.shape[1])
+        return csr_matrix((v.flatten(), (i, j.flatten())), shape=(n, n))
+
     @staticmethod
     def lsplane(X, nout=2):
         """
@@ -399,6 +608,8 @@ class Grid2D(Grid):
 
         Output:
             L: ray projection matrix, ndata by ncell (ndata x 2*ncell for anisotropic media)
+
+        Matrices are kept in straight_rays_cache, and are shared (read-only)
         """
         if ind is None:
             ind = np.ones((self.Tx.shape[0],), dtype=bool)
@@ -414,9 +625,13 @@ class Grid2D(Grid):
         else:
             grz = np.arange(self.grz[0], self.grz[-1] + small, dz)
 
-        return rgrid.Grid2d.data_kernel_straight_rays(self.Tx[np.ix_(ind, [0, 2])],
-                                                      self.Rx[np.ix_(ind, [0, 2])],
-                                                      grx, grz, aniso)
+        Tx = self.Tx[np.ix_(ind, [0, 2])]
+        Rx = self.Rx[np.ix_(ind, [0, 2])]
+        key = RayMatrixCache.key(grx, grz, Tx, Rx, aniso)
+        L = straight_rays_cache.get(key)
+        if L is None:
+            L = straight_rays_cache.put(key, rgrid.Grid2d.data_kernel_straight_rays(Tx, Rx, grx, grz, aniso))
+        return L
 
     def getCellCenter(self, dx=None, dz=None):
         """
@@ -467,117 +682,6 @@ class Grid2D(Grid):
 
         return True
 
-    def derivative(self, order, normalize=False):
-        """
-        Compute spatial derivative operators for grid _cells_
-
-        For 1st order:
-            forward operator is (u_{i+1} - u_i)/dx
-            centered operator is (u_{i+1} - u_{i-1})/(2dx)
-            backward operator is (u_i - u_{i-1})/dx
-
-        For 2nd order:
-            forward operator is (u_i - 2u_{i+1} + u_{i+2})/dx^2
-            centered operator is (u_{i-1} - 2u_i + u_{i+1})/dx^2
-            backward operator is (u_{i-2} - 2u_{i-1} + u_i)/dx^2
-        """
-        dx = 1
-        dz = 1
-        if normalize:
-            dx = self.dx()
-            dz = self.dz()
-
-        nx = len(self.grx) - 1
-        nz = len(self.grz) - 1
-
-        if order == 1:
-
-            # forward operator is (u_{i+1} - u_i)/dx
-            # centered operator is (u_{i+1} - u_{i-1})/(2dx)
-            # backward operator is (u_i - u_{i-1})/dx
-
-            idx = 1 / dx
-            idz = 1 / dz
-
-            i = np.kron(np.arange(nx * nz), np.ones((2, ), dtype=int))
-            j = np.zeros((nz * nx * 2, ), dtype=int)
-            v = np.zeros((nz * nx * 2, ))
-
-            jj = np.vstack((np.arange(nz), nz + np.arange(nz))).T
-            jj = jj.flatten()
-            j[:2 * nz] = jj
-            vd = idx * np.tile(np.array([-1, 1]), (nz, ))
-            v[:2 * nz] = vd
-
-            jj = np.vstack((-nz + np.arange(nz), nz + np.arange(nz))).T
-            jj = jj.flatten()
-            for n in range(1, nx - 1):
-                j[n * 2 * nz:(n + 1) * 2 * nz] = n * nz + jj
-                v[n * 2 * nz:(n + 1) * 2 * nz] = 0.5 * vd
-
-            jj = np.vstack((-nz + np.arange(nz), np.arange(nz))).T
-            jj = jj.flatten()
-            j[(nx - 1) * 2 * nz:nx * 2 * nz] = (nx - 1) * nz + jj
-            v[(nx - 1) * 2 * nz:nx * 2 * nz] = vd
-
-            Dx = csr_matrix((v, (i, j)))
-
-            jj = np.vstack((np.hstack((0, np.arange(nz - 1))),
-                            np.hstack((np.arange(1, nz), nz - 1)))).T
-            jj = jj.flatten()
-            vd = idz * np.hstack((np.array([-1, 1]),
-                                  np.tile(np.array([-0.5, 0.5]), (nz - 2,)), np.array([-1, 1])))
-
-            for n in range(nx):
-                j[n * 2 * nz:(n + 1) * 2 * nz] = n * nz + jj
-                v[n * 2 * nz:(n + 1) * 2 * nz] = vd
-
-            Dz = csr_matrix((v, (i, j)))
-        else:  # 2nd order
-
-            # forward operator is (u_i - 2u_{i+1} + u_{i+2})/dx^2
-            # centered operator is (u_{i-1} - 2u_i + u_{i+1})/dx^2
-            # backward operator is (u_{i-2} - 2u_{i-1} + u_i)/dx^2
-
-            idx2 = 1 / (dx * dx)
-            idz2 = 1 / (dz * dz)
-
-            i = np.kron(np.arange(nx * nz), np.ones((3, ), dtype=np.int64))
-            j = np.zeros((nz * nx * 3, ), dtype=np.int64)
-            v = np.zeros((nz * nx * 3, ))
-
-            jj = np.vstack((np.arange(nz), nz + np.arange(nz), 2 * nz + np.arange(nz))).T
-            jj = jj.flatten()
-            j[:3 * nz] = jj
-            vd = idx2 * np.tile(np.array([1.0, -2.0, 1.0]), (nz, ))
-            v[:3 * nz] = vd
-
-            for n in range(1, nx - 1):
-                j[n * 3 * nz:(n + 1) * 3 * nz] = (n - 1) * nz + jj
-                v[n * 3 * nz:(n + 1) * 3 * nz] = vd
-
-            j[(nx - 1) * 3 * nz:nx * 3 * nz] = (nx - 3) * nz + jj
-            v[(nx - 1) * 3 * nz:nx * 3 * nz] = vd
-
-            Dx = csr_matrix((v, (i, j)))
-
-            jj = np.vstack((np.hstack((0, np.arange(nz - 2), nz - 3)),
-                            np.hstack((1, np.arange(1, nz - 1), nz - 2)),
-                            np.hstack((2, np.arange(2, nz), nz - 1)))).T
-            jj = jj.flatten()
-            vd = vd * idz2 / idx2
-
-            for n in range(nx):
-                j[n * 3 * nz:(n + 1) * 3 * nz] = n * nz + jj
-                v[n * 3 * nz:(n + 1) * 3 * nz] = vd
-
-            Dz = csr_matrix((v, (i, j)))
-
-        # no derivative along y, empty Dy matrix
-        Dy = csr_matrix(Dx.shape)
-
-        return Dx, Dy, Dz
-
     def preFFTMA(self, cm):
         """
         Compute matrix G for FFT-MA simulations
@@ -700,7 +804,12 @@ class Grid2D(Grid):
 
 class Grid3D(Grid):
     """
-    Class for 3D grids -> TO COMPLETE!!!
+    Class for 3D grids
+
+    Important: as for 2D grids, slowness vectors are in column-major order,
+            i.e. cell (i, j, k) along (X, Y, Z) is at index (i*ny + j)*nz + k,
+            and the vector should be reshaped as slowness.reshape(nx, ny, nz)
+
     """
     def __init__(self, grx=None, gry=None, grz=None, nthreads=1):
         Grid.__init__(self)
@@ -721,6 +830,181 @@ class Grid3D(Grid):
         self.x0 = np.array([])
         self.type = None
 
+    def __reduce__(self):
+        # cgrid excluded voluntarily, see Grid2D.__reduce__
+        return (Grid3D.rebuild, (self.grx, self.gry, self.grz, self.cont, self.Tx, self.Rx,
+                                 self.TxCosDir, self.RxCosDir, self.border,
+                                 self.Tx_Z_water, self.Rx_Z_water, self.in_vect,
+                                 self.nthreads, self.nsnx, self.nsny, self.nsnz, self.flip,
+                                 self.borehole_x0, self.x0, self.type))
+
+    @staticmethod
+    def rebuild(grx, gry, grz, cont, Tx, Rx, TxCosDir, RxCosDir, border, Tx_Z_water,
+                Rx_Z_water, in_vect, nthreads, nsnx, nsny, nsnz, flip, borehole_x0, x0, _type):
+
+        g = Grid3D(grx, gry, grz, nthreads)
+
+        g.cont = cont
+        g.Tx = Tx
+        g.Rx = Rx
+        g.TxCosDir = TxCosDir
+        g.RxCosDir = RxCosDir
+        g.border = border
+        g.Tx_Z_water = Tx_Z_water
+        g.Rx_Z_water = Rx_Z_water
+        g.in_vect = in_vect
+        g.nsnx = nsnx
+        g.nsny = nsny
+        g.nsnz = nsnz
+        g.flip = flip
+        g.borehole_x0 = borehole_x0
+        g.x0 = x0
+        g.type = _type
+
+        return g
+
+    def raytrace(self, slowness, Tx, Rx, t0=None, xi=None, theta=None,
+                 compute_L=True, return_rays=True):
+        """
+        Compute traveltimes, raypaths and build ray projection matrix
+
+        Usages:
+            tt,rays,L = grid.raytrace(slowness,Tx,Rx,t0)
+            tt,L = grid.raytrace(slowness,Tx,Rx,t0,return_rays=False)
+            tt,rays = grid.raytrace(slowness,Tx,Rx,t0,compute_L=False)
+
+        Input:
+            slowness: vector of slowness values at grid cells (ncell x 1)
+            Tx: X, Y & Z coordinates of sources points (ndata x 3)
+            Rx: X, Y & Z coordinates of receivers      (ndata x 3)
+            t0 (optional): time at sources (ndata x 1)
+            xi, theta: not used, anisotropy is not implemented for 3D grids
+        Output (in the order of ttcrpy, which differs from Grid2D.raytrace):
+            tt: vector of traveltimes, ndata by 1
+            rays: tuple containing the matrices of coordinates of the ray
+                  paths, ndata by 1.  Each matrix is nPts by 3
+            L: ray projection matrix, ndata by ncell
+
+        Raytracing is done with the shortest path method, in nthreads threads
+        """
+
+        # check input data consistency
+
+        if Tx.ndim != 2 or Rx.ndim != 2:
+            raise ValueError('Tx and Rx should be 2D arrays')
+
+        if Tx.shape[1] != 3 or Rx.shape[1] != 3:
+            raise ValueError('Tx and Rx should be ndata x 3')
+
+        if Tx.shape != Rx.shape:
+            raise ValueError('Tx and Rx should be of equal size')
+
+        if len(slowness) != self.getNumberOfCells():
+            raise ValueError('Length of slowness vector should equal number of cells')
+
+        if xi is not None or theta is not None:
+            raise ValueError('Anisotropy not implemented for 3D grids')
+
+        if t0 is None:
+            t0 = np.zeros([Tx.shape[0], ])
+        elif len(t0) != Tx.shape[0]:
+            raise ValueError('Length of t0 should equal number of Tx')
+
+        if self.cgrid is None:
+            self.cgrid = rgrid.Grid3d(self.grx, self.gry, self.grz, cell_slowness=True, method='SPM',
+                                      nsnx=self.nsnx, nsny=self.nsny, nsnz=self.nsnz,
+                                      n_threads=self.nthreads)
+
+        # sources are given with t0 in first column
+        src = np.hstack((np.asarray(t0, dtype=np.float64).reshape(-1, 1), Tx))
+        return self.cgrid.raytrace(src, Rx, slowness=slowness, compute_L=compute_L,
+                                   return_rays=return_rays)
+
+    def getForwardStraightRays(self, ind=None, dx=None, dy=None, dz=None, aniso=False):
+        """
+        Build ray projection matrix for straight rays
+
+        Input:
+            ind: indices of Tx-Rx pairs for which matrix is built
+            dx: grid cell size along X (default is size of grid instance)
+            dy: grid cell size along Y (default is size of grid instance)
+            dz: grid cell size along Z (default is size of grid instance)
+            aniso: must be False, anisotropy is not implemented for 3D grids
+
+        Output:
+            L: ray projection matrix, ndata by ncell
+
+        Matrices are kept in straight_rays_cache, and are shared (read-only)
+        """
+        if aniso:
+            raise ValueError('Anisotropy not implemented for 3D grids')
+
+        if ind is None:
+            ind = np.ones((self.Tx.shape[0],), dtype=bool)
+
+        small = 0.00001
+        if dx is None or dx == 0:
+            grx = self.grx
+        else:
+            grx = np.arange(self.grx[0], self.grx[-1] + small, dx)
+
+        if dy is None or dy == 0:
+            gry = self.gry
+        else:
+            gry = np.arange(self.gry[0], self.gry[-1] + small, dy)
+
+        if dz is None or dz == 0:
+            grz = self.grz
+        else:
+            grz = np.arange(self.grz[0], self.grz[-1] + small, dz)
+
+        Tx = self.Tx[ind, :]
+        Rx = self.Rx[ind, :]
+        key = RayMatrixCache.key(grx, grz, Tx, Rx, aniso, gry)
+        L = straight_rays_cache.get(key)
+        if L is None:
+            L = rgrid.Grid3d.data_kernel_straight_rays(Tx, Rx, grx, gry, grz, centers=False)
+            L = straight_rays_cache.put(key, L)
+        return L
+
+    def getCellCenter(self, dx=None, dy=None, dz=None):
+        """
+        Returns a nCell x 3 array containing the coordinates of the center of the cells
+        """
+        if dx is None:
+            dx = self.grx[1] - self.grx[0]
+        if dy is None:
+            dy = self.gry[1] - self.gry[0]
+        if dz is None:
+            dz = self.grz[1] - self.grz[0]
+
+        xmin = self.grx[0] + dx / 2.0
+        ymin = self.gry[0] + dy / 2.0
+        zmin = self.grz[0] + dz / 2.0
+        xmax = self.grx[-1] - dx / 3.0  # divide by 3 to avoid truncation error
+        ymax = self.gry[-1] - dy / 3.0
+        zmax = self.grz[-1] - dz / 3.0
+        nx = np.int64(np.ceil((xmax - xmin) / dx) + 0.001)
+        ny = np.int64(np.ceil((ymax - ymin) / dy) + 0.001)
+        nz = np.int64(np.ceil((zmax - zmin) / dz) + 0.001)
+
+        x, y, z = np.meshgrid(xmin + dx * np.arange(nx), ymin + dy * np.arange(ny),
+                              zmin + dz * np.arange(nz), indexing='ij')
+        return np.vstack((x.flatten(), y.flatten(), z.flatten())).T
+
+    def checkCenter(self, x, y, z):
+        """
+        Verify if given coordinates correspond to the center of the cells
+        """
+        for gr, c in ((self.grx, x), (self.gry, y), (self.grz, z)):
+            d = gr[1] - gr[0]
+            cc = np.arange(gr[0] + d / 2.0, gr[-1] - d / 3.0, d)  # divide by 3 to avoid truncation error
+            if cc.size != np.size(c):
+                return False
+            if np.any(np.abs(c - cc) > 1000.0 * np.finfo(float).eps):
+                return False
+        return True
+
 
 if __name__ == '__main__':
 
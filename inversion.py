@@ -260,7 +260,11 @@ def invLSQR(params, data, idata, grid, L=None, app=None, ui=None):
 
     # Getting our spatial derivative elements
     # These will smoothen the subsequent slowness/velocity model
-    Dx, Dy, Dz = grid.derivative(params.order)
+    Dx, Dy, Dz = grid.derivative(params.order, weights=(params.alphax, params.alphay, params.alphaz))
+    if grid.gry.size > 1:
+        D = spy.sparse.vstack([Dx, Dy, Dz])
+    else:
+        D = spy.sparse.vstack([Dx, Dz])
 
     for noIter in range(params.numItCurved + params.numItStraight):
         if ui is not None and app is not None:
@@ -285,9 +289,9 @@ def invLSQR(params, data, idata, grid, L=None, app=None, ui=None):
         if noIter == 0:
             s_o = mean_s * np.ones(L.shape[1]).T
 
-        A = spy.sparse.vstack([L, Dx * params.alphax, Dz * params.alphaz])
+        A = spy.sparse.vstack([L, D])
 
-        b = np.concatenate((dt.T, np.zeros(Dx.shape[0]+Dz.shape[0]).reshape((-1,1)))).flatten()
+        b = np.concatenate((dt.T, np.zeros(D.shape[0]).reshape((-1,1)))).flatten()
 
         if not np.all(cont == 0) and params.useCont == 1:
             # TODO: faire les modifications aux matrices A et b avec les contraintes
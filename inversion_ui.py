@@ -28,7 +28,7 @@ import numpy as np
 from mpl_toolkits.axes_grid1 import make_axes_locatable
 from scipy import interpolate
 
-from model import Model
+from model import Model, ModelDataset
 from inversion import invLSQR, InvLSQRParams, invGeostat
 from utils import set_tick_arrangement, ComputeThread
 from utils_ui import MyQLabel, chooseModel, save_warning
@@ -52,6 +52,9 @@ class InversionUI(QtWidgets.QFrame):
         self.init_UI()
         self.initinvUI()
         self.model = None
+        self.dataset = None  # ModelDataset of the selected mogs
+        self.data = None  # data matrix of dataset, for data_key
+        self.data_key = None  # dataset id & version of data
 
         # Signals
         self.InvIterationDone.connect(self.handleInvIterationDone) 
@@ -281,8 +284,15 @@ class InversionUI(QtWidgets.QFrame):
 
         elif self.T_and_A_combo.currentText() == 'Traveltime':
             self.lsqrParams.tomoAtt = 0
-            data, idata = Model.getModelData(self.model, self.lsqrParams.selectedMogs, 'tt')
-            data = np.concatenate((self.model.grid.Tx[idata, :], self.model.grid.Rx[idata, :], data, self.model.grid.TxCosDir[idata, :], self.model.grid.RxCosDir[idata, :]), axis=1)
+            if self.dataset is None or self.dataset.model is not self.model:
+                self.dataset = ModelDataset(self.model)
+            self.dataset.select(self.lsqrParams.selectedMogs, 'tt')
+            data_key = (id(self.dataset), self.dataset.version)
+            if data_key != self.data_key:
+                self.data = self.dataset.matrix()
+                self.data_key = data_key
+            data = self.data
+            idata = self.dataset.idata
 
         # TODO: Faire les autres cas du self.T_and_A_combo
 
@@ -612,7 +622,7 @@ class InversionUI(QtWidgets.QFrame):
     def update_Tx_elev(self):
         mog = self.model.mogs[self.mog_list.selectedIndexes()[0].row()]
         n = int(self.trace_num_edit.text()) - 1
-        elev = np.unique(mog.data.Tx_z)[n]
+        elev = mog.geometry.uTx_z[n]
 
         if not self.entire_coverage_check.isChecked():
             self.value_elev_label.setText(str(elev))
@@ -1162,13 +1172,8 @@ class RaysFig(FigureCanvasQTAgg):
 
         n = int(self.ui.trace_num_edit.text()) - 1
 
-        Tx = np.unique(mog.data.Tx_z)
-        print(Tx)
-
         ind1 = np.where(mog.tt != -1.0)[0]
-        ind2 = np.where(mog.data.Tx_z[ind1] == Tx[n])[0]
-        print(ind1)
-        print(ind2)
+        ind2 = np.where(mog.geometry.Tx_ind[ind1] == n)[0]
 
         rmax = 1.001 * max(np.abs(res.flatten()))
         rmin = -rmax
@@ -1283,7 +1288,7 @@ class ResidualsFig(FigureCanvasQTAgg):
 
     def plot_residuals(self):
         model = self.ui.models[self.ui.model_ind]
-        data, idata = Model.getModelData(model, self.ui.air, self.ui.lsqrParams.selectedMogs, 'tt')
+        data, idata = Model.getModelData(model, self.ui.lsqrParams.selectedMogs, 'tt')
         data = np.concatenate((model.grid.Tx[idata, :], model.grid.Rx[idata, :], data), axis=1)
 
         hyp = np.sqrt(np.sum((data[:, 0:3] - data[:, 3:6])**2, axis=1))
@@ -1300,7 +1305,7 @@ class ResidualsFig(FigureCanvasQTAgg):
         res = self.ui.tomo.invData.res[:, nIt - 1]
         vres = np.var(res)
 
-        depth, i = Model.getModelData(model, self.ui.air, self.ui.lsqrParams.selectedMogs, 'depth', type2='tt')
+        depth, i = Model.getModelData(model, self.ui.lsqrParams.selectedMogs, 'depth', type2='tt')
         dTx = np.sort(np.unique(depth[:, 0]))
         print(dTx)
         dRx = np.sort(np.unique(depth[:, 1]))
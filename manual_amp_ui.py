@@ -680,7 +680,7 @@ class StatsFig1(FigureCanvasQTAgg):
         ind = np.nonzero(done == 1)[0]
         print(ind)
 
-        tt, t0 = mog.getCorrectedTravelTimes()
+        tt, t0 = mog.getCorrectedTravelTimes(show=True)
         print(tt)
         et = mog.et[ind]
         tt = tt[ind]
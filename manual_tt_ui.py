@@ -877,8 +877,7 @@ class LowerFig(FigureCanvasQTAgg):
         self.ax.invert_yaxis()
 
         if self.tt.main_data_radio.isChecked():
-            current_trc = mog.data.Tx_z[n]
-            z = np.where(mog.data.Tx_z == current_trc)[0]
+            z = mog.geometry.gather(mog.geometry.Tx_ind[n])
 
             data = mog.data.rdata[:, z[0]:z[-1]]
             cmax = max(np.abs(mog.data.rdata.flatten()))
@@ -917,9 +916,7 @@ class LowerFig(FigureCanvasQTAgg):
 
             if self.tt.veloc_checkbox.isChecked():
                 vapp = self.calculate_Vapp()
-                hyp = np.sqrt((mog.data.Tx_x[picked_tt_ind] - mog.data.Rx_x[picked_tt_ind])**2 +
-                              (mog.data.Tx_y[picked_tt_ind] - mog.data.Rx_y[picked_tt_ind])**2 +
-                              (mog.data.Tx_z[picked_tt_ind] - mog.data.Rx_z[picked_tt_ind])**2)
+                hyp = mog.geometry.dist[picked_tt_ind]
                 tvapp = hyp / vapp
 
                 self.vapp_plot.set_ydata(tvapp)
@@ -1024,9 +1021,7 @@ class LowerFig(FigureCanvasQTAgg):
             return vapp
 
         # hyp is the distance between Tx and Rx
-        hyp = np.sqrt((mog.data.Tx_x[ind2] - mog.data.Rx_x[ind2])**2 +
-                      (mog.data.Tx_y[ind2] - mog.data.Rx_y[ind2])**2 +
-                      (mog.data.Tx_z[ind2] - mog.data.Rx_z[ind2])**2)
+        hyp = mog.geometry.dist[ind2]
 
         tt = mog.tt[ind2]
         et = mog.et[ind2]
@@ -1122,16 +1117,12 @@ class StatsFig1(FigureCanvasQTAgg):
         done = (mog.tt_done + mog.in_vect.astype(int)) - 1
         ind = np.nonzero(done == 1)[0]
 
-        tt, t0 = mog.getCorrectedTravelTimes()
+        tt, t0 = mog.getCorrectedTravelTimes(show=True)
         et = mog.et[ind]
         tt = tt[ind]
 
-        hyp = np.sqrt((mog.data.Tx_x[ind] - mog.data.Rx_x[ind])**2 +
-                      (mog.data.Tx_y[ind] - mog.data.Rx_y[ind])**2 +
-                      (mog.data.Tx_z[ind] - mog.data.Rx_z[ind])**2)
-        dz = mog.data.Rx_z[ind] - mog.data.Tx_z[ind]
-
-        theta = 180 / np.pi * np.arcsin(dz / hyp)
+        hyp = mog.geometry.dist[ind]
+        theta = mog.geometry.theta[ind]
 
         vapp = hyp / tt
 
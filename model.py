@@ -19,8 +19,20 @@ You should have received a copy of the GNU General Public License
 along with this program. If not, see <http://www.gnu.org/licenses/>.
 """
 
+import itertools
+
 import numpy as np
 
+from mog import Mog, fingerprint
+
+# MOG attributes holding data & standard deviations, for each type of model data
+MODEL_DATA_TYPES = {'tt': ('tt', 'et'),
+                    'amp': ('tauApp', 'tauApp_et'),
+                    'fce': ('tauFce', 'tauFce_et'),
+                    'hyb': ('tauHyb', 'tauHyb_et')}
+
+# versions of ModelDataset are numbered across instances (see ModelDataset.update)
+_dataset_versions = itertools.count(1)
 
 class Model:
     def __init__(self, name=''):
@@ -48,113 +60,216 @@ class Model:
 
         return boreholes
 
+    @staticmethod
+    def getModelDataset(model, selected_mogs, types=('tt',)):
+        """
+        Data of all traces of the selected MOGs of a model
+
+        The output is allocated once and filled MOG by MOG, for all
+        requested types (e.g. ('tt', 'amp')).  It is a structured array
+        with, for each trace, the fields
+            id: trace number in the dataset
+            mog: index of the MOG in model.mogs
+            no: trace number in the MOG
+            in_vect: trace kept after pruning
+        and, for each type ('tt', 'amp', 'fce' or 'hyb')
+            type, type_et: corrected travel time or amplitude datum, and its
+                           standard deviation
+            type_ok: datum has been picked (is not -1)
+        or, for type 'depth', Tx_z and Rx_z (original depths of Tx and Rx).
+        """
+        mogs = [model.mogs[i] for i in selected_mogs]
+        ntrace = [mog.data.ntrace for mog in mogs]
+        if 'tt' in types:
+            # air shots of all MOGs are fitted at once rather than in getCorrectedTravelTimes
+            Mog.fit_air_shots([shot for mog in mogs if mog.useAirShots for shot in (mog.av, mog.ap)
+                               if shot is not None and shot.name != ''])
+
+        fields = [('id', np.int64), ('mog', np.int32), ('no', np.int64), ('in_vect', bool)]
+        for type_ in types:
+            if type_ == 'depth':
+                fields += [('Tx_z', np.float64), ('Rx_z', np.float64)]
+            elif type_ in MODEL_DATA_TYPES:
+                fields += [(type_, np.float64), (type_ + '_et', np.float64), (type_ + '_ok', bool)]
+            else:
+                raise ValueError('Unknown data type: ' + str(type_))
+
+        dataset = np.empty(sum(ntrace), dtype=fields)
+        dataset['id'] = np.arange(dataset.size)
+        dataset['mog'] = np.repeat(np.asarray(selected_mogs, dtype=np.int32), ntrace)
+
+        start = 0
+        for mog, n in zip(mogs, ntrace):
+            data = dataset[start:start + n]
+            data['no'] = np.arange(n)
+            data['in_vect'] = np.asarray(mog.in_vect).flatten()
+            for type_ in types:
+                if type_ == 'depth':
+                    data['Tx_z'] = np.asarray(mog.Tx_z_orig).flatten()
+                    data['Rx_z'] = np.asarray(mog.Rx_z_orig).flatten()
+                    continue
+                value, et = MODEL_DATA_TYPES[type_]
+                data[type_ + '_ok'] = np.asarray(getattr(mog, value)).flatten() != -1
+                if type_ == 'tt':
+                    data[type_] = np.asarray(mog.getCorrectedTravelTimes()[0]).flatten()
+                else:
+                    data[type_] = np.asarray(getattr(mog, value)).flatten()
+                data[type_ + '_et'] = mog.f_et * np.asarray(getattr(mog, et)).flatten()
+            start += n
+
+        return dataset
+
     @staticmethod
     def getModelData(model, selected_mogs, type1, vlim=0, type2=''):
-        data = np.array([])
-        ind = np.array([])
-        
-        tt = np.array([])
-        et = np.array([])
-        in_vect = np.array([])
-        mogs = []
-        for i in selected_mogs:
-            mogs.append(model.mogs[i])
-
-        if type1 == 'tt':
-            fac_dt = 1
-
-            mog = mogs[0]
-            ind = np.not_equal(mog.tt, -1).T
-            tt, t0 = mog.getCorrectedTravelTimes()
-            tt = tt.T
-            et = fac_dt * mog.f_et * mog.et.T
-            in_vect = mog.in_vect.T
-            no = np.arange(mog.data.ntrace).T
-
-            if len(mogs) > 1:
-                for n in range(1, len(model.mogs)):
-                    mog = mogs[n]
-                    ind = np.concatenate((ind, np.not_equal(mog.tt, -1).T), axis=0)
-                    tt = np.concatenate((tt, mog.getCorrectedTravelTimes()[0].T), axis=0)
-                    et = np.concatenate((et, fac_dt * mog.et * mog.f_et.T), axis=0)
-                    in_vect = np.concatenate((in_vect, mog.in_vect.T), axis=0)
-                    no = np.concatenate((no, np.arange(mog.ntrace + 1).T), axis=0)
-
-        elif type1 == "amp":
-            mog = mogs[0]
-            ind = np.not_equal(mog.tauApp, -1).T
-            tt = mog.tauApp.T
-            et = mog.tauApp_et.T * mog.f_et
-            in_vect = mog.in_vect.T
-            no = np.arange(mog.data.ntrace).T
-
-            if len(mogs) > 1:
-                for n in range(1, len(model.mogs)):
-                    mog = mogs[n]
-                    ind = np.concatenate((ind, np.not_equal(mog.tauApp, -1).T), axis=0)
-                    tt = np.concatenate((tt, mog.tauApp.T), axis=0)
-                    et = np.concatenate((et, mog.tauApp_et.T * mog.f_et), axis=0)
-                    in_vect = np.concatenate((in_vect, mog.in_vect.T), axis=0)
-                    no = np.concatenate((no, np.arange(mog.ntrace + 1).T), axis=0)
-
-        elif type1 == "fce":
-            mog = mogs[0]
-            ind = np.not_equal(mog.tauFce, -1).T
-            tt = mog.tauFce.T
-            et = mog.tauFce_et.T * mog.f_et
-            in_vect = mog.in_vect.T
-            no = np.arange(mog.data.ntrace).T
-
-            if len(mogs) > 1:
-                for n in range(1, len(model.mogs)):
-                    mog = mogs[n]
-                    ind = np.concatenate((ind, np.not_equal(mog.tauFce, -1).T), axis=0)
-                    tt = np.concatenate((tt, mog.tauFce.T), axis=0)
-                    et = np.concatenate((et, mog.tauFce_et.T * mog.f_et), axis=0)
-                    in_vect = np.concatenate((in_vect, mog.in_vect.T), axis=0)
-                    no = np.concatenate((no, np.arange(mog.ntrace + 1).T), axis=0)
-
-        elif type1 == "hyb":
-            mog = mogs[0]
-            ind = np.not_equal(mog.tauHyb, -1).T
-            tt = mog.tauHyb.T
-            et = mog.tauHyb_et.T * mog.f_et
-            in_vect = mog.in_vect.T
-            no = np.arange(mog.data.ntrace).T
-
-            if len(mogs) > 1:
-                for n in range(1, len(model.mogs)):
-                    mog = mogs[n]
-                    ind = np.concatenate((ind, np.not_equal(mog.tauHyb, -1).T), axis=0)
-                    tt = np.concatenate((tt, mog.tauHyb.T), axis=0)
-                    et = np.concatenate((et, mog.tauHyb_et.T * mog.f_et), axis=0)
-                    in_vect = np.concatenate((in_vect, mog.in_vect.T), axis=0)
-                    no = np.concatenate((no, np.arange(mog.ntrace + 1).T), axis=0)
-
-        elif type1 == 'depth':
+        """
+        Data of selected MOGs of a model, for traces with a datum of type
+        type1 and kept after pruning
+
+        Returns data, an array with columns datum, standard deviation and
+        trace number in MOG (depths of Tx and Rx instead of datum and
+        standard deviation if type1 is 'depth', for traces with a datum
+        of type type2), and ind, the boolean index of the returned traces
+        in all traces of the selected MOGs (see getModelDataset).
+        """
+        if type1 == 'depth':
             if type2 == '':
-                return data, ind
-            
-            _, ind = Model.getModelData(model, selected_mogs, type2)  # @UndefinedVariable
-            mog = mogs[0]
-            tt = mog.Tx_z_orig.T
-            et = mog.Rx_z_orig.T
-            in_vect = mog.in_vect.T
-            if len(mogs) > 1:
-                for n in (1, len(mogs)):
-                    tt = np.concatenate((tt, mogs[n].Tx_z_orig.T), axis=0)
-                    et = np.concatenate((et, mogs[n].Rx_z_orig.T), axis=0)
-                    in_vect = np.concatenate((in_vect, mogs[n].in_vect.T), axis=0)
+                return np.array([]), np.array([])
+            dataset = Model.getModelDataset(model, selected_mogs, (type2, 'depth'))
+            return Model.selectModelData(model, dataset, type2, columns=('Tx_z', 'Rx_z'))
         else:
-            raise ValueError
+            dataset = Model.getModelDataset(model, selected_mogs, (type1,))
+            return Model.selectModelData(model, dataset, type1, vlim)
+
+    @staticmethod
+    def selectModelData(model, dataset, type_, vlim=0, columns=None):
+        """
+        Select traces of dataset (see getModelDataset) with a datum of type
+        type_, kept after pruning, and with apparent velocity below vlim
+        (if not 0)
 
-        if vlim != 0:   
+        Returns data, an array with columns given by columns (type_ and
+        type_+'_et' by default) and trace number in MOG, and ind, the
+        boolean index of the selected traces in dataset
+        """
+        if columns is None:
+            columns = (type_, type_ + '_et')
+        ind = dataset[type_ + '_ok']
+
+        if vlim != 0:
             l = np.sqrt(np.sum((model.grid.Tx-model.grid.Rx)**2, axis=1)).T
-            vapp = l/tt
+            vapp = l/dataset[type_]
             in2 = vapp<vlim
             print(str(np.sum(~in2&ind)) + " rays with apparent velocity above " + str(vlim))
             ind = ind & in2
-         
-        ind = np.equal((ind.astype(int) + in_vect.astype(int)), 2)
-        data = np.array([tt[ind], et[ind], no[ind]]).T
+
+        ind = np.logical_and(ind, dataset['in_vect'])
+        data = np.column_stack((dataset[columns[0]][ind], dataset[columns[1]][ind], dataset['no'][ind]))
         return data, ind
+
+
+class ModelDataset(object):
+    """
+    Data of the selected MOGs of a model, with the geometry of the selected
+    traces
+
+    Data are assembled again by update only if picks, prune masks or
+    coordinates of the MOGs (or the selection) have changed (see key), in
+    which case version changes.  Results derived from the data (ray matrix,
+    covariance, ...) can thus be kept with the key (id(dataset), version),
+    without hashing the data again; versions are never reused, even by
+    another instance.
+
+    Attributes are:
+        dataset: data of all traces of the selected MOGs (see Model.getModelDataset)
+        data, idata: selected data and their index (see Model.getModelData)
+        Tx, Rx, TxCosDir, RxCosDir: coordinates and direction cosines of
+                                    selected traces, taken from grid
+    """
+    def __init__(self, model, grid=None):
+        """
+        :param model: instance of class Model
+        :param grid: grid holding Tx & Rx of traces (model.grid if None)
+        """
+        self.model         = model
+        self.grid          = grid
+        self.selected_mogs = []
+        self.type          = 'tt'
+        self.vlim          = 0
+        self.version       = 0
+        self.dataset       = None
+        self.data          = None
+        self.idata         = None
+        self.Tx            = None
+        self.Rx            = None
+        self.TxCosDir      = None
+        self.RxCosDir      = None
+        self._key          = None
+
+    def select(self, selected_mogs, type_='tt', vlim=0):
+        """
+        Select MOGs and type of data, and update data
+
+        Returns True if data were assembled again
+        """
+        self.selected_mogs = list(selected_mogs)
+        self.type = type_
+        self.vlim = vlim
+        return self.update()
+
+    def update(self):
+        """
+        Assemble data again if they have changed since last update
+
+        Returns True if data were assembled again
+        """
+        key = self.key()
+        if key == self._key:
+            return False
+
+        grid = self.model.grid if self.grid is None else self.grid
+        self.dataset = Model.getModelDataset(self.model, self.selected_mogs, (self.type,))
+        self.data, self.idata = Model.selectModelData(self.model, self.dataset, self.type, self.vlim)
+        if grid is not None:
+            self.Tx = grid.Tx[self.idata, :]
+            self.Rx = grid.Rx[self.idata, :]
+            self.TxCosDir = grid.TxCosDir[self.idata, :]
+            self.RxCosDir = grid.RxCosDir[self.idata, :]
+
+        self._key = key
+        self.version = next(_dataset_versions)
+        return True
+
+    def key(self):
+        """
+        Digest of everything data depend on: selection, picks, prune masks
+        and coordinates of the selected MOGs, air shots if travel times
+        are used, and coordinates in grid
+        """
+        value, et = MODEL_DATA_TYPES[self.type]
+        arrays = [np.asarray(self.selected_mogs, dtype=np.int64), np.asarray(self.vlim, dtype=np.float64),
+                  np.frombuffer(self.type.encode(), dtype=np.uint8)]
+        for i in self.selected_mogs:
+            mog = self.model.mogs[i]
+            arrays += [getattr(mog, value), getattr(mog, et), mog.in_vect, mog.f_et,
+                       mog.data.Tx_x, mog.data.Tx_y, mog.data.Tx_z,
+                       mog.data.Rx_x, mog.data.Rx_y, mog.data.Rx_z]
+            if self.type == 'tt':
+                # fac_dt is an output of getCorrectedTravelTimes unless set by user
+                arrays.append(np.array([mog.data.synthetique, mog.useAirShots, mog.user_fac_dt,
+                                        mog.fac_dt if mog.user_fac_dt else 0], dtype=np.float64))
+                for shot in (mog.av, mog.ap):
+                    if shot is not None:
+                        arrays += [shot.tt, shot.et, shot.tt_done, shot.d_TxRx]
+
+        grid = self.model.grid if self.grid is None else self.grid
+        if grid is not None:
+            arrays += [grid.Tx, grid.Rx, grid.TxCosDir, grid.RxCosDir]
+
+        return fingerprint(*arrays)
+
+    def matrix(self):
+        """
+        Tx, Rx, data and direction cosines of selected traces, in columns
+        (as used by inversion routines)
+        """
+        return np.concatenate((self.Tx, self.Rx, self.data, self.TxCosDir, self.RxCosDir), axis=1)
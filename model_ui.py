@@ -288,11 +288,11 @@ class ModelUI(QtWidgets.QWidget):
 
         data = GridData()
 
-        data.in_vect = mog.in_vect
+        data.in_vect = mog.in_vect.copy()
         data.Tx = np.array([mog.data.Tx_x, mog.data.Tx_y, mog.data.Tx_z]).T
         data.Rx = np.array([mog.data.Rx_x, mog.data.Rx_y, mog.data.Rx_z]).T
-        data.TxCosDir = mog.TxCosDir
-        data.RxCosDir = mog.RxCosDir
+        data.TxCosDir = mog.TxCosDir.copy()
+        data.RxCosDir = mog.RxCosDir.copy()
         
         data.nthreads = psutil.cpu_count(logical=False) - 1;
 
@@ -791,14 +791,9 @@ class BoreholesFig(FigureCanvasQTAgg):
 
         for n in range(len(mogs)):
             mog = mogs[n]
-            false_Rx_ind = np.nonzero(not mog.in_Rx_vect.all())  # Verify boolean value
-            false_Tx_ind = np.nonzero(not mog.in_Tx_vect.all())  # Verify boolean value
-
-            Tx_zs = np.unique(mog.data.Tx_z)
-            Rx_zs = np.unique(mog.data.Rx_z)
-
-            Tx_zs = np.delete(Tx_zs, false_Tx_ind[0])
-            Rx_zs = np.delete(Rx_zs, false_Rx_ind[0])
+            # positions of Tx and Rx kept after pruning
+            Tx_zs = np.unique(mog.data.Tx_z[mog.in_Tx_vect])
+            Rx_zs = np.unique(mog.data.Rx_z[mog.in_Rx_vect])
 
             num_Tx = len(Tx_zs)
             num_Rx = len(Rx_zs)
@@ -20,10 +20,205 @@ along with this program. If not, see <http://www.gnu.org/licenses/>.
 """
 import os
 import re
+import hashlib
 import numpy as np
 
 from borehole import Borehole
 
+V_AIR = 0.2998  # velocity in air, used for air shots
+
+
+class MemmapTraces(np.lib.mixins.NDArrayOperatorsMixin):
+    """
+    Read-only, memory-mapped view of raw traces stored on disk
+
+    The file is mapped as (ntrace, nptsptrc) samples of type dtype but
+    is exposed with shape (nptsptrc, ntrace), like MogData.rdata.
+    Nothing is read at creation: samples are converted to float only
+    when a trace or a group of traces is indexed, e.g. rdata[:, n]
+    """
+
+    def __init__(self, filename, nptsptrc, ntrace, dtype='int16', offset=0):
+        self.filename = filename
+        self.nptsptrc = nptsptrc
+        self.ntrace = ntrace
+        self.file_dtype = np.dtype(dtype)
+        self.offset = offset
+        self._traces = np.memmap(filename, dtype=self.file_dtype, mode='r',
+                                 offset=offset, shape=(ntrace, nptsptrc))
+
+    def __reduce__(self):
+        # the mapping itself cannot be pickled, the file is mapped again when unpickling
+        return (MemmapTraces, (self.filename, self.nptsptrc, self.ntrace,
+                               self.file_dtype.str, self.offset))
+
+    @property
+    def shape(self):
+        return self.nptsptrc, self.ntrace
+
+    @property
+    def ndim(self):
+        return 2
+
+    @property
+    def size(self):
+        return self.nptsptrc * self.ntrace
+
+    @property
+    def dtype(self):
+        return np.dtype(np.float64)
+
+    @property
+    def T(self):
+        return np.asarray(self).T
+
+    def __len__(self):
+        return self.nptsptrc
+
+    def __getitem__(self, key):
+        # the transpose is a view, only the samples selected by key are read and converted
+        return np.asarray(self._traces.T[key], dtype=np.float64)
+
+    def __array__(self, dtype=None, copy=None):
+        if dtype is None:
+            dtype = np.float64
+        return np.asarray(self._traces.T, dtype=dtype)
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        # arithmetic is done on the traces loaded in memory
+        inputs = tuple(np.asarray(x) if isinstance(x, MemmapTraces) else x for x in inputs)
+        return getattr(ufunc, method)(*inputs, **kwargs)
+
+    def copy(self):
+        return np.array(self)
+
+    def flatten(self):
+        return np.asarray(self).flatten()
+
+
+class IndexedTraces(np.lib.mixins.NDArrayOperatorsMixin):
+    """
+    Traces of rdata (ndarray or MemmapTraces) reordered through an index
+
+    Column n of the view is column ind[n] of rdata, nothing is copied
+    until traces are indexed, e.g. rdata[:, n] (see Mog.sort_by_Tx)
+    """
+
+    def __init__(self, rdata, ind):
+        if isinstance(rdata, IndexedTraces):
+            # compose permutations rather than stacking views
+            ind = rdata.ind[ind]
+            rdata = rdata.rdata
+        self.rdata = rdata
+        self.ind = np.asarray(ind, dtype=np.int64)
+
+    @property
+    def shape(self):
+        return self.rdata.shape[0], self.ind.size
+
+    @property
+    def ndim(self):
+        return 2
+
+    @property
+    def size(self):
+        return self.rdata.shape[0] * self.ind.size
+
+    @property
+    def dtype(self):
+        return self.rdata.dtype
+
+    @property
+    def T(self):
+        return np.asarray(self).T
+
+    def __len__(self):
+        return self.rdata.shape[0]
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple) and len(key) == 2:
+            return self.rdata[key[0], self.ind[key[1]]]
+        return self.rdata[key, self.ind]
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self.rdata[:, self.ind], dtype=dtype)
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        inputs = tuple(np.asarray(x) if isinstance(x, IndexedTraces) else x for x in inputs)
+        return getattr(ufunc, method)(*inputs, **kwargs)
+
+    def copy(self):
+        return np.array(self)
+
+    def flatten(self):
+        return np.asarray(self).flatten()
+
+
+class MergedTraces(np.lib.mixins.NDArrayOperatorsMixin):
+    """
+    Traces of several MOGs (ndarray, MemmapTraces or IndexedTraces)
+    seen as a single array, without copying (see Mog.merge_mogs)
+    """
+
+    def __init__(self, blocks):
+        self.blocks = list(blocks)
+        self.offsets = np.cumsum([0] + [b.shape[1] for b in self.blocks])
+
+    @property
+    def shape(self):
+        return self.blocks[0].shape[0], int(self.offsets[-1])
+
+    @property
+    def ndim(self):
+        return 2
+
+    @property
+    def size(self):
+        return self.shape[0] * self.shape[1]
+
+    @property
+    def dtype(self):
+        return np.result_type(*[b.dtype for b in self.blocks])
+
+    @property
+    def T(self):
+        return np.asarray(self).T
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple) and len(key) == 2:
+            rows, cols = key
+        else:
+            rows, cols = key, slice(None)
+        scalar = np.ndim(cols) == 0 and not isinstance(cols, slice)
+        cols = np.atleast_1d(np.arange(self.offsets[-1])[cols])
+        nb = np.searchsorted(self.offsets, cols, side='right') - 1
+        # traces are gathered block by block, then put back in the requested order
+        order = np.argsort(nb, kind='stable')
+        parts = [np.asarray(self.blocks[b][rows, cols[nb == b] - self.offsets[b]])
+                 for b in np.unique(nb)]
+        if len(parts) == 0:
+            return np.asarray(self.blocks[0][rows, cols])
+        out = np.empty_like(np.concatenate(parts, axis=-1))
+        out[..., order] = np.concatenate(parts, axis=-1)
+        return out[..., 0] if scalar else out
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(np.hstack([np.asarray(b) for b in self.blocks]), dtype=dtype)
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        inputs = tuple(np.asarray(x) if isinstance(x, MergedTraces) else x for x in inputs)
+        return getattr(ufunc, method)(*inputs, **kwargs)
+
+    def copy(self):
+        return np.array(self)
+
+    def flatten(self):
+        return np.asarray(self).flatten()
+
+
 class MogData(object):
     """
     Class to hold multi-offset gather (mog) data
@@ -55,9 +250,11 @@ class MogData(object):
         self.date        = date  # the date of the data sample
         self.name        = name
 
-    def readRAMAC(self, basename):
+    def readRAMAC(self, basename, memmap=False):
         """
         loads data in Malå RAMAC format
+
+        if memmap is True, the traces are not loaded in memory (see readRD3)
         """
         rname = os.path.basename(basename)
 
@@ -66,7 +263,7 @@ class MogData(object):
         self.cunits = 'm'
 
         self.readRAD(basename)
-        self.readRD3(basename)
+        self.readRD3(basename, memmap)
         
         self.TxOffset = 0
         self.RxOffset = 0
@@ -148,10 +345,13 @@ class MogData(object):
 #         print(self.antennas)
 #         print(self.ntrace)
 
-    def readRD3(self, basename):
+    def readRD3(self, basename, memmap=False):
         """
         loads contents of *.rd3 extension
         RD3 stands for Ray Dream Designer 3 graphics
+
+        if memmap is True, rdata is a MemmapTraces instance mapping the
+        int16 file, and traces are converted to float only when accessed
         """
         try:
             file = open(basename, 'rb')
@@ -164,7 +364,18 @@ class MogData(object):
                 except Exception as e:
                     raise IOError("Cannot open RD3 file '" + str(e)[:42] + "...' [mog 3]")
 
-        self.rdata = np.asfarray(np.fromfile(file, dtype='int16', count=self.nptsptrc * self.ntrace))
+        if memmap:
+            file.seek(0, os.SEEK_END)
+            nbytes = file.tell()
+            file.close()
+            if nbytes >= 2 * self.nptsptrc * self.ntrace:
+                self.rdata = MemmapTraces(file.name, self.nptsptrc, self.ntrace)
+                return
+            # truncated file, missing samples must be padded with zeros in memory
+            file = open(file.name, 'rb')
+
+        self.rdata = np.fromfile(file, dtype='int16', count=self.nptsptrc * self.ntrace).astype(np.float64)
+        file.close()
         self.rdata.resize((self.ntrace, self.nptsptrc))
         self.rdata = self.rdata.T
 
@@ -182,36 +393,101 @@ class MogData(object):
                     file = open(basename + ".TLF", 'r')
                 except Exception as e:
                     raise IOError("Cannot open TLF file '" + str(e)[:42] + "...' [mog 4]")
-        self.Tx_z = np.array([])
-        self.Rx_z = np.array([])
         lines = file.readlines()[1:]
-        for line in lines:
-            line_contents = re.findall(r"[-+]?\d*\.\d+|\d+", line)
-            tnd          = int(line_contents[0])     # first trace
-            tnf          = int(line_contents[1])     # last trace
-            Rxd          = float(line_contents[2])   # first coordinate of the Rx
-            Rxf          = float(line_contents[3])   # last coordinate of the Rx
-            Tx           = float(line_contents[4])   # Tx's fixed position
-            nt           = tnf - tnd + 1
-            if nt == 1:
-                dRx = 1
-                if Rxd > Rxf:
-                    Rxd = Rxf
-            else:
-                dRx = (Rxf - Rxd) / (nt - 1)
+        file.close()
 
-            vect = np.arange(Rxd, Rxf + dRx / 2, dRx)
+        # each row holds the first five numbers of a line (further fields are ignored):
+        # first trace, last trace, first Rx coordinate, last Rx coordinate, Tx fixed position
+        rows = [re.findall(r"[-+]?\d*\.\d+|\d+", line)[:5] for line in lines]
+        rows = [row for row in rows if row]  # blank lines
+        if any(len(row) != 5 for row in rows):
+            raise IOError("Cannot parse TLF file '" + file.name[-42:] + "' [mog 5]")
+        tlf = np.array(rows, dtype=float).reshape(-1, 5)
 
-            if nt > 0:
-                self.Tx_z = np.append(self.Tx_z, (Tx * np.ones(np.abs(nt))))
-                self.Rx_z = np.concatenate((self.Rx_z, vect))
-        file.close()
+        nt = (tlf[:, 1] - tlf[:, 0]).astype(np.int64) + 1
+        tlf = tlf[nt > 0, :]
+        nt = nt[nt > 0]
+        Rxd = tlf[:, 2]
+        Rxf = tlf[:, 3]
+
+        # single-trace lines are located at the shallowest of the two coordinates
+        Rx0 = np.where(nt == 1, np.minimum(Rxd, Rxf), Rxd)
+        dRx = np.where(nt == 1, 0.0, (Rxf - Rxd) / np.maximum(nt - 1, 1))
+
+        # position of each trace within its line
+        no = np.arange(nt.sum()) - np.repeat(np.cumsum(nt) - nt, nt)
+
+        self.Tx_z = np.repeat(tlf[:, 4], nt)
+        self.Rx_z = np.repeat(Rx0, nt) + no * np.repeat(dRx, nt)
+
+        if self.ntrace != 0 and self.Tx_z.size != self.ntrace:
+            raise IOError("TLF file describes {0:d} traces, {1:d} expected [mog 6]".format(self.Tx_z.size, self.ntrace))
 
     def readSEGY(self, basename):
         """
-        :param basename:
-        :return:
+        loads data in SEG-Y format
+
+        Source and receiver coordinates are taken from the trace headers
+        (sx, sy, selev, gx, gy, gelev, scaled with scalco and scalel), they
+        are thus true positions and are used as is by Mog.update_coords
+        """
+        from cutils import read_segy, read_segy_text, TIME_UNITS_RE
+
+        for ext in ('', '.sgy', '.SGY', '.segy', '.SEGY'):
+            if os.path.isfile(basename + ext):
+                filename = basename + ext
+                break
+        else:
+            raise IOError("Cannot open SEG-Y file '" + basename[-42:] + "...' [mog 7]")
+
+        s = read_segy(filename, fields=['sx', 'sy', 'selev', 'gx', 'gy', 'gelev',
+                                        'scalco', 'scalel', 'dt', 'ns'])
+        th = s.th
+
+        self.name = os.path.basename(basename)
+        self.tunits = 'ms'
+        self.cunits = 'ft' if s.bh['mfeet'] == 2 else 'm'
+        self.synthetique = 0
+        self.TxOffset = 0.0
+        self.RxOffset = 0.0
+        self.comment = 'true positions'
+
+        # traces come as a float32 array of size nsamples x ntraces
+        self.rdata = s.data
+        self.nptsptrc, self.ntrace = self.rdata.shape
+        if self.ntrace > 0 and th['ns'][0] != 0 and th['ns'][0] != self.nptsptrc:
+            raise IOError("Traces of variable length not handled [mog 8]")
+
+        # sampling interval is in microseconds in trace headers, unless time units
+        # are given in textual header (files written by write_segy)
+        dt = th['dt'][0] if self.ntrace > 0 and th['dt'][0] != 0 else s.bh['hdt']
+        self.timec = 1.0e-3 * (int(dt) & 0xffff)
+        units = TIME_UNITS_RE.search(read_segy_text(filename))
+        if units is not None:
+            self.tunits = units.group(1)
+            self.timec = float(units.group(2))
+        self.timestp = self.timec * np.arange(self.nptsptrc)
+
+        fac_co = MogData._segy_scaling(th['scalco'])
+        fac_el = MogData._segy_scaling(th['scalel'])
+        self.Tx_x = fac_co * th['sx']
+        self.Tx_y = fac_co * th['sy']
+        self.Tx_z = fac_el * th['selev']
+        self.Rx_x = fac_co * th['gx']
+        self.Rx_y = fac_co * th['gy']
+        self.Rx_z = fac_el * th['gelev']
+
+    @staticmethod
+    def _segy_scaling(scal):
+        """
+        Returns factors to apply to coordinates given SEG-Y scalars
+        (negative: divisor, positive: multiplier, zero: no scaling)
         """
+        scal = np.asarray(scal, dtype=float)
+        fac = np.ones(scal.shape)
+        fac[scal > 0] = scal[scal > 0]
+        fac[scal < 0] = -1.0 / scal[scal < 0]
+        return fac
 
 
 class PruneParams(object):
@@ -227,7 +503,120 @@ class PruneParams(object):
         self.thetaMax = 90.0
 
 
+class MogGeometry(object):
+    """
+    Geometry of the Tx-Rx pairs of a Mog, computed once (see Mog.geometry)
+
+    Attributes are (arrays of size ntrace unless noted):
+        dist: Tx-Rx distance
+        offset: horizontal Tx-Rx distance
+        dz: Rx_z - Tx_z
+        theta: angle of Tx-Rx segment with respect to horizontal, in degrees
+               (positive when Rx is above Tx)
+        uTx_z: unique Tx elevations, sorted (array of size nTx)
+        Tx_ind: index of the Tx of each trace in uTx_z
+        Tx_order: trace numbers sorted by Tx (in original order for a given Tx)
+        Tx_offsets: traces of gather n are Tx_order[Tx_offsets[n]:Tx_offsets[n+1]]
+                    (array of size nTx+1, see gather)
+    """
+
+    def __init__(self, data):
+        self._coords = (data.Tx_x, data.Tx_y, data.Tx_z, data.Rx_x, data.Rx_y, data.Rx_z)
+        Tx_x, Tx_y, Tx_z, Rx_x, Rx_y, Rx_z = [np.asarray(c, dtype=np.float64).flatten() for c in self._coords]
+        self.offset = np.sqrt((Tx_x - Rx_x)**2 + (Tx_y - Rx_y)**2)
+        self.dz = Rx_z - Tx_z
+        self.dist = np.sqrt(self.offset**2 + self.dz**2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.theta = 180.0 / np.pi * np.arcsin(self.dz / self.dist)
+        self.uTx_z, self.Tx_ind = np.unique(Tx_z, return_inverse=True)
+        self.Tx_ind = self.Tx_ind.reshape(-1)
+        self.Tx_order = np.argsort(self.Tx_ind, kind='stable')
+        self.Tx_offsets = np.r_[0, np.cumsum(np.bincount(self.Tx_ind, minlength=self.uTx_z.size))]
+
+    def gather(self, n):
+        """
+        Trace numbers of Tx gather n (Tx at elevation uTx_z[n])
+        """
+        return self.Tx_order[self.Tx_offsets[n]:self.Tx_offsets[n + 1]]
+
+    def is_current(self, data):
+        """
+        False if coordinates of data have been replaced since geometry was computed
+        """
+        coords = (data.Tx_x, data.Tx_y, data.Tx_z, data.Rx_x, data.Rx_y, data.Rx_z)
+        return all(c1 is c2 for c1, c2 in zip(coords, self._coords))
+
+
+# Per-trace attributes of Mog, held in a single structured array (Mog.traces)
+# so that sorting, masking, merging and saving act on all of them at once.
+# Each field is also accessible as an attribute of Mog (e.g. mog.tt)
+TRACE_DTYPE = np.dtype([('tt', np.float64), ('et', np.float64), ('tt_done', bool),
+                        ('amp_tmin', np.float64), ('amp_tmax', np.float64), ('amp_done', bool),
+                        ('App', np.float64), ('fcentroid', np.float64), ('scentroid', np.float64),
+                        ('tauApp', np.float64), ('tauApp_et', np.float64),
+                        ('tauFce', np.float64), ('tauFce_et', np.float64),
+                        ('tauHyb', np.float64), ('tauHyb_et', np.float64),
+                        ('Tx_z_orig', np.float64), ('Rx_z_orig', np.float64),
+                        ('in_Rx_vect', bool), ('in_Tx_vect', bool), ('in_vect', bool),
+                        ('TxCosDir', np.float64, (3,)), ('RxCosDir', np.float64, (3,))])
+
+
+def _trace_attribute(name):
+    """
+    Property giving access to field name of Mog.traces
+    """
+    shape = TRACE_DTYPE[name].shape
+
+    def fget(self):
+        return self.traces[name]
+
+    def fset(self, value):
+        value = np.asarray(value)
+        if value.ndim > len(shape):
+            ntrace = value.size // int(np.prod(shape))
+            value = value.reshape((ntrace,) + shape)
+            if ntrace != self.traces.size:
+                # new number of traces, the other attributes are reset to their defaults
+                self.traces = Mog.new_traces(ntrace)
+        self.traces[name] = value
+
+    return property(fget, fset, doc='per-trace attribute held in Mog.traces')
+
+
 class Mog():  # Multi-Offset Gather
+    """
+    Multi-Offset Gather
+
+    Per-trace attributes (tt, et, in_vect, TxCosDir, ...) are fields of the
+    structured array traces (see TRACE_DTYPE).  Reading one of them returns a
+    view on traces, so that e.g. mog.tt[ind] = t modifies the Mog; the view
+    follows in-place changes (pruning, picking), and is detached from the Mog
+    when traces is replaced (sorting, new number of traces).  Copy it to keep
+    the values of a given moment.
+    """
+
+    tt = _trace_attribute('tt')
+    et = _trace_attribute('et')
+    tt_done = _trace_attribute('tt_done')
+    amp_tmin = _trace_attribute('amp_tmin')
+    amp_tmax = _trace_attribute('amp_tmax')
+    amp_done = _trace_attribute('amp_done')
+    App = _trace_attribute('App')
+    fcentroid = _trace_attribute('fcentroid')
+    scentroid = _trace_attribute('scentroid')
+    tauApp = _trace_attribute('tauApp')
+    tauApp_et = _trace_attribute('tauApp_et')
+    tauFce = _trace_attribute('tauFce')
+    tauFce_et = _trace_attribute('tauFce_et')
+    tauHyb = _trace_attribute('tauHyb')
+    tauHyb_et = _trace_attribute('tauHyb_et')
+    Tx_z_orig = _trace_attribute('Tx_z_orig')
+    Rx_z_orig = _trace_attribute('Rx_z_orig')
+    in_Rx_vect = _trace_attribute('in_Rx_vect')
+    in_Tx_vect = _trace_attribute('in_Tx_vect')
+    in_vect = _trace_attribute('in_vect')
+    TxCosDir = _trace_attribute('TxCosDir')
+    RxCosDir = _trace_attribute('RxCosDir')
 
     def __init__(self, name='', data=MogData()):
         self.pruneParams              = PruneParams()
@@ -245,16 +634,11 @@ class Mog():  # Multi-Offset Gather
         self.ap                       = None
         self.Tx                       = None
         self.Rx                       = None
-        self.TxCosDir                 = np.zeros((self.data.ntrace, 3), dtype=float)
-        self.RxCosDir                 = np.zeros((self.data.ntrace, 3), dtype=float)
-
-        self.in_Rx_vect               = np.ones(self.data.ntrace, dtype=bool)
-        self.in_Tx_vect               = np.ones(self.data.ntrace, dtype=bool)
-        self.in_vect                  = np.ones(self.data.ntrace, dtype=bool)
+        self.traces                   = Mog.new_traces(self.data.ntrace)  # per-trace attributes, see TRACE_DTYPE
+        self._cos_dir_cache           = None  # coordinates & direction cosines of last update_coords
+        self._geometry                = None  # see geometry
+        self._tt_cache                = None  # see getCorrectedTravelTimes
         self.date                     = self.data.date
-        self.tt                       = -1 * np.ones(self.data.ntrace, dtype=float)
-        self.et                       = -1 * np.ones(self.data.ntrace, dtype=float)
-        self.tt_done                  = np.zeros(self.data.ntrace, dtype=bool)
 
         if self.data.tdata is None or self.data.tdata == 0:
             self.ttTx                 = np.array([])
@@ -263,18 +647,6 @@ class Mog():  # Multi-Offset Gather
             self.ttTx                 = np.zeros(self.data.ntrace)
             self.ttTx_done            = np.zeros(self.data.ntrace, dtype=bool)
 
-        self.amp_tmin                 = -1 * np.ones(self.data.ntrace, dtype=float)
-        self.amp_tmax                 = -1 * np.ones(self.data.ntrace, dtype=float)
-        self.amp_done                 = np.zeros(self.data.ntrace, dtype=bool)
-        self.App                      = np.zeros(self.data.ntrace, dtype=float)
-        self.fcentroid                = np.zeros(self.data.ntrace, dtype=float)
-        self.scentroid                = np.zeros(self.data.ntrace, dtype=float)
-        self.tauApp                   = -1 * np.ones(self.data.ntrace, dtype=float)
-        self.tauApp_et                = -1 * np.ones(self.data.ntrace, dtype=float)
-        self.tauFce                   = -1 * np.ones(self.data.ntrace, dtype=float)
-        self.tauFce_et                = -1 * np.ones(self.data.ntrace, dtype=float)
-        self.tauHyb                   = -1 * np.ones(self.data.ntrace, dtype=float)
-        self.tauHyb_et                = -1 * np.ones(self.data.ntrace, dtype=float)
         self.Tx_z_orig                = self.data.Tx_z
         self.Rx_z_orig                = self.data.Rx_z
 
@@ -282,6 +654,19 @@ class Mog():  # Multi-Offset Gather
         self.pruneParams.zmax         = max(np.array([self.data.Tx_z, self.data.Rx_z]).flatten())
         self.modified                 = True
 
+    @staticmethod
+    def new_traces(ntrace):
+        """
+        Returns table of per-trace attributes (see TRACE_DTYPE) holding default values
+        """
+        traces = np.zeros(ntrace, dtype=TRACE_DTYPE)
+        for name in ('tt', 'et', 'amp_tmin', 'amp_tmax', 'tauApp', 'tauApp_et',
+                     'tauFce', 'tauFce_et', 'tauHyb', 'tauHyb_et'):
+            traces[name] = -1.0
+        for name in ('in_Rx_vect', 'in_Tx_vect', 'in_vect'):
+            traces[name] = True
+        return traces
+
     def correction_t0(self, ndata, air_before, air_after, show):
         """
         :param ndata:
@@ -298,22 +683,20 @@ class Mog():  # Multi-Offset Gather
             t0 = np.zeros(ndata)
             raise ValueError("t0 correction not applied; Pick t0 before and t0 after for correction")
 
-        v_air = 0.2998
+        v_air = V_AIR
         t0av = np.array([])
         t0ap = np.array([])
+        Mog.fit_air_shots([shot for shot in (air_before, air_after) if shot.name != ''], v_air)
 
         if air_before.name != '':
-            if 'fixed_antenna' in air_before.method:
-                t0av = self.get_t0_fixed(air_before, v_air)
-            if 'walkaway' in air_before.method:
-                t0av, fac_dt_av = self.get_t0_walkaway(air_before, v_air, show)
+            t0av, fac_dt_av = self.airshot_t0(air_before, v_air)
+            if show and 'walkaway' in air_before.method:
+                self.plot_t0_walkaway(air_before, v_air, t0av, fac_dt_av)
 
         if air_after.name != '':
-            if 'fixed_antenna' in air_before.method:
-                t0ap = self.get_t0_fixed(air_after, v_air)
-
-            if 'walkaway' in air_before.method:
-                t0ap, fac_dt_ap = self.get_t0_walkaway(air_after, v_air, show)
+            t0ap, fac_dt_ap = self.airshot_t0(air_after, v_air)
+            if show and 'walkaway' in air_after.method:
+                self.plot_t0_walkaway(air_after, v_air, t0ap, fac_dt_ap)
 
         if np.isnan(t0av) or np.isnan(t0ap):
             t0 = np.zeros((1, ndata))
@@ -332,14 +715,73 @@ class Mog():  # Multi-Offset Gather
 
         return t0, fac_dt_av, fac_dt_ap
 
-    def getCorrectedTravelTimes(self):
+    def apply_prune(self, params=None):
+        """
+        Select traces according to prune parameters (self.pruneParams if
+        params is None, params is otherwise stored in self.pruneParams)
+
+        in_Tx_vect and in_Rx_vect are False for traces with Tx or Rx
+        outside [zmin, zmax] or skipped (every stepTx+1 or stepRx+1 unique
+        positions are kept, positions being rounded to round_factor if
+        it is not 0); in_Rx_vect is also False for traces with Tx-Rx
+        angle outside [thetaMin, thetaMax] (geometry.theta, positive when Rx
+        is above Tx).
+        in_vect is True for traces kept by both, and with a SNR above
+        threshold_SNR if use_SNR is set.
+        """
+        if params is not None:
+            self.pruneParams = params
+        params = self.pruneParams
+
+        Tx_z = np.asarray(self.data.Tx_z, dtype=np.float64).flatten()
+        Rx_z = np.asarray(self.data.Rx_z, dtype=np.float64).flatten()
+
+        in_Tx = np.logical_and(Tx_z >= params.zmin, Tx_z <= params.zmax)
+        in_Rx = np.logical_and(Rx_z >= params.zmin, Rx_z <= params.zmax)
+
+        # skipping is done on unique positions, masks are mapped back to traces with the inverse index
+        for z, step, in_z in ((Tx_z, params.stepTx, in_Tx), (Rx_z, params.stepRx, in_Rx)):
+            if params.round_factor > 0:
+                z = params.round_factor * np.round(z / params.round_factor)
+            uz, inv = np.unique(z, return_inverse=True)
+            keep = np.zeros(uz.size, dtype=bool)
+            keep[::int(step) + 1] = True
+            in_z &= keep[inv.reshape(-1)]
+
+        # coincident Tx and Rx have an undefined angle, they are considered horizontal
+        theta = np.nan_to_num(self.geometry.theta)
+        in_Rx &= np.logical_and(theta >= params.thetaMin, theta <= params.thetaMax)
+
+        self.in_Tx_vect = in_Tx
+        self.in_Rx_vect = in_Rx
+        in_vect = np.logical_and(in_Tx, in_Rx)
+        if params.use_SNR:
+            from utils import compute_SNR  # utils imports PyQt5
+            in_vect &= compute_SNR(self) >= params.threshold_SNR
+        self.in_vect = in_vect
+
+    def getCorrectedTravelTimes(self, show=False):
+        """
+        Travel times corrected for t0 and time step, and t0 of traces
+
+        The result is kept in the Mog, and computed again only if picks,
+        air shots (method & picks) or time step settings have changed; air
+        shot regressions are themselves computed only when picks of air
+        shots have changed (see airshot_t0).  Fits of walkaway air shots
+        are plotted if show is True
+        """
 
         if self.data.synthetique == 1:
             tt = self.tt
             t0 = np.zeros(np.shape(tt))
             return tt, t0
 
-        t0, fac_dt_av, fac_dt_ap = self.correction_t0(len(self.tt), self.av, self.ap, True)
+        key = self._tt_key()
+        cache = getattr(self, '_tt_cache', None)
+        if not show and cache is not None and cache[0] == key:
+            return cache[1].copy(), cache[2].copy()
+
+        t0, fac_dt_av, fac_dt_ap = self.correction_t0(len(self.tt), self.av, self.ap, show)
 
         if self.av is not None:
             self.av.fac_dt = fac_dt_av
@@ -360,40 +802,73 @@ class Mog():  # Multi-Offset Gather
         t0 = self.fac_dt * t0
         tt = self.fac_dt * self.tt - t0
 
+        self._tt_cache = (key, tt.copy(), t0.copy())
         return tt, t0
-    
+
+    def _tt_key(self):
+        """
+        Key of the corrected travel times in getCorrectedTravelTimes
+        """
+        shots = []
+        if self.useAirShots:
+            for shot in (self.av, self.ap):
+                if shot is None or shot.name == '':
+                    shots.append(None)
+                else:
+                    shots.append((shot.name, getattr(shot, 'method', ''),
+                                  fingerprint(shot.tt, shot.et, shot.tt_done, shot.d_TxRx)))
+        fac_dt = self.fac_dt if self.user_fac_dt else None
+        return (self.useAirShots, self.user_fac_dt, fac_dt, tuple(shots),
+                fingerprint(self.tt, self.tt_done))
+
+    @property
+    def geometry(self):
+        """
+        Tx-Rx distances, offsets, angles and Tx index of traces (see MogGeometry)
+
+        Computed when first needed, and again after update_coords or
+        sort_by_Tx, or if coordinates arrays of data are replaced
+        """
+        if self._geometry is None or not self._geometry.is_current(self.data):
+            self._geometry = MogGeometry(self.data)
+        return self._geometry
+
+    @staticmethod
+    def cos_dir(pos):
+        """
+        Direction cosines at positions pos (npts x 3)
+
+        Unique positions are ordered along the borehole by decreasing
+        elevation; the cosines at a station are those of the segment going
+        to the next (deeper) station, and the deepest station takes the
+        cosines of the last segment
+        """
+        u, inv = np.unique(pos, axis=0, return_inverse=True)
+        if u.shape[0] < 2:
+            return np.zeros(pos.shape)
+        order = np.argsort(-u[:, 2], kind='stable')
+        rank = np.empty(order.size, dtype=np.int64)
+        rank[order] = np.arange(order.size)
+        u = u[order, :]
+        v = -np.diff(u, axis=0)
+        l = v / np.sqrt(np.sum(v*v, axis=1)).reshape(-1, 1)
+        l = np.vstack((l, l[-1, :]))
+        return l[rank[inv.reshape(-1)], :]
+
     def update_coords(self):
-        
+
+        self._geometry = None
         if 'true positions' in self.data.comment:
-            Tx = np.vstack((self.data.Tx_x, self.data.Tx_y, self.data.Tx_z)).T
-            self.TxCosDir = np.zeros(Tx.shape)
-            tmp = np.unique(Tx, axis=0)
-            tmp = np.sort(tmp, axis=0)
-            tmp = tmp[::-1, :]
-            v = -np.diff(tmp, axis=0)
-            d = np.sqrt(np.sum(v*v, axis=1))
-            l = v/np.kron(d.reshape(-1,1), np.ones((3,)))
-            l = np.vstack((l, l[-1, :]))
-            for n in range(tmp.shape[0]):
-                ind = Tx[:, 0] == tmp[n, 0]
-                ind = np.logical_and(ind, Tx[:, 1] == tmp[n, 1])
-                ind = np.logical_and(ind, Tx[:, 2] == tmp[n, 2])
-                self.TxCosDir[ind, :] = l[n, :]
-                
-            Rx = np.vstack((self.data.Rx_x, self.data.Rx_y, self.data.Rx_z)).T
-            self.RxCosDir = np.zeros(Rx.shape)
-            tmp = np.unique(Rx, axis=0)
-            tmp = np.sort(tmp, axis=0)
-            tmp = tmp[::-1, :]
-            v = -np.diff(tmp, axis=0)
-            d = np.sqrt(np.sum(v*v, axis=1))
-            l = v/np.kron(d.reshape(-1,1), np.ones((3,)))
-            l = np.vstack((l, l[-1, :]))
-            for n in range(tmp.shape[0]):
-                ind = Rx[:, 0] == tmp[n, 0]
-                ind = np.logical_and(ind, Rx[:, 1] == tmp[n, 1])
-                ind = np.logical_and(ind, Rx[:, 2] == tmp[n, 2])
-                self.RxCosDir[ind, :] = l[n, :]
+            coords = (self.data.Tx_x, self.data.Tx_y, self.data.Tx_z,
+                      self.data.Rx_x, self.data.Rx_y, self.data.Rx_z)
+            if self._cos_dir_cache is not None and \
+                    all(np.array_equal(c1, c2) for c1, c2 in zip(coords, self._cos_dir_cache[0])):
+                self.TxCosDir, self.RxCosDir = self._cos_dir_cache[1]
+                return
+            self.TxCosDir = Mog.cos_dir(np.vstack(coords[:3]).T)
+            self.RxCosDir = Mog.cos_dir(np.vstack(coords[3:]).T)
+            self._cos_dir_cache = (tuple(np.array(c) for c in coords),
+                                   (self.TxCosDir.copy(), self.RxCosDir.copy()))
             return
 
         if self.Tx is None or self.Rx is None:
@@ -411,7 +886,7 @@ class Mog():  # Multi-Offset Gather
                 self.data.Tx_z = self.Tx.Z - self.data.TxOffset - self.Tx_z_orig
                 self.TxCosDir = np.tile(np.array([0.0, 0.0, 1.0]), (self.data.ntrace, 1))
             else:
-                self.data.Tx_x, self.data.Tx_y, self.data.Tx_z = Borehole.project(self.Tx.fdata, self.Tx_z_orig+self.data.TxOffset)
+                self.data.Tx_x, self.data.Tx_y, self.data.Tx_z, self.TxCosDir = Borehole.project(self.Tx.fdata, self.Tx_z_orig+self.data.TxOffset)
 
             if np.abs(self.Rx.X-self.Rx.Xmax) < 1.0e-5 and np.abs(self.Rx.Y-self.Rx.Ymax) < 1.0e-5:
                 # forage vertical
@@ -420,7 +895,7 @@ class Mog():  # Multi-Offset Gather
                 self.data.Rx_z = self.Rx.Z - self.data.RxOffset - self.Rx_z_orig
                 self.RxCosDir = np.tile(np.array([0.0, 0.0, 1.0]), (self.data.ntrace, 1))
             else:
-                self.data.Rx_x, self.data.Rx_y, self.data.Rx_z = Borehole.project(self.Rx.fdata, self.Rx_z_orig+self.data.RxOffset)
+                self.data.Rx_x, self.data.Rx_y, self.data.Rx_z, self.RxCosDir = Borehole.project(self.Rx.fdata, self.Rx_z_orig+self.data.RxOffset)
 
         elif self.type == 1:  # VSP
             # Rx
@@ -431,7 +906,7 @@ class Mog():  # Multi-Offset Gather
                 self.data.Rx_z = self.Rx.Z - self.data.RxOffset - self.Rx_z_orig
                 self.RxCosDir = np.tile(np.array([0.0, 0.0, 1.0]), (self.data.ntrace, 1))
             else:
-                self.data.Rx_x, self.data.Rx_y, self.data.Rx_z = Borehole.project(self.Rx.fdata, self.Rx_z_orig+self.data.RxOffset)
+                self.data.Rx_x, self.data.Rx_y, self.data.Rx_z, self.RxCosDir = Borehole.project(self.Rx.fdata, self.Rx_z_orig+self.data.RxOffset)
 
             # Tx on surface
             theta = np.arctan2( self.Tx.Y - self.Rx.Y, self.Tx.X - self.Rx.X )
@@ -450,47 +925,31 @@ class Mog():  # Multi-Offset Gather
         else:
             raise RuntimeWarning('Mog type undefined: coordinates not updated')
         
-    def sort_by_Tx(self):
-            uTx_z = np.sort(np.unique(self.Tx_z_orig))
-            ind = np.zeros((self.data.ntrace,), dtype=np.int64)
-            start = 0
-            for n in np.arange(uTx_z.size):
-                nos = np.nonzero(uTx_z[n] == self.Tx_z_orig)[0]
-                nfound = len(nos)
-                ind[start+np.arange(nfound)] = nos
-                start = start+nfound
-
-            self.tt = self.tt[ind]
-            self.et = self.et[ind]
-            self.tt_done = self.tt_done[ind]
-            if self.ttTx.size > 0:
-                self.ttTx = self.ttTx[ind]
-                self.ttTx_done = self.ttTx_done[ind]
-            self.amp_tmin = self.amp_tmin[ind]
-            self.amp_tmax = self.amp_tmax[ind]
-            self.amp_done = self.amp_done[ind]
-            self.App = self.App[ind]
-            self.fcentroid = self.fcentroid[ind]
-            self.scentroid = self.scentroid[ind]
-            self.tauApp = self.tauApp[ind]
-            self.tauApp_et = self.tauApp_et[ind]
-            self.tauFce = self.tauFce[ind]
-            self.tauFce_et = self.tauFce_et[ind]
-            self.tauHyb = self.tauHyb[ind]
-            self.tauHyb_et = self.tauHyb_et[ind]
-            self.Tx_z_orig = self.Tx_z_orig[ind]
-            self.Rx_z_orig = self.Rx_z_orig[ind]
-            self.in_vect = self.in_vect[ind]
-            self.TxCosDir = self.TxCosDir[ind, :]
-            self.RxCosDir = self.RxCosDir[ind, :]
-            self.data.rdata = self.data.rdata[:, ind]
-            self.data.Tx_x = self.data.Tx_x[ind]
-            self.data.Tx_y = self.data.Tx_y[ind]
-            self.data.Tx_z = self.data.Tx_z[ind]
-            self.data.Rx_x = self.data.Rx_x[ind]
-            self.data.Rx_y = self.data.Rx_y[ind]
-            self.data.Rx_z = self.data.Rx_z[ind]
+    def sort_by_Tx(self, lazy=False):
+        """
+        Sort traces by Tx depth, and by Rx depth for a given Tx (the sort is
+        stable: traces with the same Tx & Rx depths keep their order)
 
+        If lazy is True, rdata is not copied but reordered through an
+        index (see IndexedTraces)
+        """
+        ind = np.lexsort((self.Rx_z_orig, self.Tx_z_orig))
+        self._geometry = None
+
+        self.traces = self.traces[ind]
+        if self.ttTx.size > 0:
+            self.ttTx = self.ttTx[ind]
+            self.ttTx_done = self.ttTx_done[ind]
+        if lazy:
+            self.data.rdata = IndexedTraces(self.data.rdata, ind)
+        else:
+            self.data.rdata = self.data.rdata[:, ind]
+        self.data.Tx_x = self.data.Tx_x[ind]
+        self.data.Tx_y = self.data.Tx_y[ind]
+        self.data.Tx_z = self.data.Tx_z[ind]
+        self.data.Rx_x = self.data.Rx_x[ind]
+        self.data.Rx_y = self.data.Rx_y[ind]
+        self.data.Rx_z = self.data.Rx_z[ind]
 
     @staticmethod
     def get_t0_fixed(shot, v):
@@ -506,66 +965,174 @@ class Mog():  # Multi-Offset Gather
     
     @staticmethod
     def get_t0_walkaway(shot, v, show):
+        t0, fac, _, _ = Mog.get_t0_walkaway_batch([shot], v)
+        t0 = t0[0]
+        fac = fac[0]
         if show:
-            import matplotlib.pyplot as plt
-        ind = shot.tt != -1.0
-        times = shot.tt[np.logical_and(shot.tt_done, ind)]
-        std_times = shot.et[np.logical_and(shot.tt_done, ind)]
-        d = shot.d_TxRx[np.logical_and(shot.tt_done, ind)]
+            Mog.plot_t0_walkaway(shot, v, t0, fac)
+        return t0, fac
+
+    @staticmethod
+    def get_t0_walkaway_batch(shots, v):
+        """
+        Fit t0 and time step correction factor of walkaway air shots
+
+        Picked times of each shot are fitted with a line of the Tx-Rx
+        distance, by least-squares weighted by 1/et**2 (unweighted if et is
+        not defined for the shot).  All shots are fitted in one pass, sums
+        over the picks of each shot being accumulated with bincount.
+
+        :param shots: list of AirShots
+        :param v: velocity in air
+        :return: t0, fac, std_t0, std_fac, arrays with one value per shot
+                 (nan for shots with less than 2 picks)
+        """
+        nshots = len(shots)
+        d = []
+        t = []
+        w = []
+        weighted = np.zeros(nshots, dtype=bool)
+        for n, shot in enumerate(shots):
+            tt = np.asarray(shot.tt, dtype=np.float64).flatten()
+            et = np.asarray(shot.et, dtype=np.float64).flatten()
+            ind = np.logical_and(np.asarray(shot.tt_done).flatten() != 0, tt != -1.0)
+            d.append(np.broadcast_to(np.asarray(shot.d_TxRx, dtype=np.float64).flatten(), tt.shape)[ind])
+            t.append(tt[ind])
+            if np.all(et[ind] == -1.0):
+                w.append(np.ones(t[-1].size))
+            else:
+                w.append(1/et[ind]**2)
+                weighted[n] = True
+        no = np.repeat(np.arange(nshots), [x.size for x in t])
+        d = np.concatenate(d) if nshots > 0 else np.array([])
+        t = np.concatenate(t) if nshots > 0 else np.array([])
+        w = np.concatenate(w) if nshots > 0 else np.array([])
+
+        def shot_sum(x):
+            return np.bincount(no, weights=x, minlength=nshots)
+
+        npicks = np.bincount(no, minlength=nshots)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sw = shot_sum(w)
+            d_mean = shot_sum(w * d) / sw
+            t_mean = shot_sum(w * t) / sw
+            dc = d - d_mean[no]
+            sdd = shot_sum(w * dc * dc)
+            slope = shot_sum(w * dc * (t - t_mean[no])) / sdd
+            t0 = t_mean - slope * d_mean
+
+            # covariance of parameters, scaled by variance of residuals if times have no std
+            res = t - t0[no] - slope[no] * d
+            sigma2 = np.where(weighted, 1.0, shot_sum(res * res) / (npicks - 2))
+            std_slope = np.sqrt(sigma2 / sdd)
+            std_t0 = np.sqrt(sigma2 * (1 / sw + d_mean**2 / sdd))
+
+            slown = 1.0/v
+            fac = slown / slope
+            std_fac = slown / slope**2 * std_slope
+
+        few = npicks < 2
+        for x in (t0, fac, std_t0, std_fac):
+            x[few] = np.nan
+        return t0, fac, std_t0, std_fac
+
+    @staticmethod
+    def plot_t0_walkaway(shot, v, t0, fac):
+        """
+        Plot picked times of walkaway air shot, with fitted line before and
+        after correction of time step
+        """
+        import matplotlib.pyplot as plt
+        ind = np.logical_and(shot.tt_done, shot.tt != -1.0)
+        times = shot.tt[ind]
+        std_times = shot.et[ind]
+        d = shot.d_TxRx[ind]
         slown = 1.0/v
-        if np.all(std_times == -1.0):
-            b = np.linalg.lstsq(np.vstack((d, np.ones((d.size, )))).T, times, rcond=None)[0]
-            t0 = b[1]
-            fac = slown/b[0]
-            if show:
-                plt.figure('Air shot '+shot.name)
-                plt.subplot(121)
-                plt.plot(d, times, 'o')
-                dd = np.hstack(([0.0], d))
-                plt.plot(dd, dd*b[0] + b[1])
-                plt.xlabel('Distance')
-                plt.ylabel('Time')
-                plt.title('Correction factor: {0:g}'.format(fac))
-                plt.text(d[0], b[0]*d[-2], '$t_0$ at {0:g}'.format(t0))
-                
-                plt.subplot(122)
-                plt.plot(d, times*fac, 'o')
-                plt.plot(dd, slown*dd+b[1]*fac,'g')
-                plt.xlabel('Distance')
-                plt.title('After $\Delta t$ correction')
-                plt.text(d[0], b[0]*d[-2], '$t_0$ at {0:g}'.format(t0))
-                plt.show(block=False)
+        slope = slown/fac
+        dd = np.hstack(([0.0], d))
+        plt.figure('Air shot '+shot.name)
+        plt.subplot(121)
+        plt.plot(d, times, 'o')
+        if not np.all(std_times == -1.0):
+            plt.errorbar(d, times, yerr=std_times)
+        plt.plot(dd, dd*slope + t0)
+        plt.xlabel('Distance')
+        plt.ylabel('Time')
+        plt.title('Correction factor: {0:g}'.format(fac))
+        plt.text(d[0], slope*d[-2], '$t_0$ at {0:g}'.format(t0))
+
+        plt.subplot(122)
+        plt.plot(d, times*fac, 'o')
+        if not np.all(std_times == -1.0):
+            plt.errorbar(d, times*fac, yerr=std_times)
+        plt.plot(dd, slown*dd+t0*fac,'g')
+        plt.xlabel('Distance')
+        plt.title('After $\Delta t$ correction')
+        plt.text(d[0], slope*d[-2], '$t_0$ at {0:g}'.format(t0))
+        plt.show(block=False)
+
+    @staticmethod
+    def airshot_t0(shot, v):
+        """
+        t0 and time step correction factor of air shot, from get_t0_fixed or
+        get_t0_walkaway depending on shot.method
+
+        The result is kept in the air shot (which can be shared by many
+        MOGs), and computed again only if its method, positions or picks
+        have changed; walkaway air shots can be fitted together beforehand
+        with fit_air_shots
+        """
+        method = getattr(shot, 'method', '')
+        key = Mog._airshot_key(shot, v)
+        cache = getattr(shot, '_t0_cache', None)
+        if cache is not None and cache[0] == key:
+            return cache[1]
+
+        if 'fixed_antenna' in method:
+            t0 = Mog.get_t0_fixed(shot, v), 1
+        elif 'walkaway' in method:
+            t0 = Mog.get_t0_walkaway(shot, v, False)
         else:
-            W = np.diag(1/std_times**2)
-            x = np.vstack((d, np.ones((d.size, )))).T
-            b = np.linalg.lstsq(x.T.dot(W.dot(x)), x.T.dot(W.dot(times)), rcond=None)[0]
-            t0 = b[1]
-            fac = slown/b[0]
-            if show:
-                plt.figure('Air shot '+shot.name)
-                plt.subplot(121)
-                plt.plot(d, times, 'o')
-                plt.errorbar(d, times, yerr=std_times)
-                d = np.hstack(([0.0], d))
-                plt.plot(dd, dd*b[0] + b[1])
-                plt.xlabel('Distance')
-                plt.ylabel('Time')
-                plt.title('Correction factor: {0:g}'.format(fac))
-                plt.text(d[0], b[0]*d[-2], '$t_0$ at {0:g}'.format(t0))
-                
-                plt.subplot(122)
-                plt.plot(d, times*fac, 'o')
-                plt.errorbar(d, times*fac, yerr=std_times)
-                plt.plot(dd, slown*dd+b[1]*fac,'g')
-                plt.xlabel('Distance')
-                plt.title('After $\Delta t$ correction')
-                plt.text(d[0], b[0]*d[-2], '$t_0$ at {0:g}'.format(t0))
-                plt.show(block=False)
-        
-        return t0, fac
+            t0 = np.array([]), 1
+        shot._t0_cache = (key, t0)
+        return t0
+
+    @staticmethod
+    def _airshot_key(shot, v):
+        return (getattr(shot, 'method', ''), v,
+                fingerprint(shot.tt, shot.et, shot.tt_done, shot.d_TxRx))
 
     @staticmethod
-    def merge_mogs(mog_list, name, sort=True):
+    def fit_air_shots(shots, v=V_AIR):
+        """
+        Fit walkaway air shots of shots (e.g. all air shots of a database)
+        whose picks have changed, in one call to get_t0_walkaway_batch
+
+        Results are kept in the air shots, where airshot_t0 finds them
+        """
+        stale = {}
+        for shot in shots:
+            key = Mog._airshot_key(shot, v)
+            cache = getattr(shot, '_t0_cache', None)
+            if 'walkaway' in key[0] and (cache is None or cache[0] != key):
+                stale[id(shot)] = (shot, key)
+        if len(stale) == 0:
+            return
+        stale = list(stale.values())
+        t0, fac, _, _ = Mog.get_t0_walkaway_batch([shot for shot, _ in stale], v)
+        for (shot, key), t, f in zip(stale, t0, fac):
+            shot._t0_cache = (key, (t, f))
+
+    @staticmethod
+    def merge_mogs(mog_list, name, sort=True, virtual=False):
+        """
+        Returns a new Mog holding the traces of all mogs in mog_list
+
+        Output arrays are allocated once and filled block by block.  If
+        virtual is True, rdata is not copied: the new Mog references the
+        traces of the mogs in mog_list (see MergedTraces), and sorting
+        is done through an index (see sort_by_Tx)
+        """
         # we assume all mogs in list are compatible
         mdata = MogData()  # mogdata must be instantiated explicitely
         new_mog = Mog(name, mdata)
@@ -598,88 +1165,46 @@ class Mog():  # Multi-Offset Gather
         new_mog.data.comment = mog.data.comment
         new_mog.data.date = mog.data.date
 
-        new_mog.tau_params = mog.tau_params.copy()
-        new_mog.fw = mog.fw.copy()
-        new_mog.TxCosDir = mog.TxCosDir.copy()
-        new_mog.RxCosDir = mog.RxCosDir.copy()
-        new_mog.in_Rx_vect = mog.in_Rx_vect.copy()
-        new_mog.in_Tx_vect = mog.in_Tx_vect.copy()
-        new_mog.in_vect = mog.in_vect.copy()
-        new_mog.tt = mog.tt.copy()
-        new_mog.et = mog.et.copy()
-        new_mog.tt_done = mog.tt_done.copy()
-        new_mog.ttTx = mog.ttTx.copy()
-        new_mog.ttTx_done = mog.ttTx_done.copy()
-        new_mog.amp_tmin = mog.amp_tmin.copy()
-        new_mog.amp_tmax = mog.amp_tmax.copy()
-        new_mog.amp_done = mog.amp_done.copy()
-        new_mog.App = mog.App.copy()
-        new_mog.fcentroid = mog.fcentroid.copy()
-        new_mog.scentroid = mog.scentroid.copy()
-        new_mog.tauApp = mog.tauApp.copy()
-        new_mog.tauApp_et = mog.tauApp_et.copy()
-        new_mog.tauFce = mog.tauFce.copy()
-        new_mog.tauFce_et = mog.tauFce_et.copy()
-        new_mog.tauHyb = mog.tauHyb.copy()
-        new_mog.tauHyb_et = mog.tauHyb_et.copy()
-        new_mog.Tx_z_orig = mog.Tx_z_orig.copy()
-        new_mog.Rx_z_orig = mog.Rx_z_orig.copy()
-        
-        new_mog.data.ntrace = mog.data.ntrace
-        new_mog.data.rdata = mog.data.rdata.copy()
-        new_mog.data.Tx_x = mog.data.Tx_x.copy()
-        new_mog.data.Tx_y = mog.data.Tx_y.copy() 
-        new_mog.data.Tx_z = mog.data.Tx_z.copy()
-        new_mog.data.Rx_x = mog.data.Rx_x.copy()
-        new_mog.data.Rx_y = mog.data.Rx_y.copy()
-        new_mog.data.Rx_z = mog.data.Rx_z.copy()
-
-        for n in range(1, len(mog_list)):
-            mog = mog_list[n]
-            
-            new_mog.tau_params = np.r_[new_mog.tau_params, mog.tau_params]
-            new_mog.fw = np.r_[new_mog.fw, mog.fw]
-            new_mog.TxCosDir = np.r_[new_mog.TxCosDir, mog.TxCosDir]
-            new_mog.RxCosDir = np.r_[new_mog.RxCosDir, mog.RxCosDir]
-            new_mog.in_Rx_vect = np.r_[new_mog.in_Rx_vect, mog.in_Rx_vect]
-            new_mog.in_Tx_vect = np.r_[new_mog.in_Tx_vect, mog.in_Tx_vect]
-            new_mog.in_vect = np.r_[new_mog.in_vect, mog.in_vect]
-            new_mog.tt = np.r_[new_mog.tt, mog.tt]
-            new_mog.et = np.r_[new_mog.et, mog.et]
-            new_mog.tt_done = np.r_[new_mog.tt_done, mog.tt_done]
-            new_mog.ttTx = np.r_[new_mog.ttTx, mog.ttTx]
-            new_mog.ttTx_done = np.r_[new_mog.ttTx_done, mog.ttTx_done]
-            new_mog.amp_tmin = np.r_[new_mog.amp_tmin, mog.amp_tmin]
-            new_mog.amp_tmax = np.r_[new_mog.amp_tmax, mog.amp_tmax]
-            new_mog.amp_done = np.r_[new_mog.amp_done, mog.amp_done]
-            new_mog.App = np.r_[new_mog.App, mog.App]
-            new_mog.fcentroid = np.r_[new_mog.fcentroid, mog.fcentroid]
-            new_mog.scentroid = np.r_[new_mog.scentroid, mog.scentroid]
-            new_mog.tauApp = np.r_[new_mog.tauApp, mog.tauApp]
-            new_mog.tauApp_et = np.r_[new_mog.tauApp_et, mog.tauApp_et]
-            new_mog.tauFce = np.r_[new_mog.tauFce, mog.tauFce]
-            new_mog.tauFce_et = np.r_[new_mog.tauFce_et, mog.tauFce_et]
-            new_mog.tauHyb = np.r_[new_mog.tauHyb, mog.tauHyb]
-            new_mog.tauHyb_et = np.r_[new_mog.tauHyb_et, mog.tauHyb_et]
-            new_mog.Tx_z_orig = np.r_[new_mog.Tx_z_orig, mog.Tx_z_orig]
-            new_mog.Rx_z_orig = np.r_[new_mog.Rx_z_orig, mog.Rx_z_orig]
-            
-            new_mog.data.ntrace += mog.data.ntrace
-            new_mog.data.rdata = np.c_[new_mog.data.rdata, mog.data.rdata]
-            new_mog.data.Tx_x = np.r_[new_mog.data.Tx_x, mog.data.Tx_x]
-            new_mog.data.Tx_y = np.r_[new_mog.data.Tx_y, mog.data.Tx_y]
-            new_mog.data.Tx_z = np.r_[new_mog.data.Tx_z, mog.data.Tx_z]
-            new_mog.data.Rx_x = np.r_[new_mog.data.Rx_x, mog.data.Rx_x]
-            new_mog.data.Rx_y = np.r_[new_mog.data.Rx_y, mog.data.Rx_y]
-            new_mog.data.Rx_z = np.r_[new_mog.data.Rx_z, mog.data.Rx_z]
+        new_mog.tau_params = np.concatenate([mog.tau_params for mog in mog_list])
+        new_mog.fw = np.concatenate([mog.fw for mog in mog_list])
+        new_mog.ttTx = np.concatenate([mog.ttTx for mog in mog_list])
+        new_mog.ttTx_done = np.concatenate([mog.ttTx_done for mog in mog_list])
+        new_mog.traces = np.concatenate([mog.traces for mog in mog_list])
+
+        new_mog.data.ntrace = sum([mog.data.ntrace for mog in mog_list])
+        for attr in ('Tx_x', 'Tx_y', 'Tx_z', 'Rx_x', 'Rx_y', 'Rx_z'):
+            setattr(new_mog.data, attr, np.concatenate([getattr(mog.data, attr) for mog in mog_list]))
+
+        if virtual:
+            new_mog.data.rdata = MergedTraces([mog.data.rdata for mog in mog_list])
+        else:
+            new_mog.data.rdata = np.empty((new_mog.data.nptsptrc, new_mog.data.ntrace),
+                                          dtype=np.result_type(*[mog.data.rdata.dtype for mog in mog_list]))
+            start = 0
+            for mog in mog_list:
+                new_mog.data.rdata[:, start:start + mog.data.ntrace] = mog.data.rdata[:, :]
+                start += mog.data.ntrace
 
         new_mog.pruneParams.zmin = min(np.array([new_mog.data.Tx_z, new_mog.data.Rx_z]).flatten())
         new_mog.pruneParams.zmax = max(np.array([new_mog.data.Tx_z, new_mog.data.Rx_z]).flatten())
         
         if sort:
-            new_mog.sort_by_Tx()
+            new_mog.sort_by_Tx(lazy=virtual)
         return new_mog
 
+
+def fingerprint(*arrays):
+    """
+    Digest of the content of arrays, used to detect changes made in place
+    """
+    h = hashlib.blake2b(digest_size=16)
+    for a in arrays:
+        a = np.ascontiguousarray(a)
+        h.update(str((a.dtype, a.shape)).encode())
+        h.update(a)
+    return h.digest()
+
+
 class AirShots():
     def __init__(self, name='', data=MogData()):
         self.name = name
@@ -690,6 +1215,7 @@ class AirShots():
         self.tt = -1 * np.ones((1, self.data.ntrace), dtype=float)
         self.et = -1 * np.ones((1, self.data.ntrace), dtype=float)
         self.tt_done = np.zeros((1, self.data.ntrace), dtype=bool)
+        self._t0_cache = None  # see Mog.airshot_t0
         
         self.modified = True
 
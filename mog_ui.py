@@ -40,7 +40,7 @@ from spectrum import arburg
 
 from database import BhTomoDb
 from mog import MogData, Mog, AirShots
-from utils import compute_SNR, data_select
+from utils import data_select
 from utils_ui import MyQLabel, choose_mog
 
 
@@ -69,22 +69,31 @@ class MOGUI(QtWidgets.QWidget):  # Multi Offset Gather User Interface
         # Conditions to get the path of the file itself in order to execute it
         if ".rad" in filename.lower() or ".rd3" in filename.lower() or ".tlf" in filename.lower():
             basename = filename[:-4]
+            segy = False
+
+        elif ".sgy" in filename.lower() or ".segy" in filename.lower():
+            basename = os.path.splitext(filename)[0]
+            segy = True
 
         else:
-            self.moglogSignal.emit("Error: MOG file must have either *.rad, *.rd3 or *.tlf extension")
+            self.moglogSignal.emit("Error: MOG file must have either *.rad, *.rd3, *.tlf, *.sgy or *.segy extension")
             return
 
         try:
             self.data_rep,rname = os.path.split(basename)
 
             mogdata = MogData(rname)
-            try:
-                mogdata.readRAMAC(basename)
-            except IOError:
-                position_input = PositionInputDialog(mogdata)
-                ans = position_input.exec()
-                if ans == QtWidgets.QDialog.Rejected:
-                    return
+            if segy:
+                # positions are read from the trace headers
+                mogdata.readSEGY(filename)
+            else:
+                try:
+                    mogdata.readRAMAC(basename, memmap=True)
+                except IOError:
+                    position_input = PositionInputDialog(mogdata)
+                    ans = position_input.exec()
+                    if ans == QtWidgets.QDialog.Rejected:
+                        return
 
             mog = Mog(rname, mogdata)
             try:
@@ -389,7 +398,7 @@ class MOGUI(QtWidgets.QWidget):  # Multi Offset Gather User Interface
         self.Tx_num_list.clear()
         if itemNo != -1:
             mog = self.db.mogs[itemNo]
-            unique_Tx_z = np.unique(mog.data.Tx_z)
+            unique_Tx_z = mog.geometry.uTx_z
 
             for Tx in range(len(unique_Tx_z)):
                 self.Tx_num_list.addItem(str(Tx))
@@ -405,36 +414,37 @@ class MOGUI(QtWidgets.QWidget):  # Multi Offset Gather User Interface
             self.Tx_elev_value_label.clear()
             ind1 = self.Tx_num_list.selectedIndexes()
             ind2 = int(self.trace_num_edit.text())
-            unique_Tx_z = np.unique(mog.data.Tx_z)[::-1]
+            unique_Tx_z = mog.geometry.uTx_z[::-1]
             for i in ind1:
                 self.Tx_elev_value_label.setText(str((list(unique_Tx_z))[-i.row()]))
 
             self.value_elev_label.setText(str((list(unique_Tx_z))[-ind2]))
 
     def search_Tx_elev(self):
+        try:
+            item = float(self.search_elev_edit.text())
+        except ValueError:
+            red = QtGui.QPalette()
+            red.setColor(QtGui.QPalette.Foreground, QtCore.Qt.red)
+            self.search_info_label.setText('{} is not a number'.format(self.search_elev_edit.text()))
+            self.search_info_label.setPalette(red)
+            return
+
         if self.search_combo.currentText() == 'Search with Elevation':
-            try:
-                item = float(self.search_elev_edit.text())
-            except:
-                pass
             item_ = self.MOG_list.currentRow()
             mog = self.db.mogs[item_]
-            for i in range(len(mog.data.Tx_z)):
-                if mog.data.Tx_z[i] == item:
-                    self.Tx_num_list.setCurrentRow(i + 1)
-                elif item not in mog.data.Tx_z:
-                    idx = np.argmin((np.abs(np.unique(mog.data.Tx_z) - item)))
-                    self.Tx_num_list.setCurrentRow(idx + 1)
-                    green = QtGui.QPalette()
-                    green.setColor(QtGui.QPalette.Foreground, QtCore.Qt.darkCyan)
-                    self.search_info_label.setText('{} is not a value in this data, {} is the closest'.format(item, np.unique(mog.data.Tx_z)[idx], decimals=1))
-                    self.search_info_label.setPalette(green)
-                self.update_spectra_and_coverage_Tx_elev_value_label()
+            idx = np.argmin((np.abs(mog.geometry.uTx_z - item)))
+            self.Tx_num_list.setCurrentRow(idx + 1)
+            if mog.geometry.uTx_z[idx] != item:
+                green = QtGui.QPalette()
+                green.setColor(QtGui.QPalette.Foreground, QtCore.Qt.darkCyan)
+                self.search_info_label.setText('{} is not a value in this data, {} is the closest'.format(item, mog.geometry.uTx_z[idx], decimals=1))
+                self.search_info_label.setPalette(green)
+            self.update_spectra_and_coverage_Tx_elev_value_label()
 
         elif self.search_combo.currentText() == 'Search with Number':
-            item = float(self.search_elev_edit.text())
             if item in range(len(self.Tx_num_list)):
-                self.Tx_num_list.setCurrentRow(item)
+                self.Tx_num_list.setCurrentRow(int(item))
             else:
                 red = QtGui.QPalette()
                 red.setColor(QtGui.QPalette.Foreground, QtCore.Qt.red)
@@ -687,100 +697,20 @@ class MOGUI(QtWidgets.QWidget):  # Multi Offset Gather User Interface
         if itemNo != -1:
             mog = self.db.mogs[itemNo]
 
-            # List which contain the indexes of the skipped Tx and Rx
-            inRx = []
-            inTx = []
-
-            # Reinitialisation of the boolean vectors before modification
-            mog.in_Rx_vect = np.ones(mog.data.ntrace, dtype=bool)
-            mog.in_Tx_vect = np.ones(mog.data.ntrace, dtype=bool)
-
-            # Information from all the edits of the prune widget
-            new_min = float(self.min_elev_edit.text())
-            new_max = float(self.max_elev_edit.text())
-            skip_len_Rx = int(self.skip_Rx_edit.text())
-            skip_len_Tx = int(self.skip_Tx_edit.text())
-            round_factor = float(self.round_fac_edit.text())
-            use_snr = self.thresh_check.isChecked()
-            threshold_snr = float(self.thresh_edit.text())
-            ang_min = float(self.min_ang_edit.text())
-            ang_max = float(self.max_ang_edit.text())
-
-            # -These steps are for the constraining of the Tx's ad Rx's elevation--------------------------------------------
-            # Because the truth of multiple values array is ambiguous, we have to do these steps
-
-            # We first create a boolean vector which will have a True value if the elevation is greater or equals the new min
-            # and will be False the other way
-            min_Tx = np.greater_equal(-np.unique(mog.data.Tx_z), new_min)
-            min_Rx = np.greater_equal(-np.unique(np.sort(mog.data.Rx_z)), new_min)
-
-            # Then we create another boolean vector which will have a True value if the elevation is less or equals the new max
-            # and will be false otherwise
-            max_Tx = np.less_equal(-np.unique(mog.data.Tx_z), new_max)
-            max_Rx = np.less_equal(-np.unique(np.sort(mog.data.Rx_z)), new_max + 0.0000000001)  # TODO À voir avec bernard
-
-            # Finally, we add these two boolean vectors as integer type. The subsequent vector will have values of 1 and 2,
-            # but only the 2s are of interest because they mean that the value is true, either in the min vector than the
-            # max vector.we than substract 1 to this vector and transform it to a boolean type to have the right points
-            # plotted in the pruneFig
-            mog.in_Tx_vect = (min_Tx.astype(int) + max_Tx.astype(int) - 1).astype(bool)
-            mog.in_Rx_vect = (min_Rx.astype(int) + max_Rx.astype(int) - 1).astype(bool)
-
-            # We then append a False boolean vector to fit the lenght of ntrace
-            mog.in_Tx_vect = np.append(mog.in_Tx_vect, np.ones(mog.data.ntrace - len(min_Tx), dtype=bool))
-            mog.in_Rx_vect = np.append(mog.in_Rx_vect, np.ones(mog.data.ntrace - len(min_Rx), dtype=bool))
-
-            # -These steps are for the skipping of Txs and Rxs---------------------------------------------------------------
-
-            # We first get the unique version of Rx_z and Tx_z
-            unique_Rx_z = np.unique(mog.data.Rx_z)
-            unique_Tx_z = np.unique(mog.data.Tx_z)
-
-            # And then we apply the skip_len with proper matrix indexing
-            unique_Rx_z = unique_Rx_z[::skip_len_Rx + 1]
-            unique_Tx_z = unique_Tx_z[::skip_len_Tx + 1]
-            # Why the +1 ? its because skipping 0 would bring out an error. The initial skipping value is 1, which skips no values
-
-            # We then look for the indexes of the skipped values
-            for i in range(len(np.unique(mog.data.Rx_z))):
-                if np.unique(mog.data.Rx_z)[i] not in unique_Rx_z:
-                    inRx.append(i)
-            # And the we assing and False to the skipped points, so the plotting can be successful
-            for value in inRx:
-                mog.in_Rx_vect[value] = False
-
-            # here its the same thig but for the Txs
-            for i in range(len(np.unique(mog.data.Tx_z))):
-                if np.unique(mog.data.Tx_z)[i] not in unique_Tx_z:
-                    inTx.append(i)
-            for value in inTx:
-                mog.in_Tx_vect[value] = False
-
-            # For the angular restrictions, we first calculate the X-Y distance between the Tx's and Rx's
-            dr = np.sqrt((mog.data.Tx_x - mog.data.Rx_x)**2 + (mog.data.Tx_y - mog.data.Rx_y)**2)
-
-            # Then we call the arctan2 function from numpy which gives us the angle for every couple Tx-Rx
-            theta = np.arctan2(mog.data.Tx_z - mog.data.Rx_z, dr) * 180 / np.pi
-
-            # After finding all the angles of the Tx-Rx set, we do the same thing we did for the elevation
-            min_theta = np.greater_equal(theta, ang_min)
-            max_theta = np.less_equal(theta, ang_max)
-
-            intheta = (min_theta.astype(int) + max_theta.astype(int) - 1).astype(bool)
-
-            # We then look for the indexes of the angle values which don't fit in the restrictions
-            false_theta = np.where(not intheta)
-
-            # Then we associate a false value to these indexes in the in_Rx_vect so the plot will contain only the Rx points
-            # which fit the constraints values of the min_ang and max_ang edits
-            for false_index in false_theta[0]:
-                mog.in_Rx_vect[false_index] = False
-
-            if use_snr:
-                # TODO: Faire la fonction detrend_rad
-                SNR = compute_SNR(mog)
-
-            mog.in_vect = (mog.in_Rx_vect.astype(int) + mog.in_Tx_vect.astype(int) - 1).astype(bool)
+            # Information from all the edits of the prune widget, elevations in the edits are -z
+            params = mog.pruneParams
+            params.zmin = -float(self.max_elev_edit.text())
+            params.zmax = -float(self.min_elev_edit.text())
+            params.stepRx = int(self.skip_Rx_edit.text())
+            params.stepTx = int(self.skip_Tx_edit.text())
+            params.round_factor = float(self.round_fac_edit.text())
+            params.use_SNR = self.thresh_check.isChecked()
+            params.threshold_SNR = float(self.thresh_edit.text())
+            params.thetaMin = float(self.min_ang_edit.text())
+            params.thetaMax = float(self.max_ang_edit.text())
+            round_factor = params.round_factor
+
+            mog.apply_prune(params)
 
             # And then. when all of the steps have been done, we update the prune info subwidget and plot the graphic
             self.update_prune_info()
@@ -1614,9 +1544,7 @@ class SpectraFig(FigureCanvasQTAgg):
         self.ax2.cla()
         self.ax3.cla()
 
-        Tx = np.unique(mog.data.Tx_z)
-
-        ind = Tx[n] == mog.data.Tx_z
+        ind = mog.geometry.gather(n)
 
         fac_f = 1
         fac_t = 1
@@ -1771,7 +1699,7 @@ class ZOPFig(FigureCanvasQTAgg):  # Zero Offset Profile (ZOP) Figure
         amp_state = self.ui.amp_check.isChecked()
         color_scale = float(self.ui.color_scale_edit.text())
 
-        dz = np.abs(mog.data.Tx_z - mog.data.Rx_z)
+        dz = np.abs(mog.geometry.dz)
         zop_ind = np.where(dz <= tol)[0]
 
         zop_picked_ind = np.less_equal(dz, tol).astype(int) + np.not_equal(mog.tt, -1).astype(int)
@@ -1812,9 +1740,7 @@ class ZOPFig(FigureCanvasQTAgg):  # Zero Offset Profile (ZOP) Figure
 
         # TODO: faire le module bh_tomo_amp afin de pouvoir obtenir les informations sur les amplitudes
         if amp_state:
-            rayl = np.sqrt((mog.data.Tx_x[zop_ind] - mog.data.Rx_x[zop_ind])**2 +
-                           (mog.data.Tx_y[zop_ind] - mog.data.Rx_y[zop_ind])**2 +
-                           (mog.data.Tx_z[zop_ind] - mog.data.Rx_z[zop_ind])**2)
+            rayl = mog.geometry.dist[zop_ind]
 
         self.ax1.imshow(mog.data.rdata[:, zop_ind].T,
                         extent=[mog.data.timestp[0], mog.data.timestp[-1], zmin, zmax],
@@ -1840,11 +1766,9 @@ class ZOPFig(FigureCanvasQTAgg):  # Zero Offset Profile (ZOP) Figure
 
     def calculate_Vapp(self, mog):
 
-        hyp = np.sqrt((mog.data.Tx_x - mog.data.Rx_x)**2 +
-                      (mog.data.Tx_y - mog.data.Rx_y)**2 +
-                      (mog.data.Tx_z - mog.data.Rx_z)**2)
+        hyp = mog.geometry.dist
 
-        tt, _ = mog.getCorrectedTravelTimes()
+        tt, _ = mog.getCorrectedTravelTimes(show=True)
         et = mog.et
         vapp = hyp / tt
         in_minus = hyp / (tt - et)
@@ -1863,7 +1787,7 @@ class ZOPRaysFig(FigureCanvasQTAgg):
 
     def plot_rays(self, mog, offset_tol):
         self.ax.cla()
-        dz = np.abs(mog.data.Tx_z - mog.data.Rx_z)
+        dz = np.abs(mog.geometry.dz)
 
         zop = np.less_equal(dz, offset_tol)
 
@@ -1938,17 +1862,12 @@ class StatsttFig(FigureCanvasQTAgg):
         done = (mog.tt_done + mog.in_vect.astype(int))
         ind = np.where(done == 2)[0]
 
-        tt, t0 = mog.getCorrectedTravelTimes()
+        tt, t0 = mog.getCorrectedTravelTimes(show=True)
         et = mog.et[ind]
         tt = tt[ind]
 
-        hyp = np.sqrt((mog.data.Tx_x[ind] - mog.data.Rx_x[ind])**2 +
-                      (mog.data.Tx_y[ind] - mog.data.Rx_y[ind])**2 +
-                      (mog.data.Tx_z[ind] - mog.data.Rx_z[ind])**2)
-
-        dz = mog.data.Rx_z[ind] - mog.data.Tx_z[ind]
-
-        theta = 180.0 / np.pi * np.arcsin(dz / hyp)
+        hyp = mog.geometry.dist[ind]
+        theta = mog.geometry.theta[ind]
 
         vapp = hyp / tt
         # n = np.arange(len(ind))
@@ -2056,13 +1975,8 @@ class StatsAmpFig(FigureCanvasQTAgg):
 
     def plot_stats(self, mog):
         # TODO: faire le module Bh_Tomo_amp afin d'avoir les données nécessaires pour les statistiques sur les amplitudes pointées
-        hyp = np.sqrt((mog.data.Tx_x - mog.data.Rx_x)**2 +
-                      (mog.data.Tx_y - mog.data.Rx_y)**2 +
-                      (mog.data.Tx_z - mog.data.Rx_z)**2)
-
-        dz = mog.data.Rx_z - mog.data.Tx_z
-
-        theta = 180 / np.pi * np.arcsin(dz / hyp)
+        hyp = mog.geometry.dist
+        theta = mog.geometry.theta
 
         ind = np.nonzero(mog.amp_tmax != -1)[0] == np.nonzero(mog.tauApp != -1)[0]
 
@@ -2152,9 +2066,8 @@ class RayCoverageFig(FigureCanvasQTAgg):
 
             self.draw()
         else:
-            Tx = np.unique(mog.data.Tx_z)
-            ind_unpicked = np.where(Tx_Rx_zs[0, unpicked_tt] == Tx[n])[0]
-            ind_picked = np.where(Tx_Rx_zs[0, picked_tt] == Tx[n])[0]
+            ind_unpicked = np.where(mog.geometry.Tx_ind[unpicked_tt] == n)[0]
+            ind_picked = np.where(mog.geometry.Tx_ind[picked_tt] == n)[0]
 
             if show_type == 'Show picked and unpicked':
                 tmp_Tx_Rx_xs = Tx_Rx_xs[:, unpicked_tt]
@@ -2195,14 +2108,9 @@ class PruneFig(FigureCanvasQTAgg):
     def plot_prune(self, mog, round_factor):
         self.ax.cla()
 
-        false_Rx_ind = np.nonzero(np.logical_not(mog.in_Rx_vect))  # TODO: false_Rx_ind = np.nonzero(mog.in_Rx_vect == False)
-        false_Tx_ind = np.nonzero(np.logical_not(mog.in_Tx_vect))
-
-        Tx_zs = np.unique(mog.data.Tx_z)
-        Rx_zs = np.unique(mog.data.Rx_z)
-
-        Tx_zs = np.delete(Tx_zs, false_Tx_ind[0])
-        Rx_zs = np.delete(Rx_zs, false_Rx_ind[0])
+        # positions of Tx and Rx kept after pruning
+        Tx_zs = np.unique(mog.data.Tx_z[mog.in_Tx_vect])
+        Rx_zs = np.unique(mog.data.Rx_z[mog.in_Rx_vect])
 
         if round_factor == 0:
             pass
@@ -2394,41 +2302,9 @@ class MergeMog(QtWidgets.QWidget):   # TODO: make this work
 
         newName = self.new_edit.text()
         refMog = self.mogUI.db.mogs[self.ref_combo.currentIndex()]
-        newMog = Mog(newName, refMog.data)
+        newMog = Mog.merge_mogs([refMog, merging_mog], newName)
         self.mogUI.db.mogs.append(newMog)
 
-        newMog.av           = refMog.av
-        newMog.ap           = refMog.ap
-        newMog.Tx           = refMog.Tx
-        newMog.Rx           = refMog.Rx
-        newMog.f_et         = np.array([refMog.f_et, merging_mog.f_et])
-        newMog.type         = np.array([refMog.type, merging_mog.type])
-        newMog.fac_dt       = np.array([refMog.fac_dt, merging_mog.fac_dt])
-        newMog.user_fac_dt  = np.array([refMog.user_fac_dt, merging_mog.user_fac_dt])
-        newMog.fw           = np.array([refMog.fw, merging_mog.fw])
-        newMog.tt           = np.array([refMog.tt, merging_mog.tt])
-        newMog.et           = np.array([refMog.et, merging_mog.et])
-        newMog.tt_done      = np.array([refMog.tt_done, merging_mog.tt_done])
-        newMog.ttTx         = np.array([refMog.ttTx, merging_mog.ttTx])
-        newMog.ttTx_done    = np.array([refMog.ttTx_done, merging_mog.ttTx_done])
-        newMog.amp_tmin     = np.array([refMog.amp_tmin, merging_mog.amp_tmin])
-        newMog.amp_tmax     = np.array([refMog.amp_tmax, merging_mog.amp_tmax])
-        newMog.amp_done     = np.array([refMog.amp_done, merging_mog.amp_done])
-        newMog.App          = np.array([refMog.App, merging_mog.App])
-        newMog.fcentroid    = np.array([refMog.fcentroid, merging_mog.fcentroid])
-        newMog.scentroid    = np.array([refMog.scentroid, merging_mog.scentroid])
-        newMog.tauApp       = np.array([refMog.tauApp, merging_mog.tauApp])
-        newMog.tauApp_et    = np.array([refMog.tauApp_et, merging_mog.tauApp_et])
-        newMog.tauFce       = np.array([refMog.tauFce, merging_mog.tauFce])
-        newMog.tauFce_et    = np.array([refMog.tauFce_et, merging_mog.tauFce_et])
-        newMog.tauHyb       = np.array([refMog.tauHyb, merging_mog.tauHyb])
-        newMog.tauHyb_et    = np.array([refMog.tauHyb_et, merging_mog.tauHyb_et])
-        newMog.Tx_z_orig    = np.array([refMog.Tx_z_orig, merging_mog.Tx_z_orig])
-        newMog.Rx_z_orig    = np.array([refMog.Rx_z_orig, merging_mog.Rx_z_orig])
-        newMog.in_vect      = np.array([refMog.in_vect, merging_mog.in_vect])
-        newMog.in_Tx_vect   = np.array([refMog.in_Tx_vect, merging_mog.in_Tx_vect])
-        newMog.in_Rx_vect   = np.array([refMog.in_Rx_vect, merging_mog.in_Rx_vect])
-
         if self.erase_check.isChecked():
 
             self.dialog.setText("following MOGs will be erased : {} {}".format(refMog.name, merging_mog.name))
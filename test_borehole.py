@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Regression tests of borehole.py against the former (loop-based) implementations
+
+Run with pytest from the root directory of BhTomoPy
+"""
+import glob
+import os
+
+import numpy as np
+import pytest
+
+from borehole import Borehole
+
+TEST_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'testData')
+
+
+def project_loop(fdata, ldepth):
+    # former Borehole.project, locating each point in the trajectory separately
+    npts = ldepth.size
+    x = np.zeros((npts, 1))
+    y = np.zeros((npts, 1))
+    z = np.zeros((npts, 1))
+    c = np.zeros((npts, 3))
+    depthBH = np.append(np.array([[0]]), np.cumsum(np.sqrt(np.sum(np.diff(fdata, n=1, axis=0) ** 2, axis=1))))
+    for n in range(npts):
+        i1, = np.nonzero(ldepth[n] >= depthBH)
+        i2, = np.nonzero(ldepth[n] < depthBH)
+        if i1.size == 0 or i2.size == 0:
+            raise ValueError('Depth data outside trajectory range')
+        i1 = i1[-1]
+        i2 = i2[0]
+        d = np.sqrt(np.sum((fdata[i2, :] - fdata[i1, :]) ** 2))
+        l = (fdata[i2, :] - fdata[i1, :]) / d
+        d2 = ldepth[n] - depthBH[i1]
+        x[n] = fdata[i1, 0] + d2 * l[0]
+        y[n] = fdata[i1, 1] + d2 * l[1]
+        z[n] = fdata[i1, 2] + d2 * l[2]
+        c[n, :] = l
+    return x, y, z, c
+
+
+def trajectories():
+    # vertical boreholes of testData, and a deviated borehole with irregular stations
+    for filename in sorted(glob.glob(os.path.join(TEST_DATA, 'testConstraints', '*.xyz'))):
+        yield os.path.basename(filename), np.loadtxt(filename)
+    s = np.cumsum(np.random.RandomState(0).uniform(0.2, 2.0, 30))
+    s = np.append(0.0, s)
+    yield 'deviated', np.vstack((0.05 * s, 1.0 + 0.002 * s ** 2, -s)).T
+
+
+@pytest.mark.parametrize('name, fdata', list(trajectories()))
+def test_project(name, fdata):
+    length = np.sum(np.sqrt(np.sum(np.diff(fdata, axis=0) ** 2, axis=1)))
+    ldepth = np.random.RandomState(1).uniform(0.0, length, 500)
+    ldepth[:3] = [0.0, 0.3 * length, 0.3 * length]  # top of borehole, repeated depths
+    ldepth = np.append(ldepth, np.arange(0.0, length, 0.25))
+
+    x, y, z, c = Borehole.project(fdata, ldepth)
+    x0, y0, z0, c0 = project_loop(fdata, ldepth)
+    for a, a0 in ((x, x0), (y, y0), (z, z0), (c, c0)):
+        assert a.shape == a0.shape
+        np.testing.assert_allclose(a, a0, rtol=0, atol=1e-12)
+
+
+def test_project_outside():
+    fdata = np.array([[0.0, 0.0, 0.0], [0.0, 0.0, -10.0]])
+    for ldepth in (np.array([2.0, -0.5]), np.array([10.0]), np.array([3.0, 12.0])):
+        with pytest.raises(ValueError):
+            Borehole.project(fdata, ldepth)
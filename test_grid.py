@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Regression tests of the derivative operators of grid.py against the former
+(loop-based) implementation
+
+Run with pytest from the root directory of BhTomoPy (requires ttcrpy)
+"""
+import numpy as np
+import pytest
+from scipy.sparse import csr_matrix
+
+grid = pytest.importorskip('grid')
+
+
+def derivative_loop(nx, nz, order, dx=1, dz=1):
+    # former Grid2D.derivative, filling the operators one column of cells at a time
+    if order == 1:
+        idx = 1 / dx
+        idz = 1 / dz
+
+        i = np.kron(np.arange(nx * nz), np.ones((2, ), dtype=int))
+        j = np.zeros((nz * nx * 2, ), dtype=int)
+        v = np.zeros((nz * nx * 2, ))
+
+        jj = np.vstack((np.arange(nz), nz + np.arange(nz))).T
+        jj = jj.flatten()
+        j[:2 * nz] = jj
+        vd = idx * np.tile(np.array([-1, 1]), (nz, ))
+        v[:2 * nz] = vd
+
+        jj = np.vstack((-nz + np.arange(nz), nz + np.arange(nz))).T
+        jj = jj.flatten()
+        for n in range(1, nx - 1):
+            j[n * 2 * nz:(n + 1) * 2 * nz] = n * nz + jj
+            v[n * 2 * nz:(n + 1) * 2 * nz] = 0.5 * vd
+
+        jj = np.vstack((-nz + np.arange(nz), np.arange(nz))).T
+        jj = jj.flatten()
+        j[(nx - 1) * 2 * nz:nx * 2 * nz] = (nx - 1) * nz + jj
+        v[(nx - 1) * 2 * nz:nx * 2 * nz] = vd
+
+        Dx = csr_matrix((v, (i, j)))
+
+        jj = np.vstack((np.hstack((0, np.arange(nz - 1))),
+                        np.hstack((np.arange(1, nz), nz - 1)))).T
+        jj = jj.flatten()
+        vd = idz * np.hstack((np.array([-1, 1]),
+                              np.tile(np.array([-0.5, 0.5]), (nz - 2,)), np.array([-1, 1])))
+
+        for n in range(nx):
+            j[n * 2 * nz:(n + 1) * 2 * nz] = n * nz + jj
+            v[n * 2 * nz:(n + 1) * 2 * nz] = vd
+
+        Dz = csr_matrix((v, (i, j)))
+    else:
+        idx2 = 1 / (dx * dx)
+        idz2 = 1 / (dz * dz)
+
+        i = np.kron(np.arange(nx * nz), np.ones((3, ), dtype=np.int64))
+        j = np.zeros((nz * nx * 3, ), dtype=np.int64)
+        v = np.zeros((nz * nx * 3, ))
+
+        jj = np.vstack((np.arange(nz), nz + np.arange(nz), 2 * nz + np.arange(nz))).T
+        jj = jj.flatten()
+        j[:3 * nz] = jj
+        vd = idx2 * np.tile(np.array([1.0, -2.0, 1.0]), (nz, ))
+        v[:3 * nz] = vd
+
+        for n in range(1, nx - 1):
+            j[n * 3 * nz:(n + 1) * 3 * nz] = (n - 1) * nz + jj
+            v[n * 3 * nz:(n + 1) * 3 * nz] = vd
+
+        j[(nx - 1) * 3 * nz:nx * 3 * nz] = (nx - 3) * nz + jj
+        v[(nx - 1) * 3 * nz:nx * 3 * nz] = vd
+
+        Dx = csr_matrix((v, (i, j)))
+
+        jj = np.vstack((np.hstack((0, np.arange(nz - 2), nz - 3)),
+                        np.hstack((1, np.arange(1, nz - 1), nz - 2)),
+                        np.hstack((2, np.arange(2, nz), nz - 1)))).T
+        jj = jj.flatten()
+        vd = vd * idz2 / idx2
+
+        for n in range(nx):
+            j[n * 3 * nz:(n + 1) * 3 * nz] = n * nz + jj
+            v[n * 3 * nz:(n + 1) * 3 * nz] = vd
+
+        Dz = csr_matrix((v, (i, j)))
+
+    return Dx, Dz
+
+
+@pytest.mark.parametrize('nx, nz', [(6, 8), (3, 3), (4, 11), (50, 70)])
+@pytest.mark.parametrize('order', [1, 2])
+@pytest.mark.parametrize('normalize', [False, True])
+def test_derivative_2d(nx, nz, order, normalize):
+    g = grid.Grid2D(0.25 * np.arange(nx + 1.0), 0.5 * np.arange(nz + 1.0))
+    Dx, Dy, Dz = g.derivative(order, normalize=normalize)
+    if normalize:
+        Dx0, Dz0 = derivative_loop(nx, nz, order, 0.25, 0.5)
+    else:
+        Dx0, Dz0 = derivative_loop(nx, nz, order)
+
+    assert Dx.shape == Dy.shape == Dz.shape == (nx * nz, nx * nz)
+    assert Dy.nnz == 0
+    assert abs(Dx - Dx0).max() < 1e-12
+    assert abs(Dz - Dz0).max() < 1e-12
+
+
+def test_derivative_cache():
+    g = grid.Grid2D(np.arange(6.0), np.arange(9.0))
+    D = g.derivative(1)
+    assert all(a is b for a, b in zip(D, g.derivative(1)))
+    with pytest.raises(ValueError):
+        D[0].data[0] = 2.0
+
+    Dw = g.derivative(1, weights=(2.0, 0.0, 3.0))
+    np.testing.assert_allclose(Dw[0].toarray(), 2.0 * D[0].toarray())
+    np.testing.assert_allclose(Dw[2].toarray(), 3.0 * D[2].toarray())
+
+    # operators follow changes of the cells
+    g.grz = np.arange(12.0)
+    assert g.derivative(1)[0].shape == (5 * 11, 5 * 11)
+
+
+@pytest.mark.parametrize('order', [1, 2])
+def test_derivative_3d(order):
+    grx = 0.5 * np.arange(5.0)
+    gry = 0.25 * np.arange(4.0)
+    grz = np.arange(7.0)
+    g = grid.Grid3D(grx, gry, grz)
+    Dx, Dy, Dz = g.derivative(order, normalize=True)
+
+    # linear field, cells in x, y, z order
+    xc, yc, zc = [0.5 * (gr[1:] + gr[:-1]) for gr in (grx, gry, grz)]
+    f = (2.0 * xc.reshape(-1, 1, 1) - 3.0 * yc.reshape(1, -1, 1) + 0.5 * zc.reshape(1, 1, -1)).flatten()
+    expected = (2.0, -3.0, 0.5) if order == 1 else (0.0, 0.0, 0.0)
+    for D, e in zip((Dx, Dy, Dz), expected):
+        np.testing.assert_allclose(D @ f, e, rtol=0, atol=1e-12)
+
+
+def test_straight_rays_3d_aniso():
+    g = grid.Grid3D(np.arange(5.0), np.arange(4.0), np.arange(7.0))
+    g.Tx = np.array([[0.5, 0.5, 0.5]])
+    g.Rx = np.array([[3.5, 2.5, 5.5]])
+    with pytest.raises(ValueError):
+        g.getForwardStraightRays(aniso=True)
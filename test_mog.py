@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+Regression tests of mog.py against the former (loop-based) implementations
+
+Run with pytest from the root directory of BhTomoPy
+"""
+import glob
+import os
+import re
+
+import numpy as np
+import pytest
+
+from mog import MogData, Mog, IndexedTraces, MergedTraces
+
+TEST_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'testData')
+
+
+def read_tlf_loop(filename):
+    # former MogData.readTLF, appending the traces of each line
+    Tx_z = np.array([])
+    Rx_z = np.array([])
+    with open(filename, 'r') as file:
+        lines = file.readlines()[1:]
+    for line in lines:
+        line_contents = re.findall(r"[-+]?\d*\.\d+|\d+", line)
+        tnd = int(line_contents[0])
+        tnf = int(line_contents[1])
+        Rxd = float(line_contents[2])
+        Rxf = float(line_contents[3])
+        Tx = float(line_contents[4])
+        nt = tnf - tnd + 1
+        if nt == 1:
+            dRx = 1
+            if Rxd > Rxf:
+                Rxd = Rxf
+        else:
+            dRx = (Rxf - Rxd) / (nt - 1)
+        vect = np.arange(Rxd, Rxf + dRx / 2, dRx)
+        if nt > 0:
+            Tx_z = np.append(Tx_z, (Tx * np.ones(np.abs(nt))))
+            Rx_z = np.concatenate((Rx_z, vect))
+    return Tx_z, Rx_z
+
+
+@pytest.mark.parametrize('filename', sorted(glob.glob(os.path.join(TEST_DATA, '*', '*.tlf')) +
+                                            glob.glob(os.path.join(TEST_DATA, '*', '*', '*.tlf'))))
+def test_readTLF(filename):
+    md = MogData()
+    md.readTLF(filename)
+    Tx_z, Rx_z = read_tlf_loop(filename)
+    np.testing.assert_array_equal(md.Tx_z, Tx_z)
+    np.testing.assert_allclose(md.Rx_z, Rx_z, rtol=0, atol=1e-10)
+
+
+def test_readTLF_single_trace(tmp_path):
+    filename = tmp_path / 'single.tlf'
+    filename.write_text('#First trace     Last trace     First pos     Last pos     Fixed pos\n'
+                        '   0     2     1.00    2.00    0.50\n'
+                        '   3     3     4.00    3.00    0.75\n'
+                        '   4     5     2.00    1.00    1.00\n'
+                        '   6     7     0.00    1.00    1.25    12    # extra field\n')
+    md = MogData()
+    md.readTLF(str(filename))
+    np.testing.assert_array_equal(md.Tx_z, [0.5, 0.5, 0.5, 0.75, 1.0, 1.0, 1.25, 1.25])
+    np.testing.assert_allclose(md.Rx_z, [1.0, 1.5, 2.0, 3.0, 2.0, 1.0, 0.0, 1.0])
+
+
+def test_readTLF_truncated(tmp_path):
+    filename = tmp_path / 'truncated.tlf'
+    filename.write_text('#First trace     Last trace     First pos     Last pos     Fixed pos\n'
+                        '   0     2     1.00    2.00    0.50\n'
+                        '   3     4     4.00    3.00\n')
+    with pytest.raises(IOError):
+        MogData().readTLF(str(filename))
+
+
+def ramac_mog(basename, memmap=False, shuffle=False):
+    md = MogData(basename)
+    md.readRAMAC(os.path.join(TEST_DATA, 'formats', 'ramac', basename), memmap=memmap)
+    if shuffle:
+        # traces in random order, rdata being copied in memory
+        ind = np.random.RandomState(0).permutation(md.ntrace)
+        md.rdata = np.asarray(md.rdata)[:, ind]
+        for attr in ('Tx_x', 'Tx_y', 'Tx_z', 'Rx_x', 'Rx_y', 'Rx_z'):
+            setattr(md, attr, np.asarray(getattr(md, attr)).flatten()[ind])
+    mog = Mog(basename, md)
+    mog.tt = np.arange(md.ntrace, dtype=np.float64)  # original trace numbers
+    return mog
+
+
+def sort_by_Tx_loop(Tx_z):
+    # former Mog.sort_by_Tx, gathering traces of each Tx in original order
+    uTx_z = np.sort(np.unique(Tx_z))
+    ind = np.zeros((Tx_z.size,), dtype=np.int64)
+    start = 0
+    for n in np.arange(uTx_z.size):
+        nos = np.nonzero(uTx_z[n] == Tx_z)[0]
+        nfound = len(nos)
+        ind[start+np.arange(nfound)] = nos
+        start = start+nfound
+    return ind
+
+
+@pytest.mark.parametrize('memmap, shuffle', [(False, False), (True, False), (False, True)])
+def test_sort_by_Tx(memmap, shuffle):
+    mog = ramac_mog('t0102', memmap, shuffle)
+    Tx_z = np.asarray(mog.Tx_z_orig).flatten().copy()
+    Rx_z = np.asarray(mog.Rx_z_orig).flatten().copy()
+    rdata = np.asarray(mog.data.rdata).copy()
+    mog.sort_by_Tx()
+    ind = mog.tt.astype(np.int64)
+
+    # same gathers as the former sort, traces of a gather being sorted by Rx (stable)
+    np.testing.assert_array_equal(Tx_z[ind], Tx_z[sort_by_Tx_loop(Tx_z)])
+    np.testing.assert_array_equal(ind, sorted(range(ind.size), key=lambda i: (Tx_z[i], Rx_z[i])))
+    np.testing.assert_array_equal(mog.Rx_z_orig, Rx_z[ind])
+    np.testing.assert_array_equal(mog.data.Rx_z, Rx_z[ind])
+    np.testing.assert_array_equal(np.asarray(mog.data.rdata), rdata[:, ind])
+
+
+@pytest.mark.parametrize('memmap', [False, True])
+def test_sort_by_Tx_lazy(memmap):
+    eager = ramac_mog('t0102', memmap, shuffle=not memmap)
+    lazy = ramac_mog('t0102', memmap, shuffle=not memmap)
+    eager.sort_by_Tx()
+    lazy.sort_by_Tx(lazy=True)
+
+    assert isinstance(lazy.data.rdata, IndexedTraces)
+    assert lazy.data.rdata.shape == eager.data.rdata.shape
+    np.testing.assert_array_equal(lazy.traces, eager.traces)
+    np.testing.assert_array_equal(np.asarray(lazy.data.rdata), np.asarray(eager.data.rdata))
+    for key in ((slice(None), 5), (slice(10, 20), slice(3, 40, 7)), (slice(None), [8, 2, 5])):
+        np.testing.assert_array_equal(lazy.data.rdata[key], np.asarray(eager.data.rdata)[key])
+
+    # sorting again is a no-op, the index is composed
+    lazy.sort_by_Tx(lazy=True)
+    np.testing.assert_array_equal(np.asarray(lazy.data.rdata), np.asarray(eager.data.rdata))
+
+
+@pytest.mark.parametrize('sort', [False, True])
+def test_merge_mogs(sort):
+    mogs = [ramac_mog('t0102', memmap=True), ramac_mog('t0302'), ramac_mog('t0102b', shuffle=True)]
+    for n, mog in enumerate(mogs):
+        mog.et = n  # MOG of traces
+    eager = Mog.merge_mogs(mogs, 'eager', sort=sort)
+    virtual = Mog.merge_mogs(mogs, 'virtual', sort=sort, virtual=True)
+
+    # former merge: traces & coordinates concatenated MOG after MOG, then sorted by Tx
+    rdata = np.concatenate([np.asarray(mog.data.rdata) for mog in mogs], axis=1)
+    traces = np.concatenate([mog.traces for mog in mogs])
+    Tx_z = np.concatenate([np.asarray(mog.data.Tx_z).flatten() for mog in mogs])
+    ind = np.arange(Tx_z.size)
+    if sort:
+        ind = np.lexsort((traces['Rx_z_orig'], traces['Tx_z_orig']))
+        np.testing.assert_array_equal(Tx_z[ind], Tx_z[sort_by_Tx_loop(Tx_z)])
+
+    assert isinstance(virtual.data.rdata, IndexedTraces if sort else MergedTraces)
+    for new_mog in (eager, virtual):
+        assert new_mog.data.ntrace == rdata.shape[1]
+        assert new_mog.data.rdata.shape == rdata.shape
+        np.testing.assert_array_equal(new_mog.traces, traces[ind])
+        np.testing.assert_array_equal(new_mog.data.Tx_z, Tx_z[ind])
+        np.testing.assert_array_equal(np.asarray(new_mog.data.rdata), rdata[:, ind])
+    for key in ((slice(None), 700), (slice(5, 50), slice(400, 1400, 3)), (slice(None), [1500, 3, 900, 4])):
+        np.testing.assert_array_equal(virtual.data.rdata[key], rdata[:, ind][key])
+
+
+def test_trace_attributes():
+    mog = ramac_mog('t0102')
+    ntrace = mog.data.ntrace
+    assert np.shares_memory(mog.in_vect, mog.traces)  # views on Mog.traces
+    mog.in_vect[:10] = False
+    assert not mog.traces['in_vect'][:10].any()
+    mog.TxCosDir = [0.0, 0.0, 1.0]
+    np.testing.assert_array_equal(mog.traces['TxCosDir'], np.tile([0.0, 0.0, 1.0], (ntrace, 1)))
+
+    # a new number of traces rebinds the attribute, as former plain arrays did
+    mog.tt = -np.ones((1, 5))
+    assert mog.traces.size == 5
+    np.testing.assert_array_equal(mog.tt, -np.ones(5))
+    np.testing.assert_array_equal(mog.in_vect, np.ones(5, dtype=bool))
@@ -5,17 +5,19 @@ Created on Fri Aug  5 12:54:52 2016
 @author: giroux
 """
 
-from cutils import segy
+from cutils import read_segy
 
-filename = '/Users/giroux/CloudStation/Projets/Frio/donnees_brutes/pre-xwell-all.sgy'
+if __name__ == '__main__':
 
-d = segy.read_segy(filename, fields=['sx', 'sy', 'gx', 'gy', 'selev'])  # @UndefinedVariable
+    filename = '/Users/giroux/CloudStation/Projets/Frio/donnees_brutes/pre-xwell-all.sgy'
 
-for k in d.bh:
-    print(k, d.bh[k])
+    d = read_segy(filename, fields=['sx', 'sy', 'gx', 'gy', 'selev'])
 
-for k in d.th:
-    print(k, d.th[k][1])
+    for k in d.bh:
+        print(k, d.bh[k])
 
-print(d.data.shape)
-print(d.data[:50, 0])
+    for k in d.th:
+        print(k, d.th[k][1])
+
+    print(d.data.shape)
+    print(d.data[:50, 0])
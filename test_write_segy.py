@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Round trip of MOG data through cutils.write_segy and MogData.readSEGY
+
+Run with pytest from the root directory of BhTomoPy
+"""
+import os
+
+import numpy as np
+import pytest
+
+from cutils import npsegy, write_segy
+from mog import MogData
+
+TEST_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'testData')
+
+
+@pytest.fixture
+def ramac():
+    md = MogData('t0102')
+    md.readRAMAC(os.path.join(TEST_DATA, 'formats', 'ramac', 't0102'))
+    return md
+
+
+def test_round_trip(ramac, tmp_path):
+    filename = str(tmp_path / 't0102.sgy')
+    write_segy(filename, ramac, block=100)
+
+    md = MogData()
+    md.readSEGY(filename)
+    assert (md.nptsptrc, md.ntrace) == (ramac.nptsptrc, ramac.ntrace)
+    assert md.tunits == ramac.tunits
+    assert md.cunits == ramac.cunits
+    assert md.timec == pytest.approx(ramac.timec, rel=1e-12)
+    np.testing.assert_allclose(md.timestp, ramac.timestp)
+    np.testing.assert_array_equal(md.rdata, np.asarray(ramac.rdata, dtype=np.float32))
+    for attr in ('Tx_x', 'Tx_y', 'Tx_z', 'Rx_x', 'Rx_y', 'Rx_z'):
+        np.testing.assert_allclose(getattr(md, attr), np.asarray(getattr(ramac, attr)).flatten(),
+                                   rtol=0, atol=1e-3, err_msg=attr)
+
+
+def test_round_trip_readers(ramac, tmp_path):
+    segy = pytest.importorskip('cutils.segy')
+    filename = str(tmp_path / 't0102.sgy')
+    write_segy(filename, ramac)
+
+    fields = ['sx', 'sy', 'selev', 'gx', 'gy', 'gelev', 'scalco', 'scalel', 'dt', 'ns']
+    s1 = npsegy.read_segy(filename, fields=fields)
+    s2 = segy.read_segy(filename, fields=fields)
+    np.testing.assert_array_equal(s1.data, s2.data)
+    for f in fields:
+        np.testing.assert_array_equal(s1.th[f], s2.th[f], err_msg=f)
+
+
+@pytest.mark.parametrize('backend', ['cutils.npsegy', 'cutils.segy'])
+def test_segy_index(ramac, tmp_path, backend):
+    segy = pytest.importorskip(backend)
+    filename = str(tmp_path / 't0102.sgy')
+    write_segy(filename, ramac)
+
+    ind = segy.load_segy_index(filename)
+    assert os.path.isfile(filename + '.idx.npz')
+    assert len(ind) == ramac.ntrace
+    Tx_z = np.asarray(ramac.Tx_z).flatten()
+    Rx_z = np.asarray(ramac.Rx_z).flatten()
+    np.testing.assert_allclose(ind.traces['selev'], Tx_z, rtol=0, atol=1e-3)
+    np.testing.assert_allclose(ind.traces['gelev'], Rx_z, rtol=0, atol=1e-3)
+
+    # the sidecar is read back as long as the SEG-Y file is unchanged
+    ind2 = segy.load_segy_index(filename)
+    np.testing.assert_array_equal(ind2.traces, ind.traces)
+
+    traceNo = ind.select(selev=(Tx_z[100] - 1e-3, Tx_z[100] + 1e-3), gelev=(None, 5.0))
+    selev, gelev = ind.traces['selev'], ind.traces['gelev']
+    expected = np.nonzero((selev >= Tx_z[100] - 1e-3) & (selev <= Tx_z[100] + 1e-3) & (gelev <= 5.0))[0]
+    assert 0 < expected.size < 100
+    np.testing.assert_array_equal(traceNo, expected)
+    s = ind.read(fields=['selev'], selev=(Tx_z[100] - 1e-3, Tx_z[100] + 1e-3), gelev=(None, 5.0))
+    np.testing.assert_array_equal(s.data, np.asarray(ramac.rdata, dtype=np.float32)[:, expected])
+
+
+@pytest.mark.parametrize('backend', ['cutils.npsegy', 'cutils.segy'])
+def test_iter_segy(ramac, tmp_path, backend):
+    segy = pytest.importorskip(backend)
+    filename = str(tmp_path / 't0102.sgy')
+    write_segy(filename, ramac)
+
+    fields = ['selev', 'gelev', 'scalel']
+    ref = npsegy.read_segy(filename, fields=fields)
+    data = []
+    th = {name: [] for name in fields}
+    for block_th, block_data in segy.iter_segy(filename, block=300, fields=fields):
+        assert block_data.shape[0] == ramac.nptsptrc and 0 < block_data.shape[1] <= 300
+        data.append(block_data.copy())
+        for name in fields:
+            th[name].append(block_th[name])
+    np.testing.assert_array_equal(np.concatenate(data, axis=1), ref.data)
+    for name in fields:
+        np.testing.assert_array_equal(np.concatenate(th[name]), ref.th[name], err_msg=name)
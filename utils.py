@@ -89,21 +89,35 @@ def detrend_rad(traces):
     return traces
 
 
-def compute_SNR(mog):
-    SNR = np.ones(mog.data.ntrace)
-
-    max_amps = np.amax(np.abs(detrend_rad(mog.data.rdata)))
-    i = np.nonzero(np.abs(detrend_rad(mog.data.rdata)) == max_amps)[0]
-
-    width = 60
-
-    i1 = i - width / 2
-    i2 = i + width / 2
-    i1[i1 < 1] = 1
-    i2[i2 > mog.data.nptsptrc] = mog.data.nptsptrc
+def compute_SNR(mog, width=60, block=1024):
+    """
+    Signal to noise ratio of the traces of mog: standard deviation of the
+    samples in a window of width samples around the maximum amplitude,
+    divided by the standard deviation of the first width samples
 
-    for n in range(mog.data.ntrace):
-        SNR[n] = np.std(mog.data.rdata[i1[n]:i2[n], n]) / np.std(mog.data.rdata[:width, n])
+    Traces are read block traces at a time, rdata may be memory mapped
+    """
+    rdata = mog.data.rdata
+    npts, ntrace = rdata.shape
+    SNR = np.ones(ntrace)
+    k = np.arange(npts).reshape(-1, 1)
+
+    for start in range(0, ntrace, block):
+        stop = min(start + block, ntrace)
+        traces = detrend_rad(np.asarray(rdata[:, start:stop], dtype=np.float64))
+
+        i = np.argmax(np.abs(traces), axis=0)
+        i1 = np.maximum(i - width // 2, 0)
+        i2 = np.minimum(i + width // 2, npts)
+        window = np.logical_and(k >= i1, k < i2)
+
+        # std over the window, computed with the counts of the masks
+        n = window.sum(axis=0)
+        mean = np.where(window, traces, 0.0).sum(axis=0) / n
+        signal = np.sqrt(np.where(window, (traces - mean)**2, 0.0).sum(axis=0) / n)
+        noise = np.std(traces[:width, :], axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            SNR[start:stop] = signal / noise
 
     return SNR
 